@@ -1,189 +1,273 @@
-import os
-import requests
-from bs4 import BeautifulSoup
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from functools import lru_cache
 import logging
 import threading
 import time
-import re
-import traceback
-import shelve
-import hashlib
+import queue
+import os
 import json
 import pickle
-import multiprocessing
 
 # Import the AutocompleteCombobox class
 from ttkwidgets.autocomplete import AutocompleteCombobox
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
-@lru_cache(maxsize=32)
-def fetch_file_data(item_url, file_types):
-    result = []
-    try:
-        response = requests.get(item_url)
-        item_soup = BeautifulSoup(response.content, 'html.parser')
-        file_links = set()
-        for file_type in file_types:
-            download_links = item_soup.select(f'a.download-pill[href$=".{file_type}"]')
-            for link in download_links:
-                download_url = f"https://archive.org{link['href']}"
-                if download_url not in file_links:
-                    file_links.add(download_url)
-                    file_name = os.path.basename(download_url)
-                    file_size = get_file_size(link, item_soup)
-                    book_name = get_book_name(item_soup)
-                    description = get_book_description(item_soup)
-                    result.append((file_name, book_name, download_url, file_size, description))
-    except Exception as e:
-        logging.error(f"Error fetching data for {item_url}: {e}")
-    return result
-
-def get_file_size(link, soup):
-    # Try to get size from data-original-title
-    size = link.get('data-original-title')
-    if size:
-        return size
-
-    # Try to get size from title attribute
-    size = link.get('title')
-    if size:
-        return size
-
-    # Try to find size in the page content
-    size_elem = soup.select_one('.item-stats .size')
-    if size_elem:
-        return size_elem.text.strip()
-
-    return 'Unknown'
+# Downloads and exports are imported when first used (requests, pyarrow); the
+# engine itself only loads its HTTP and parsing stacks once a search starts
+from engine import DEFAULT_ROWS, Harvester, common_file_types, format_size, set_item_cache
+from item_cache import ItemCache
+from jobs import JobJournal
+from logqueue import configure_logging
+import metrics
+import ratelimit
+from result_model import ResultModel
+from result_store import ResultStore
+from selection import SelectionPolicy
 
-def get_book_name(item_soup):
-    title_tag = item_soup.find('h1', class_='item-title')
-    return title_tag.text.strip() if title_tag else "Unknown"
+# Configure logging; records are written from a background thread
+configure_logging(logging.DEBUG)
 
-def get_book_description(item_soup):
-    description_elem = item_soup.select_one('div[itemprop="description"]')
-    return description_elem.text.strip() if description_elem else "No description available."
+# Set ARCHIVE_ORG_PROFILE to a .prof (cProfile) or .html (pyinstrument) path to profile each search
+PROFILE_PATH = os.environ.get('ARCHIVE_ORG_PROFILE')
 
 # Global variables
-all_items = []
+results = ResultModel()
 fetch_thread = None
 search_history = []
-common_file_types = ['pdf', 'epub', 'mobi', 'txt', 'doc', 'docx', 'rtf', 'djvu']
 
-class SearchCache:
-    def __init__(self, cache_file='search_cache'):
-        self.cache_file = cache_file
-
-    def get_cache_key(self, search_params, file_types):
-        key_data = json.dumps({**search_params, 'file_types': file_types}, sort_keys=True).encode('utf-8')
-        return hashlib.md5(key_data).hexdigest()
-
-    def get(self, search_params, file_types):
-        key = self.get_cache_key(search_params, file_types)
-        with shelve.open(self.cache_file) as cache:
-            if key in cache:
-                return cache[key]['data']
-        return None
-
-    def set(self, search_params, file_types, data):
-        key = self.get_cache_key(search_params, file_types)
-        with shelve.open(self.cache_file) as cache:
-            cache[key] = {'data': data}
-
-search_cache = SearchCache()
-
-class LazyTreeview(ttk.Treeview):
-    def __init__(self, master, **kw):
+result_store = ResultStore()
+job_journal = JobJournal()
+# Interrupted searches kept for Resume; finished ones are dropped as they complete
+GUI_JOBS_KEPT = 5
+
+# Worker threads never touch Tk; they post here and the main loop applies the updates in batches
+UI_REFRESH_MS = 100
+MAX_ROWS_PER_TICK = 5000
+ui_queue = queue.Queue()
+
+# Sort state: (tree column, reverse) pairs, most significant first
+SORT_FIELDS = {"name": "file_name", "book_name": "book_name", "size": "file_size", "url": "download_url"}
+HEADINGS = {"name": "File Name", "book_name": "Book Name", "size": "Size", "url": "URL"}
+VIEW_UPDATE_INTERVAL = 1.0
+FILTER_DELAY_MS = 150
+sort_columns = []
+filter_text = ""
+filter_job = None
+last_view_update = 0.0
+view_stale = False
+
+# Exports started while results are still arriving
+live_exporters = []
+loading_cache = False
+
+def add_results(records):
+    global view_stale
+    start = len(results)
+    results.extend(records)
+    for exporter in live_exporters:
+        exporter.add_many(results.records(range(start, len(results))))
+    if not (sort_columns or filter_text):
+        file_tree.refresh()
+        return
+    # Sorted or filtered views are rebuilt at most once a second while results stream in
+    view_stale = True
+    if not filter_text and file_tree.rows is not None:
+        # Until then new rows go at the end, so they show up straight away
+        file_tree.rows.extend(range(start, len(results)))
+        file_tree.refresh()
+
+def post_file(source, record):
+    ui_queue.put((source, record, None))
+
+def post_status(text=None, size=None, progress=None):
+    ui_queue.put((None, None, (text, size, progress)))
+
+def drain_ui_queue():
+    records = []
+    status = [None, None, None]
+    while len(records) < MAX_ROWS_PER_TICK:
+        try:
+            source, record, update = ui_queue.get_nowait()
+        except queue.Empty:
+            break
+        if record is not None:
+            # Rows from a search that was cancelled or replaced are dropped
+            if source is fetch_thread:
+                records.append(record)
+        else:
+            # Only the latest value of each status field is shown
+            status = [new if new is not None else old for old, new in zip(status, update)]
+    if records:
+        add_results(records)
+    text, size, progress = status
+    if text is not None:
+        status_label.config(text=text)
+    if size is not None:
+        total_size_label.config(text=size)
+    if progress is not None:
+        progress_bar["value"] = progress
+    if harvest_running():
+        limits_label.config(text=ratelimit.summary())
+    if view_stale and time.monotonic() - last_view_update > VIEW_UPDATE_INTERVAL:
+        apply_view(keep_position=True)
+    if live_exporters and not harvest_running() and ui_queue.empty():
+        close_live_exporters()
+        status_label.config(text="Export complete.")
+    window.after(UI_REFRESH_MS, drain_ui_queue)
+
+class VirtualTreeview(ttk.Treeview):
+    """Treeview over a ``ResultModel`` that only holds Tk items for the rows on screen.
+
+    ``rows`` lists the model rows in display order; scrolling re-fills the same
+    handful of items instead of creating one per result. Selection is kept as
+    model rows, so it survives scrolling.
+    """
+
+    def __init__(self, master, model, **kw):
         ttk.Treeview.__init__(self, master, **kw)
-        self._items = []
-        self.bind("<<TreeviewOpen>>", self._on_open)
-
-    def set_items(self, items):
-        self._items = items
-        self.delete(*self.get_children())
-        if len(items) > 0:
-            self.insert("", "end", "dummy")
-
-    def _on_open(self, event):
-        self.delete("dummy")
-        for i, item in enumerate(self._items):
-            self.insert("", "end", values=item[:4], iid=str(i))
+        self.model = model
+        self.rows = None
+        self.first = 0
+        self.visible = 1
+        self.selected = set()
+        self.scrollbar = None
+        self.row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        self.bind("<Configure>", self._on_resize)
+        self.bind("<<TreeviewSelect>>", self._on_select)
+        self.bind("<MouseWheel>", lambda event: self.yview("scroll", -event.delta // 120, "units"))
+        self.bind("<Button-4>", lambda event: self.yview("scroll", -3, "units"))
+        self.bind("<Button-5>", lambda event: self.yview("scroll", 3, "units"))
+        self.bind("<Prior>", lambda event: self.yview("scroll", -1, "pages"))
+        self.bind("<Next>", lambda event: self.yview("scroll", 1, "pages"))
+
+    def set_scrollbar(self, scrollbar):
+        self.scrollbar = scrollbar
+        scrollbar.configure(command=self.yview)
+
+    def set_rows(self, rows, keep_position=False):
+        self.rows = rows
+        if not keep_position:
+            self.first = 0
+        self.refresh()
+
+    def row_count(self):
+        return len(self.model) if self.rows is None else len(self.rows)
+
+    def model_row(self, position):
+        return position if self.rows is None else self.rows[position]
+
+    def clear(self):
+        self.rows = None
+        self.first = 0
+        self.selected.clear()
+        self.refresh()
+
+    def refresh(self):
+        count = self.row_count()
+        self.first = max(0, min(self.first, count - self.visible))
+        shown = min(self.visible, count - self.first)
+        items = self.get_children()
+        if len(items) > shown:
+            self.delete(*items[shown:])
+        for i in range(len(items), shown):
+            self.insert("", "end", iid=str(i))
+        selection = []
+        for i in range(shown):
+            row = self.model_row(self.first + i)
+            self.item(str(i), values=self.model.display_values(row))
+            if row in self.selected:
+                selection.append(str(i))
+        self.selection_set(selection)
+        if self.scrollbar:
+            if count:
+                self.scrollbar.set(self.first / count, (self.first + shown) / count)
+            else:
+                self.scrollbar.set(0, 1)
+
+    def yview(self, *args):
+        if not args:
+            count = max(self.row_count(), 1)
+            return self.first / count, min(self.first + self.visible, count) / count
+        if args[0] == "moveto":
+            self.first = int(float(args[1]) * self.row_count())
+        elif args[0] == "scroll":
+            step = self.visible if args[2] == "pages" else 1
+            self.first += int(args[1]) * step
+        self.refresh()
+        return "break"
+
+    def selected_rows(self):
+        return sorted(self.selected)
+
+    def row_at(self, item):
+        return self.model_row(self.first + int(item))
+
+    def _on_resize(self, event):
+        # One row's worth of height goes to the headings
+        visible = max(1, event.height // self.row_height - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.refresh()
+
+    def _on_select(self, event):
+        shown = {self.model_row(self.first + int(item)) for item in self.get_children()}
+        self.selected -= shown
+        self.selected.update(self.row_at(item) for item in self.selection())
 
 class FetchFilesThread(threading.Thread):
-    def __init__(self, base_url, file_types, search_params):
+    def __init__(self, file_types, search_params, writer=None, append=False, job=None, selection=None):
         threading.Thread.__init__(self)
-        self.base_url = base_url
-        self.file_types = file_types
-        self.search_params = search_params
-        self.total_files = 0
-        self.total_size = 0
-        self.is_paused = False
-        self.is_cancelled = False
-        self.total_available_files = 0
-        self.progress = 0
-        self.page = 1
+        options = job_journal.harvester_options(job) if job else {'selection': selection}
+        self.harvester = Harvester(search_params, file_types, on_file=self.add_file, on_status=self.update_status, **options)
+        self.writer = writer
+        self.append = append
+        self.job = job
 
     def run(self):
-        global all_items
-        all_items = []
-        
-        while self.total_files < self.total_available_files or self.total_available_files == 0:
-            if self.is_cancelled:
-                break
-            
-            url = f"{self.base_url}&page={self.page}"
-            response = requests.get(url)
-            data = response.json()
-            
-            if "response" in data and "docs" in data["response"]:
-                docs = data["response"]["docs"]
-                self.total_available_files = int(data["response"]["numFound"])
-                self.update_status()
-                
-                if not docs:  # If we've reached a page with no results, break the loop
-                    break
-                
-                with ThreadPoolExecutor(max_workers=10) as executor:
-                    item_futures = []
-                    for doc in docs:
-                        identifier = doc["identifier"]
-                        item_url = f"https://archive.org/details/{identifier}"
-                        item_futures.append(executor.submit(fetch_file_data, item_url, tuple(self.file_types)))
-                    
-                    for item_future in as_completed(item_futures):
-                        if self.is_cancelled:
-                            break
-                        while self.is_paused:
-                            time.sleep(0.1)
-                        result = item_future.result()
-                        for file_name, book_name, file_url, file_size, description in result:
-                            parsed_size = parse_size(file_size)
-                            formatted_size = format_size(parsed_size)
-                            self.total_files += 1
-                            self.total_size += parsed_size
-                            self.progress = min((self.total_files / self.total_available_files) * 100, 100)
-                            item_id = file_tree.insert("", "end", values=(file_name, book_name, formatted_size, file_url))
-                            all_items.append((file_name, book_name, formatted_size, file_url, description, item_id))
-                            self.update_status()
-            
-            self.page += 1  # Move to the next page
-
-        if not self.is_cancelled:
-            status_label.config(text=f"Fetching complete. Found {self.total_files} files out of {self.total_available_files}")
-            total_size_label.config(text=f"Total size: {format_size(self.total_size)}")
-        progress_bar["value"] = 100
-        window.update()
-
-    def update_status(self):
-        status_label.config(text=f"Found {self.total_files} files out of {self.total_available_files}")
-        total_size_label.config(text=f"Total size: {format_size(self.total_size)}")
-        progress_bar["value"] = self.progress
+        run_started = time.time()
+        if PROFILE_PATH:
+            metrics.run_profiled(self.harvester.run, PROFILE_PATH)
+        else:
+            self.harvester.run()
+        harvester = self.harvester
+        unfinished = harvester.failed_items or harvester.search_failed
+        if self.writer:
+            # Items that failed to resolve, or pages after a failed one, are missing, so the stored
+            # search can't be served as complete
+            self.writer.close(complete=not (harvester.is_cancelled or unfinished), run_started=run_started)
+        if self.job:
+            if harvester.is_cancelled:
+                job_journal.set_state(self.job.id, 'interrupted')
+            elif unfinished:
+                # Resume carries on from the last page whose items all resolved
+                job_journal.set_state(self.job.id, 'incomplete')
+            else:
+                # The result store keeps what was found; a finished job has nothing left to resume
+                job_journal.delete(self.job.id)
+
+        if not harvester.is_cancelled:
+            failed = f", {len(harvester.failed_items)} items failed" if harvester.failed_items else ""
+            if harvester.search_failed:
+                failed += ", the search failed part way"
+            if unfinished:
+                failed += " (resume to retry)"
+            post_status(f"Fetching complete. Found {harvester.total_files} files out of "
+                        f"{harvester.total_available_files}{failed}", total_size_text(harvester), 100)
+
+    def add_file(self, record):
+        if self.writer:
+            self.writer.add(record)
+        post_file(self, record)
+
+    def update_status(self, harvester):
+        failed = f" ({len(harvester.failed_items)} items failed, resume to retry)" if harvester.failed_items else ""
+        post_status(f"Found {harvester.total_files} files out of {harvester.total_available_files}{failed}",
+                    total_size_text(harvester), harvester.progress)
+
+def total_size_text(harvester):
+    text = f"Total size: {format_size(harvester.total_size)}"
+    if harvester.deselected_files:
+        text += f" ({harvester.deselected_files} other formats left out, {format_size(harvester.avoided_size)} saved)"
+    return text
 
 def create_icon():
     icon = tk.PhotoImage(width=64, height=64)
@@ -193,32 +277,7 @@ def create_icon():
     icon.put(("black",), to=(25, 25, 39, 39))  # Black center
     return icon
 
-def show_splash_screen():
-    splash = tk.Toplevel()
-    splash.overrideredirect(True)
-    icon = create_icon()
-    icon = icon.zoom(5)  # Make the icon larger for the splash screen
-    label = tk.Label(splash, image=icon, bg='#001100')
-    label.image = icon  # Keep a reference to prevent garbage collection
-    label.pack()
-    splash.geometry(f"320x320+{(splash.winfo_screenwidth()-320)//2}+{(splash.winfo_screenheight()-320)//2}")
-    splash.after(3000, splash.destroy)
-    return splash
-
-def build_advanced_query(**kwargs):
-    query_parts = []
-    if kwargs.get('language'):
-        query_parts.append(f"language:{kwargs['language']}")
-    if kwargs.get('start_year') and kwargs.get('end_year'):
-        query_parts.append(f"year:[{kwargs['start_year']} TO {kwargs['end_year']}]")
-    if kwargs.get('keyword'):
-        query_parts.append(f"title:{kwargs['keyword']}")
-    if kwargs.get('author'):
-        query_parts.append(f"creator:{kwargs['author']}")
-    return " AND ".join(query_parts)
-
-def perform_search():
-    global fetch_thread
+def get_search_form():
     search_params = {
         'language': language_entry.get().strip(),
         'start_year': start_year_entry.get().strip(),
@@ -227,42 +286,90 @@ def perform_search():
         'author': author_entry.get().strip()
     }
     file_types = [ft.strip() for ft in file_type_entry.get().split(',') if ft.strip()]
+    # Remove empty parameters
+    return {k: v for k, v in search_params.items() if v}, file_types
+
+def get_selection(file_types):
+    # With "Best format only" the file types, in the order given, are the preference list
+    return SelectionPolicy(prefer=file_types) if best_format_var.get() and len(file_types) > 1 else None
+
+def perform_search():
+    search_params, file_types = get_search_form()
     
     # Add to search history
     search_history.append({**search_params, 'file_types': file_types})
     if len(search_history) > 10:
         search_history.pop(0)
     
-    # Check cache
-    cached_results = search_cache.get(search_params, file_types)
-    if cached_results:
-        display_cached_results(cached_results)
-        return
-
     logging.debug(f"Search params: {search_params}")
     logging.debug(f"File types: {file_types}")
     
-    # Remove empty parameters
-    search_params = {k: v for k, v in search_params.items() if v}
-    
     if not search_params:
         messagebox.showerror("Error", "Please provide at least one search parameter.")
         return
     
-    query = build_advanced_query(**search_params)
-    logging.debug(f"Built query: {query}")
-    
-    base_url = f"https://archive.org/advancedsearch.php?q={query}&fl[]=identifier&fl[]=title&fl[]=creator&fl[]=year&fl[]=subject&fl[]=description&sort[]=downloads+desc&rows=100&output=json"
-    logging.debug(f"Base Search URL: {base_url}")
-    
-    # Clear existing results
-    file_tree.delete(*file_tree.get_children())
+    # Check the result store
+    selection = get_selection(file_types)
+    entry = result_store.lookup(search_params, file_types, selection)
+    if entry and entry.complete:
+        display_cached_results(entry)
+        return
+
+    start_fetch(search_params, file_types, result_store.writer(result_store.begin(search_params, file_types,
+                                                                                  selection=selection)),
+                selection=selection)
+
+def refresh_search():
+    search_params, file_types = get_search_form()
+    selection = get_selection(file_types)
+    entry = result_store.lookup(search_params, file_types, selection)
+    if not entry or not entry.complete:
+        perform_search()
+        return
+    # Only items added since the last run are fetched; they are appended to what is shown
+    writer = result_store.writer(result_store.begin(search_params, file_types, incremental=True, selection=selection))
+    start_fetch(result_store.refresh_params(entry), file_types, writer, append=True, selection=selection)
+
+def resume_search():
+    job = job_journal.latest_unfinished()
+    if job is None:
+        messagebox.showinfo("Resume", "There is no interrupted search to resume.")
+        return
+    for entry, field in ((language_entry, 'language'), (start_year_entry, 'start_year'), (end_year_entry, 'end_year'),
+                         (keyword_entry, 'keyword'), (author_entry, 'author')):
+        entry.delete(0, tk.END)
+        entry.insert(0, job.search_params.get(field, ''))
+    selection = SelectionPolicy.from_spec(job.options.get('selection'))
+    file_type_entry.set(', '.join(job.file_types))
+    best_format_var.set(bool(selection))
+    # Show what the earlier run found, then carry on from its last checkpoint
+    results.clear()
+    file_tree.clear()
+    add_results(list(job_journal.iter_files(job.id)))
+    writer = result_store.writer(result_store.begin(job.search_params, job.file_types, incremental=True,
+                                                    selection=selection))
+    start_fetch(job.search_params, job.file_types, writer, append=True, job=job)
+
+def start_fetch(search_params, file_types, writer, append=False, job=None, selection=None):
+    global fetch_thread
+    if job is None:
+        options = {'origin': 'gui', 'rows': DEFAULT_ROWS, 'prefilter': True}
+        if selection:
+            options['selection'] = selection.spec()
+        job = job_journal.get(job_journal.create(search_params, file_types, options))
+        # Only the latest few interrupted searches stay resumable
+        job_journal.prune('gui', GUI_JOBS_KEPT)
+    if not append:
+        # Clear existing results
+        results.clear()
+        file_tree.clear()
+        total_size_label.config(text="Total size: 0 B")
     status_label.config(text="Searching...")
-    total_size_label.config(text="Total size: 0 B")
     progress_bar["value"] = 0
     
     # Start a new thread to fetch results
-    fetch_thread = FetchFilesThread(base_url, file_types, search_params)
+    fetch_thread = FetchFilesThread(file_types, search_params, writer, append, job, selection)
+    logging.debug(f"Base Search URL: {fetch_thread.harvester.base_url}")
     fetch_thread.start()
 
     # Enable pause button and disable search button
@@ -271,27 +378,39 @@ def perform_search():
     
     logging.debug("Search initiated successfully")
 
-def display_cached_results(results):
-    global all_items
-    all_items = results
-    file_tree.delete(*file_tree.get_children())
-    total_size = 0
-    for item in all_items:
-        file_tree.insert("", "end", iid=item[-1], values=item[:4])  # Exclude description from display
-        total_size += parse_size(item[2])
-    status_label.config(text=f"Loaded {len(results)} files from cache")
-    total_size_label.config(text=f"Total size: {format_size(total_size)}")
-    progress_bar["value"] = 100
+def display_cached_results(entry):
+    global loading_cache
+    loading_cache = True
+    results.clear()
+    file_tree.clear()
+    batches = result_store.iter_records(entry.key, batch_size=10000)
+
+    # One batch per event loop turn, so large cached searches stream in without freezing the window
+    def insert_next_batch():
+        global loading_cache
+        batch = next(batches, None)
+        if batch is None:
+            loading_cache = False
+            status_label.config(text=f"Loaded {len(results)} files from cache")
+            progress_bar["value"] = 100
+            return
+        add_results(batch)
+        status_label.config(text=f"Loading {len(results)} of {entry.count} files from cache...")
+        total_size_label.config(text=f"Total size: {format_size(results.total_size)}")
+        progress_bar["value"] = len(results) / max(entry.count, 1) * 100
+        window.after(1, insert_next_batch)
+
+    insert_next_batch()
 
 def pause_resume_fetch():
     global fetch_thread
     if fetch_thread and fetch_thread.is_alive():
-        if fetch_thread.is_paused:
-            fetch_thread.is_paused = False
+        if fetch_thread.harvester.is_paused:
+            fetch_thread.harvester.is_paused = False
             pause_button.config(text="Pause")
             status_label.config(text="Resuming...")
         else:
-            fetch_thread.is_paused = True
+            fetch_thread.harvester.is_paused = True
             pause_button.config(text="Resume")
             status_label.config(text="Paused")
     window.update()
@@ -303,12 +422,13 @@ def confirm_cancel():
 def cancel_fetch():
     global fetch_thread
     if fetch_thread and fetch_thread.is_alive():
-        fetch_thread.is_cancelled = True
+        fetch_thread.harvester.is_cancelled = True
         status_label.config(text="Cancelling...")
         window.update()
         fetch_thread.join(timeout=5)  # Wait for up to 5 seconds
         if fetch_thread.is_alive():
             logging.warning("Thread did not terminate within timeout.")
+    close_live_exporters()
     clear_gui()
     search_button.config(state=tk.NORMAL)
     pause_button.config(state=tk.DISABLED)
@@ -321,70 +441,35 @@ def handle_download_error(file_name, error):
     if retry:
         download_selected_files_thread()
 
-def parse_size(size_str):
-    if not size_str or size_str.lower() == 'unknown':
-        return 0
-    size_str = size_str.replace(',', '').strip()
-    match = re.match(r"([\d.]+)\s*([KMGT]?B?)", size_str, re.I)
-    if not match:
-        return 0
-    size, unit = match.groups()
-    size = float(size)
-    unit = unit.upper() if unit else 'B'
-    units = {'B': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
-    return int(size * units.get(unit[:1], 1))
-
-def format_size(size):
-    for unit in ["B", "KB", "MB", "GB", "TB"]:
-        if size < 1024.0:
-            return f"{size:.2f} {unit}"
-        size /= 1024.0
-
 def download_selected_files():
     thread = threading.Thread(target=download_selected_files_thread)
     thread.start()
 
 def download_selected_files_thread():
-    selected_items = file_tree.selection()
+    selected_rows = file_tree.selected_rows()
     download_dir = download_dir_entry.get()
 
     if not download_dir:
         messagebox.showerror("Error", "Please select a download directory.")
         return
 
-    total_files = len(selected_items)
-    downloaded_files = 0
-
-    for item in selected_items:
-        download_url = file_tree.item(item, "values")[3]
-        file_name = file_tree.item(item, "values")[0]
-        file_path = os.path.join(download_dir, file_name)
+    from manifest import sync_files
 
-        try:
-            status_label.config(text=f"Downloading: {file_name} ({downloaded_files+1}/{total_files})")
-            progress_bar["value"] = (downloaded_files / total_files) * 100
-            window.update()
-
-            response = requests.get(download_url, stream=True)
-            
-            if response.status_code == 200:
-                with open(file_path, "wb") as file:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        file.write(chunk)
-            else:
-                status_label.config(text=f"Skipping: {file_name} (status code: {response.status_code})")
-                window.update()
-                continue
-            
-            downloaded_files += 1
-            window.update()
-        except Exception as e:
-            status_label.config(text=f"Error downloading: {file_name}")
-            window.update()
+    def on_progress(event, file_name, done, total):
+        if event == "start":
+            post_status(f"Downloading: {file_name} ({done+1}/{total})", progress=(done / total) * 100)
+        elif event == "skipped":
+            post_status(f"Skipping: {file_name}")
+        elif event == "error":
+            post_status(f"Error downloading: {file_name}")
 
-    status_label.config(text="Download complete.")
-    progress_bar["value"] = 100
-    window.update()
+    # Files the directory's manifest already holds in this version aren't fetched again, unless
+    # they were deleted or altered on disk since
+    summary = sync_files(download_dir, list(results.records(selected_rows)), check_local=True,
+                         on_progress=on_progress)
+    failed = f", {summary['failed']} failed" if summary['failed'] else ""
+    post_status(f"Download complete: {summary['added']} new, {summary['changed']} updated, "
+                f"{summary['unchanged']} already up to date{failed}.", progress=100)
 
 def select_download_dir():
     download_dir = filedialog.askdirectory()
@@ -392,61 +477,60 @@ def select_download_dir():
     download_dir_entry.insert(0, download_dir)
 
 def clear_gui():
-    file_tree.delete(*file_tree.get_children())
+    results.clear()
+    file_tree.clear()
     status_label.config(text="")
     total_size_label.config(text="")
     progress_bar["value"] = 0
 
 def export_results():
-    if not all_items:
+    if not len(results) and not harvest_running():
         show_error("Export Error", "No results to export.")
         return
     
-    file_types = [("Text files", "*.txt"), ("CSV files", "*.csv"), ("JSON files", "*.json")]
-    file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=file_types)
+    file_types = [("JSON Lines", "*.jsonl"), ("CSV files", "*.csv"), ("Parquet files", "*.parquet"),
+                  ("Arrow streams", "*.arrow"), ("Text files", "*.txt"), ("JSON files", "*.json")]
+    file_path = filedialog.asksaveasfilename(defaultextension=".jsonl", filetypes=file_types)
     if not file_path:
         return
     
     try:
-        if file_path.endswith('.txt'):
-            export_as_txt(file_path)
-        elif file_path.endswith('.csv'):
-            export_as_csv(file_path)
-        elif file_path.endswith('.json'):
-            export_as_json(file_path)
-        messagebox.showinfo("Export Successful", f"Results exported to {file_path}")
+        if os.path.exists(file_path):
+            # The dialog already confirmed overwriting; the text exporters would otherwise append
+            os.remove(file_path)
+        from exporters import open_exporter
+
+        exporter = open_exporter(file_path)
+        exporter.add_many(results.records())
+        if harvest_running():
+            # Results still coming in are appended as they arrive, until the search ends
+            live_exporters.append(exporter)
+            messagebox.showinfo("Export Started", f"Exporting to {file_path}; new results are added until the search finishes.")
+        else:
+            exporter.close()
+            messagebox.showinfo("Export Successful", f"Results exported to {file_path}")
     except Exception as e:
         show_error("Export Error", f"Failed to export results: {str(e)}")
 
-def export_as_txt(file_path):
-    with open(file_path, 'w', encoding='utf-8') as f:
-        for item in all_items:
-            f.write(f"File Name: {item[0]}\n")
-            f.write(f"Book Name: {item[1]}\n")
-            f.write(f"Size: {item[2]}\n")
-            f.write(f"URL: {item[3]}\n")
-            f.write(f"Description: {item[4]}\n")
-            f.write("\n---\n\n")
-
-def export_as_csv(file_path):
-    with open(file_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['File Name', 'Book Name', 'Size', 'URL', 'Description'])
-        for item in all_items:
-            writer.writerow(item[:5])  # Exclude the item_id
-
-def export_as_json(file_path):
-    data = [{'File Name': item[0], 'Book Name': item[1], 'Size': item[2], 'URL': item[3], 'Description': item[4]} for item in all_items]
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def harvest_running():
+    return (fetch_thread is not None and fetch_thread.is_alive()) or loading_cache
+
+def close_live_exporters():
+    while live_exporters:
+        exporter = live_exporters.pop()
+        try:
+            exporter.close()
+        except Exception as e:
+            logging.error(f"Error closing export {exporter.path}: {e}")
 
 def show_error(title, message):
     messagebox.showerror(title, message)
 
 def show_detailed_view(event):
     selected_item = file_tree.selection()[0]
-    item_data = file_tree.item(selected_item)['values']
-    description = next((item[4] for item in all_items if item[:4] == item_data), "No description available.")
+    row = file_tree.row_at(selected_item)
+    item_data = results.display_values(row)
+    description = results.record(row).description or "No description available."
     
     detail_window = tk.Toplevel(window)
     detail_window.title("Item Details")
@@ -479,12 +563,20 @@ def save_search_history():
         pickle.dump(search_history, f)
 
 def load_search_history():
-    global search_history
     try:
         with open('search_history.pkl', 'rb') as f:
-            search_history = pickle.load(f)
+            saved = pickle.load(f)
     except FileNotFoundError:
-        search_history = []
+        return
+    # Searches made while this was loading are the most recent ones
+    search_history[:0] = saved
+    del search_history[:-10]
+
+def load_in_background():
+    # Neither is needed to show the window; a search started before they're loaded just runs without them
+    load_search_history()
+    # Item listings survive restarts, so repeated and overlapping searches skip the network
+    set_item_cache(ItemCache())
 
 def add_to_search_history(search_params):
     global search_history
@@ -534,7 +626,8 @@ def save_preferences():
         'end_year': end_year_entry.get(),
         'keyword': keyword_entry.get(),
         'author': author_entry.get(),
-        'file_types': file_type_entry.get()
+        'file_types': file_type_entry.get(),
+        'best_format_only': best_format_var.get()
     }
     with open('user_preferences.json', 'w') as f:
         json.dump(preferences, f)
@@ -550,11 +643,12 @@ def load_preferences():
         keyword_entry.insert(0, preferences.get('keyword', ''))
         author_entry.insert(0, preferences.get('author', ''))
         file_type_entry.set(preferences.get('file_types', 'pdf'))
+        best_format_var.set(preferences.get('best_format_only', False))
     except FileNotFoundError:
         pass
 
 def create_gui():
-    global window, file_tree, download_dir_entry, status_label, total_size_label, progress_bar, search_button, pause_button, language_entry, start_year_entry, end_year_entry, keyword_entry, author_entry, file_type_entry
+    global window, file_tree, filter_entry, filter_count_label, download_dir_entry, status_label, total_size_label, limits_label, progress_bar, search_button, pause_button, language_entry, start_year_entry, end_year_entry, keyword_entry, author_entry, file_type_entry, best_format_var
 
     window = tk.Tk()
     window.title("ARCHIVE.ORG SCRAPER")
@@ -603,6 +697,10 @@ def create_gui():
     file_type_entry.grid(row=2, column=1, columnspan=5, sticky="ew", padx=5, pady=5)
     file_type_entry.set('pdf')  # Set default value to 'pdf'
 
+    best_format_var = tk.BooleanVar(value=False)
+    best_format_check = ttk.Checkbutton(search_frame, text="Best format only", variable=best_format_var)
+    best_format_check.grid(row=2, column=6, columnspan=3, sticky="w", padx=5, pady=5)
+
     search_button = ttk.Button(search_frame, text="Search", command=perform_search)
     search_button.grid(row=3, column=0, columnspan=2, pady=10)
 
@@ -615,32 +713,49 @@ def create_gui():
     history_button = ttk.Button(search_frame, text="History", command=show_search_history)
     history_button.grid(row=3, column=6, pady=10)
 
+    refresh_button = ttk.Button(search_frame, text="Refresh", command=refresh_search)
+    refresh_button.grid(row=3, column=7, padx=5, pady=10)
+
+    resume_button = ttk.Button(search_frame, text="Resume", command=resume_search)
+    resume_button.grid(row=3, column=8, padx=5, pady=10)
+
     # Results
     results_frame = ttk.Frame(window, padding=10)
     results_frame.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
     results_frame.grid_columnconfigure(0, weight=1)
-    results_frame.grid_rowconfigure(0, weight=1)
+    results_frame.grid_rowconfigure(1, weight=1)
+
+    filter_frame = ttk.Frame(results_frame)
+    filter_frame.grid(row=0, column=0, sticky="ew", pady=(0, 5))
+    filter_frame.grid_columnconfigure(1, weight=1)
+
+    ttk.Label(filter_frame, text="Filter:").grid(row=0, column=0, sticky="w", padx=5)
+    filter_entry = ttk.Entry(filter_frame)
+    filter_entry.grid(row=0, column=1, sticky="ew", padx=5)
+    filter_entry.bind("<KeyRelease>", on_filter_change)
+
+    filter_count_label = ttk.Label(filter_frame, text="")
+    filter_count_label.grid(row=0, column=2, sticky="e", padx=5)
 
     tree_frame = ttk.Frame(results_frame)
-    tree_frame.grid(row=0, column=0, sticky="nsew")
+    tree_frame.grid(row=1, column=0, sticky="nsew")
     tree_frame.grid_columnconfigure(0, weight=1)
     tree_frame.grid_rowconfigure(0, weight=1)
 
-    file_tree = LazyTreeview(tree_frame, columns=("name", "book_name", "size", "url"), show="headings", selectmode="extended")
-    file_tree.heading("name", text="File Name", command=lambda: sort_tree("name", False))
-    file_tree.heading("book_name", text="Book Name", command=lambda: sort_tree("book_name", False))
-    file_tree.heading("size", text="Size", command=lambda: sort_tree("size", False))
-    file_tree.heading("url", text="URL", command=lambda: sort_tree("url", False))
+    file_tree = VirtualTreeview(tree_frame, results, columns=("name", "book_name", "size", "url"), show="headings", selectmode="extended")
+    for col, text in HEADINGS.items():
+        file_tree.heading(col, text=text)
+    file_tree.bind("<Button-1>", on_heading_click)
     file_tree.column("name", width=200, minwidth=200)
     file_tree.column("book_name", width=300, minwidth=300)
     file_tree.column("size", width=100, minwidth=100)
     file_tree.column("url", width=400, minwidth=400)
     file_tree.grid(row=0, column=0, sticky="nsew")
 
-    tree_scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=file_tree.yview)
+    tree_scrollbar = ttk.Scrollbar(tree_frame, orient="vertical")
     tree_scrollbar.grid(row=0, column=1, sticky="ns")
 
-    file_tree.configure(yscrollcommand=tree_scrollbar.set)
+    file_tree.set_scrollbar(tree_scrollbar)
     file_tree.bind("<Double-1>", show_detailed_view)
 
     # Download
@@ -672,6 +787,9 @@ def create_gui():
     total_size_label = ttk.Label(status_frame, text="")
     total_size_label.grid(row=0, column=1, sticky="e")
 
+    limits_label = ttk.Label(status_frame, text="", foreground="gray")
+    limits_label.grid(row=1, column=0, columnspan=2, sticky="w")
+
     progress_bar = ttk.Progressbar(window, length=400, mode="determinate", style="TProgressbar")
     progress_bar.grid(row=4, column=0, sticky="ew", padx=10, pady=5)
 
@@ -679,26 +797,62 @@ def create_gui():
     attribution_label = ttk.Label(window, text="CREATED BY RANGAKU RESEARCH LABS, A SUBSIDIARY OF RANGAKU ZAIBATSU INTERNATIONAL TRADING COMPANY. ALL BASES BELONGED TO US. ", foreground="#00FF00", background="#001100", font=("Courier", 8))
     attribution_label.grid(row=5, column=0, sticky="ew", padx=10, pady=5)
 
-    # Set icon and show splash screen
     window.iconphoto(True, create_icon())
-    splash = show_splash_screen()
-    window.withdraw()
-    window.after(3000, window.deiconify)
 
     # Load preferences
     load_preferences()
 
+    window.after(UI_REFRESH_MS, drain_ui_queue)
+
     return (window, file_tree, download_dir_entry, 
             status_label, total_size_label, progress_bar, search_button, 
             pause_button, language_entry, start_year_entry, end_year_entry, 
             keyword_entry, author_entry, file_type_entry)
 
-def sort_tree(col, reverse):
-    l = [(file_tree.set(k, col), k) for k in file_tree.get_children('')]
-    l.sort(reverse=reverse)
-    for index, (val, k) in enumerate(l):
-        file_tree.move(k, '', index)
-    file_tree.heading(col, command=lambda: sort_tree(col, not reverse))
+def on_heading_click(event):
+    if file_tree.identify_region(event.x, event.y) == "heading":
+        col = file_tree.column(file_tree.identify_column(event.x), "id")
+        # Shift-click adds the column as a tie-breaker instead of replacing the sort
+        sort_tree(col, extend=bool(event.state & 0x0001))
+
+def sort_tree(col, extend=False):
+    global sort_columns
+    reverse = dict(sort_columns).get(col)
+    if reverse is not None and (extend or sort_columns[0][0] == col):
+        sort_columns = [(c, not r if c == col else r) for c, r in sort_columns]
+    elif extend:
+        sort_columns.append((col, False))
+    else:
+        sort_columns = [(col, False)]
+    for c, text in HEADINGS.items():
+        arrow = next((" \u25bc" if r else " \u25b2" for sc, r in sort_columns if sc == c), "")
+        file_tree.heading(c, text=text + arrow)
+    apply_view()
+
+def on_filter_change(*args):
+    global filter_job
+    # Wait for a pause in typing rather than filtering on every keystroke
+    if filter_job:
+        window.after_cancel(filter_job)
+    filter_job = window.after(FILTER_DELAY_MS, apply_filter)
+
+def apply_filter():
+    global filter_text, filter_job
+    filter_job = None
+    filter_text = filter_entry.get().strip()
+    apply_view()
+
+def apply_view(keep_position=False):
+    global last_view_update, view_stale
+    last_view_update = time.monotonic()
+    view_stale = False
+    rows = results.sorted_rows([(SORT_FIELDS[c], r) for c, r in sort_columns])
+    rows = results.filter_rows(filter_text, rows)
+    file_tree.set_rows(rows, keep_position)
+    if filter_text:
+        filter_count_label.config(text=f"{len(rows)} of {len(results)} files")
+    else:
+        filter_count_label.config(text="")
 
 # Create the GUI
 (window, file_tree, download_dir_entry, 
@@ -706,9 +860,12 @@ def sort_tree(col, reverse):
  pause_button, language_entry, start_year_entry, end_year_entry, 
  keyword_entry, author_entry, file_type_entry) = create_gui()
 
-# Load search history
-load_search_history()
+threading.Thread(target=load_in_background, daemon=True).start()
+
+# Set ARCHIVE_ORG_METRICS_PORT to watch a harvest from Prometheus or curl
+if os.environ.get('ARCHIVE_ORG_METRICS_PORT'):
+    metrics.serve(int(os.environ['ARCHIVE_ORG_METRICS_PORT']))
 
 # Start the main loop
-window.protocol("WM_DELETE_WINDOW", lambda: [save_preferences(), window.destroy()])
+window.protocol("WM_DELETE_WINDOW", lambda: [save_preferences(), close_live_exporters(), window.destroy()])
 window.mainloop()
@@ -0,0 +1,347 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import time
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency, only needed for the asyncio engine
+    aiohttp = None
+
+import downloads
+import engine
+import integrity
+import metrics
+import ratelimit
+import transport
+from downloads import DownloadManager
+from engine import Harvester
+
+class AsyncHttp:
+    """aiohttp counterpart of ``transport.HttpClient``: same timeouts, retries, backoff and ``ratelimit`` budgets.
+
+    Waiting for a budget blocks, so it happens in a worker thread; the slot is
+    held until the response has been read.
+    """
+
+    def __init__(self, concurrency=200, per_host=50, timeout=transport.DEFAULT_TIMEOUT, max_retries=5,
+                 backoff_factor=0.5, max_backoff=60.0):
+        if aiohttp is None:
+            raise RuntimeError("The asyncio engine needs aiohttp: pip install aiohttp")
+        connect_timeout, read_timeout = timeout
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout))
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.requests = 0
+        self.retries = 0
+
+    async def close(self):
+        await self.session.close()
+
+    def backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+        if response is not None:
+            retry_after = transport.parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+    async def request(self, url, read, traffic=None, **kwargs):
+        """GET ``url`` and return ``(status, await read(response))``, retrying like ``HttpClient.get``.
+
+        With ``traffic`` every attempt waits for that budget in ``ratelimit`` and reports back how it went.
+        """
+        limiter = ratelimit.limiter(traffic) if traffic else None
+        attempt = 0
+        while True:
+            async with self.semaphore:
+                self.requests += 1
+                held = await asyncio.to_thread(limiter.before_request) if limiter else False
+                started = time.monotonic()
+                outcome, retry_after = 'error', None
+                try:
+                    async with self.session.get(url, **kwargs) as response:
+                        latency = time.monotonic() - started
+                        outcome = ratelimit.outcome_for_status(response.status)
+                        retry_after = transport.parse_retry_after(response.headers.get('Retry-After'))
+                        metrics.observe('http_request_seconds', latency, traffic='async')
+                        metrics.inc('http_requests_total', traffic='async', status=response.status)
+                        if response.status not in transport.RETRY_STATUSES or attempt >= self.max_retries:
+                            return response.status, await read(response)
+                        delay = self.backoff(attempt, response)
+                        logging.warning(f"HTTP {response.status} for {url}, retrying in {delay:.1f}s")
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    outcome = 'error'
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self.backoff(attempt)
+                    logging.warning(f"{type(e).__name__} for {url}, retrying in {delay:.1f}s")
+                finally:
+                    if limiter:
+                        limiter.after_request(outcome, time.monotonic() - started, retry_after, held=held)
+            self.retries += 1
+            metrics.inc('http_retries_total', traffic='async')
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get_json(self, url, traffic=None):
+        status, data = await self.request(url, lambda response: response.json(content_type=None), traffic)
+        return data if status == 200 else {}
+
+    async def get_bytes(self, url, traffic=None):
+        return await self.request(url, lambda response: response.read(), traffic)
+
+async def load_item_metadata_async(http, identifier):
+    cached = engine.item_cache.get(identifier) if engine.item_cache is not None else None
+    if cached is not None and cached.fresh:
+        return cached.metadata
+
+    async def read(response):
+        metadata = await response.json(content_type=None) if response.status == 200 else {}
+        return metadata, response.headers
+
+    try:
+        status, (metadata, headers) = await http.request(f"{engine.ARCHIVE_URL}/metadata/{identifier}", read,
+                                                         'metadata', headers=engine.revalidation_headers(cached))
+    except Exception as e:
+        logging.warning(f"Metadata lookup failed for {identifier}: {e}")
+        status, metadata, headers = None, {}, {}
+    return engine.remember_item_metadata(identifier, cached, status, metadata, headers)
+
+async def resolve_item_files_async(http, identifier, file_types):
+    """Coroutine version of ``engine.resolve_item_files``: same records, same ``ItemUnavailable``."""
+    metadata = await load_item_metadata_async(http, identifier)
+    if metadata.get('files'):
+        return engine.files_from_metadata(identifier, metadata, file_types)
+    logging.warning(f"No file listing for {identifier}, falling back to details page")
+
+    try:
+        status, content = await http.get_bytes(f"{engine.ARCHIVE_URL}/details/{identifier}", 'metadata')
+    except Exception as e:
+        raise engine.ItemUnavailable(f"{identifier}: {e}")
+    if status in transport.RETRY_STATUSES:
+        raise engine.ItemUnavailable(f"{identifier}: HTTP {status}")
+    # Parsing is CPU-bound; keep it off the event loop
+    return await asyncio.to_thread(engine.parse_details_page, content, file_types)
+
+class AsyncHarvester(Harvester):
+    """``Harvester`` with search paging and item resolution running as coroutines.
+
+    ``concurrency`` caps requests in flight overall and ``per_host`` per host,
+    which lets a single thread keep thousands of item lookups waiting on the
+    network at once. ``on_file``, ``on_status``, ``on_item``, ``selection``
+    and the counters behave as in ``Harvester``, and a resumed run skips
+    ``skip_identifiers``, but:
+
+    - only the advancedsearch API is paged: ``use_scrape_api`` and
+      ``identifiers`` are refused;
+    - ``on_checkpoint`` is never called, so a resumed run pages from
+      ``start_page`` again.
+
+    Items that can't be resolved are listed in ``failed_items``, a failed
+    search page sets ``search_failed``, and every request waits for its
+    budget in ``ratelimit`` as the threaded engine's do.
+    """
+
+    def __init__(self, search_params, file_types, concurrency=200, per_host=50, **kwargs):
+        if kwargs.get('use_scrape_api') or kwargs.get('identifiers') is not None:
+            raise ValueError("The asyncio engine only pages the advancedsearch API")
+        Harvester.__init__(self, search_params, file_types, **kwargs)
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.queue_size = max(self.queue_size, concurrency * 2)
+
+    def run(self):
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        http = AsyncHttp(self.concurrency, self.per_host)
+        identifiers = asyncio.Queue(maxsize=self.queue_size)
+        try:
+            producer = asyncio.create_task(self._produce_async(http, identifiers))
+            workers = [asyncio.create_task(self._resolve_worker(http, identifiers))
+                       for _ in range(self.concurrency)]
+            await producer
+            for _ in workers:
+                await identifiers.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            await http.close()
+        self.progress = 100
+        self._notify_status()
+
+    async def _produce_async(self, http, identifiers):
+        # Resumes from start_page and skips resolved items, but doesn't report checkpoints (see the class docstring)
+        yielded = (self.page - 1) * self.rows
+        while not self.is_cancelled:
+            url = f"{self.base_url}&page={self.page}"
+            try:
+                with metrics.span('search_page', api='advancedsearch'):
+                    data = await http.get_json(url, 'search')
+            except Exception as e:
+                logging.error(f"Error paging search results for {self.query}: {e}")
+                self.search_failed = True
+                return
+            if "response" not in data or "docs" not in data["response"]:
+                logging.error(f"Unexpected search response for {url}")
+                self.search_failed = True
+                return
+            docs = data["response"]["docs"]
+            self.total_available_files = int(data["response"]["numFound"])
+            if not docs:
+                return
+            for doc in docs:
+                if doc['identifier'] in self.skip_identifiers:
+                    self.skipped_items += 1
+                    continue
+                await identifiers.put(doc['identifier'])
+            yielded += len(docs)
+            self.page += 1
+            if yielded >= self.total_available_files:
+                return
+
+    async def _resolve_worker(self, http, identifiers):
+        while True:
+            identifier = await identifiers.get()
+            if identifier is None:
+                return
+            if self.is_cancelled:
+                continue
+            while self.is_paused and not self.is_cancelled:
+                await asyncio.sleep(0.1)
+            try:
+                with metrics.span('item_resolve', trace={'identifier': identifier}):
+                    result = await resolve_item_files_async(http, identifier, self.file_types)
+            except engine.ItemUnavailable as e:
+                logging.error(f"Could not resolve {e}")
+                self.failed_items.append(identifier)
+                metrics.inc('items_failed_total')
+                self._notify_status()
+                continue
+            self._add_item(result, identifier)
+
+class AsyncDownloadManager(DownloadManager):
+    """``DownloadManager`` whose transfers run as coroutines on one event loop.
+
+    Tasks are laid out, renamed on collisions, resumed from ``.part`` files,
+    verified, quarantined and recorded exactly as by ``DownloadManager``;
+    only the HTTP streaming runs on aiohttp, ``workers`` files at once and
+    ``per_host`` per host. Files big enough to be fetched as parallel ranges
+    (see ``segment_size``) still are, in worker threads.
+    """
+
+    def __init__(self, download_dir, workers=8, per_host=8, **kwargs):
+        DownloadManager.__init__(self, download_dir, workers=workers, **kwargs)
+        self.per_host = per_host
+        # Stored object path -> asyncio.Lock held while it is being fetched
+        self.async_object_locks = {}
+
+    def run(self):
+        return asyncio.run(self.run_async())
+
+    async def run_async(self):
+        pending = self._start_run()
+        total = len(pending)
+        http = AsyncHttp(self.workers, self.per_host)
+        try:
+            await asyncio.gather(*(self._run_task_async(http, task, total) for task in pending))
+        finally:
+            await http.close()
+        self.save_queue()
+        return self.done
+
+    async def _run_task_async(self, http, task, total):
+        if self.is_cancelled:
+            return
+        # The "download" budget is taken per request by AsyncHttp, and held while the body streams
+        self._notify("start", task, total)
+        try:
+            with metrics.span('download', trace={'file': task.file_name}):
+                task.state = await self.download_async(http, task)
+        except Exception as e:
+            logging.error(f"Error downloading {task.url}: {e}")
+            task.state = 'error'
+        self._task_finished(task, total)
+
+    async def download_async(self, http, task):
+        file_path, algorithm, expected, stored = self._target(task)
+        if stored:
+            # A second task for the same object waits for the first, then just links it
+            async with self.async_object_locks.setdefault(stored, asyncio.Lock()):
+                if self._link_stored(task, file_path, algorithm, expected, stored):
+                    return 'skipped'
+                return await self._fetch_async(http, task, file_path, algorithm, expected, stored)
+        if not task.replace and await self.is_complete_async(http, file_path, task):
+            return 'skipped'
+        return await self._fetch_async(http, task, file_path, algorithm, expected)
+
+    async def is_complete_async(self, http, file_path, task):
+        if not os.path.exists(file_path):
+            return False
+        size = task.size
+        if size is None:
+            async def read(response):
+                return int(response.headers.get('Content-Length', -1)) if response.status == 200 else -1
+
+            status, size = await http.request(task.url, read, 'download')
+        return os.path.getsize(file_path) == size
+
+    async def _fetch_async(self, http, task, file_path, algorithm, expected, stored=None):
+        part_path = file_path + downloads.PART_SUFFIX
+        for attempt in range(self.max_verify_attempts + 1):
+            state = 'no-range'
+            if self._segmented(task):
+                state = await asyncio.to_thread(self._download_segmented, task, part_path)
+                digest = None
+                if state == 'done' and algorithm:
+                    digest = await asyncio.to_thread(integrity.hash_file, part_path, algorithm)
+            if state == 'no-range':
+                state, digest = await self._download_stream_async(http, task, part_path, algorithm)
+            if state != 'done':
+                return state
+            if self._place(task, part_path, file_path, algorithm, expected, digest, stored):
+                return 'done'
+        return 'error'
+
+    async def _download_stream_async(self, http, task, part_path, algorithm=None):
+        """Coroutine version of ``DownloadManager._download_stream``."""
+        for attempt in range(self.max_resume_attempts + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            hasher = hashlib.new(algorithm) if algorithm else None
+            if task.size and offset >= task.size:
+                return 'done', hasher and integrity.update_from_file(hasher, part_path).hexdigest()
+            headers = {'Range': f"bytes={offset}-"} if offset else {}
+
+            async def save(response):
+                if response.status == 416:
+                    if hasher:
+                        integrity.update_from_file(hasher, part_path)
+                    return 'done'
+                if response.status not in (200, 206):
+                    return downloads.failure_state(task, response.status)
+                mode = 'ab' if response.status == 206 else 'wb'
+                if hasher and mode == 'ab':
+                    integrity.update_from_file(hasher, part_path)
+                with open(part_path, mode) as file:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        if self.is_cancelled:
+                            return 'pending'
+                        file.write(chunk)
+                        if hasher:
+                            hasher.update(chunk)
+                        self._count(len(chunk))
+                return 'done'
+
+            try:
+                status, state = await http.request(task.url, save, 'download', headers=headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"Connection lost downloading {task.url} ({e}), resuming (attempt {attempt + 1})")
+                continue
+            return state, (hasher.hexdigest() if hasher and state == 'done' else None)
+        return 'error', None
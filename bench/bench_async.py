@@ -0,0 +1,67 @@
+"""Thread-pool Harvester and DownloadManager vs their asyncio counterparts against the local mock archive.
+
+    python bench/bench_async.py --items 2000 --latency 0.05 --downloads 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine
+import ratelimit
+from async_engine import AsyncDownloadManager, AsyncHarvester
+from downloads import DownloadManager
+from mock_archive import start_mock_archive
+
+def run(name, harvester, server):
+    server.reset_counters()
+    start = time.perf_counter()
+    harvester.run()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22} {harvester.total_items / elapsed:>9.1f} items/s {elapsed:>8.2f} s "
+          f"{harvester.total_files:>7} files {server.requests_served:>7} requests")
+
+def run_downloads(name, manager_class, records, server, workers):
+    with tempfile.TemporaryDirectory(prefix='bench-async-') as download_dir:
+        manager = manager_class(download_dir, workers=workers)
+        manager.add_records(records)
+        server.reset_counters()
+        start = time.perf_counter()
+        manager.run()
+        elapsed = time.perf_counter() - start
+    print(f"{name:<22} {manager.done / elapsed:>9.1f} files/s {elapsed:>8.2f} s "
+          f"{manager.bytes_downloaded / elapsed / 1024 / 1024:>7.1f} MB/s {manager.corrupt:>4} corrupt")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every mock response")
+    parser.add_argument('--workers', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--downloads', type=int, default=200, help="files to download with each manager (0: none)")
+    args = parser.parse_args()
+
+    server = start_mock_archive(items=args.items, latency=args.latency)
+    engine.ARCHIVE_URL = server.url
+    # Measure the engine, not the politeness budgets meant for archive.org
+    ratelimit.set_enabled(False)
+    params = {'keyword': 'bench'}
+    for workers in args.workers:
+        run(f"threads x{workers}", engine.Harvester(params, ['pdf'], max_workers=workers), server)
+    for concurrency in args.concurrency:
+        run(f"asyncio x{concurrency}", AsyncHarvester(params, ['pdf'], concurrency=concurrency), server)
+    if args.downloads:
+        records = []
+        engine.Harvester(params, ['pdf'], on_file=records.append).run()
+        records = records[:args.downloads]
+        for workers in args.workers:
+            run_downloads(f"download threads x{workers}", DownloadManager, records, server, workers)
+        for concurrency in args.concurrency:
+            run_downloads(f"download asyncio x{concurrency}", AsyncDownloadManager, records, server, concurrency)
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
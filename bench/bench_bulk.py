@@ -0,0 +1,66 @@
+"""Bulk-mode throughput against the mock archive as worker processes are added.
+
+Runs ``cli.py bulk`` over the same identifier list with each ``--processes``
+count, with a fixed number of resolver threads per process and mock latency
+standing in for archive.org's, and prints items/s and the speedup over one
+process. Each run gets a fresh coordinator, so the shards really are shared
+out between the processes.
+
+    python bench/bench_bulk.py --items 2000 --processes 1 2 4 --latency 0.05
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_archive import start_mock_archive
+from shards import ShardQueue
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cli.py')
+
+def run(url, ids_path, processes, args, work_dir):
+    coordinator = os.path.join(work_dir, f'shards-{processes}.sqlite3')
+    command = [sys.executable, CLI, '--archive-url', url, '--no-rate-limits', '--no-item-cache', 'bulk', ids_path,
+               '--coordinator', coordinator, '--processes', str(processes), '--workers', str(args.workers),
+               '--shard-size', str(args.shard_size), '--file-types', 'pdf']
+    if args.download:
+        command += ['--download-dir', os.path.join(work_dir, f'downloads-{processes}')]
+    start = time.perf_counter()
+    with open(os.path.join(work_dir, 'bulk.log'), 'a') as log:
+        subprocess.run(command, stdout=log, stderr=log, check=True)
+    elapsed = time.perf_counter() - start
+    batch = ShardQueue(coordinator).list()[0]
+    return batch.items / elapsed, batch
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--workers', type=int, default=4, help="resolver threads per process")
+    parser.add_argument('--shard-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every mock response")
+    parser.add_argument('--download', action='store_true', help="download the files too")
+    args = parser.parse_args()
+
+    server = start_mock_archive(items=args.items, latency=args.latency)
+    with tempfile.TemporaryDirectory(prefix='bench-bulk-') as work_dir:
+        ids_path = os.path.join(work_dir, 'identifiers.txt')
+        with open(ids_path, 'w') as f:
+            f.write('\n'.join(server.identifiers) + '\n')
+        print(f"{args.items} items, {args.workers} resolvers per process, {args.latency * 1000:.0f} ms latency, "
+              f"{os.cpu_count()} CPUs")
+        print(f"{'processes':>9} {'items/s':>9} {'speedup':>8} {'shards':>7} {'files':>7}")
+        baseline = None
+        for processes in args.processes:
+            rate, batch = run(server.url, ids_path, processes, args, work_dir)
+            baseline = baseline or rate
+            print(f"{processes:>9} {rate:>9.1f} {rate / baseline:>7.2f}x {batch.shards.get('done', 0):>7} "
+                  f"{batch.files:>7}")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
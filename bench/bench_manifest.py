@@ -0,0 +1,64 @@
+"""Time to plan a sync as the local tree grows, from the manifest alone.
+
+Fills a manifest with ``--sizes`` entries (no files are written) and times
+``Manifest.plan`` for a listing of ``--listing`` records, a tenth of them
+changed and a tenth new, plus ``Manifest.stale`` for a prune. Planning
+looks the listing up by primary key, so its time should hardly move with
+the size of the tree; the prune check is one indexed anti-join.
+
+    python bench/bench_manifest.py --sizes 10000 100000 1000000 --listing 10000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import FileRecord
+from manifest import Manifest
+
+def entry_row(i):
+    return (f"item{i:08d}.pdf", f"item{i:08d}", f"https://archive.org/download/item{i:08d}/item{i:08d}.pdf",
+            100000 + i, 1.7e9, f"{i:032x}", None, 1.7e9)
+
+def listing(size, count):
+    records = []
+    for n in range(count):
+        i = n * (size // count)
+        md5 = f"{i:032x}" if n % 10 else f"{i + 1:032x}"
+        if n % 10 == 5:
+            i = size + n  # not held yet
+        records.append(FileRecord(f"item{i:08d}.pdf", "", f"https://archive.org/download/item{i:08d}/item{i:08d}.pdf",
+                                  100000 + i, "", f"item{i:08d}", md5))
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--listing', type=int, default=10000, help="records in the remote listing")
+    args = parser.parse_args()
+
+    print(f"{'files held':>11} {'fill s':>8} {'plan ms':>9} {'stale ms':>9} {'new':>6} {'changed':>8} {'same':>7}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory(prefix='bench-manifest-') as directory:
+            manifest = Manifest(directory, flush_rows=100000)
+            start = time.perf_counter()
+            for first in range(0, size, 100000):
+                manifest.pending.extend(entry_row(i) for i in range(first, min(first + 100000, size)))
+                manifest.flush()
+            fill = time.perf_counter() - start
+            records = listing(size, args.listing)
+            start = time.perf_counter()
+            plan = manifest.plan(records)
+            planned = time.perf_counter() - start
+            start = time.perf_counter()
+            manifest.stale(records)
+            stale = time.perf_counter() - start
+            manifest.close()
+        print(f"{size:>11} {fill:>8.1f} {planned * 1000:>9.1f} {stale * 1000:>9.1f} {len(plan.added):>6} "
+              f"{len(plan.changed):>8} {len(plan.unchanged):>7}")
+
+if __name__ == '__main__':
+    main()
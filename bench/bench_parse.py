@@ -0,0 +1,73 @@
+"""Details-page parsing throughput per parser backend and number of worker processes.
+
+Parses a corpus of saved details pages (``<id>.html`` files recorded with
+``mock_archive.py record``, by default from ``bench/fixtures``) or, when none
+have been recorded, pages synthesized like the mock archive's. Each backend is first timed in-process on one thread, then
+through a ``ParsePool`` fed by ``--threads`` resolver-like threads.
+
+    python bench/mock_archive.py record alicesadventures00carr prideandprejudi00aust
+    python bench/bench_parse.py --processes 1 2 4
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import html_parse
+from mock_archive import default_fixtures, synth_details_page
+
+FILE_TYPES = ('pdf', 'epub', 'djvu', 'txt')
+ARCHIVE_URL = 'https://archive.org'
+
+def load_corpus(fixtures_dir, pages):
+    if fixtures_dir:
+        corpus = []
+        for name in sorted(os.listdir(fixtures_dir)):
+            if name.endswith('.html'):
+                with open(os.path.join(fixtures_dir, name), 'rb') as f:
+                    corpus.append(f.read())
+        return corpus
+    return [synth_details_page(f"mockitem{i:06d}").encode('utf-8') for i in range(pages)]
+
+def report(name, corpus, elapsed, links):
+    size = sum(len(page) for page in corpus)
+    print(f"{name:<28} {len(corpus) / elapsed:>9.1f} pages/s {size / elapsed / 1024 / 1024:>8.1f} MB/s "
+          f"{links:>7} links")
+
+def run_inline(backend, corpus):
+    start = time.perf_counter()
+    links = sum(len(html_parse.parse_details(page, FILE_TYPES, ARCHIVE_URL, backend)) for page in corpus)
+    report(f"{backend}, in-process", corpus, time.perf_counter() - start, links)
+
+def run_pool(backend, corpus, processes, threads):
+    pool = html_parse.ParsePool(processes, backend)
+    # Start the workers before timing, the way a long harvest amortizes them
+    pool.parse(corpus[0], FILE_TYPES, ARCHIVE_URL)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        links = sum(len(rows) for rows in executor.map(lambda page: pool.parse(page, FILE_TYPES, ARCHIVE_URL), corpus))
+    report(f"{backend}, {processes} processes", corpus, time.perf_counter() - start, links)
+    pool.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', default=default_fixtures(),
+                        help="directory of saved details pages (default: bench/fixtures if it has any)")
+    parser.add_argument('--pages', type=int, default=50, help="pages to synthesize without --fixtures")
+    parser.add_argument('--backends', nargs='+', default=list(html_parse.BACKENDS), choices=list(html_parse.BACKENDS))
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, os.cpu_count()])
+    parser.add_argument('--threads', type=int, default=32, help="threads handing pages to the pool")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.fixtures, args.pages)
+    print(f"{len(corpus)} {'recorded' if args.fixtures else 'synthesized'} pages, {sum(len(page) for page in corpus) / 1024 / 1024:.1f} MB, {os.cpu_count()} CPUs")
+    for backend in args.backends:
+        run_inline(backend, corpus)
+        for processes in sorted(set(args.processes)):
+            run_pool(backend, corpus, processes, args.threads)
+
+if __name__ == '__main__':
+    main()
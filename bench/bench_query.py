@@ -0,0 +1,64 @@
+"""Bytes and requests per 1,000 search hits for each search-query layout, against the local mock archive.
+
+Compares the old query (six fields, 100 rows a page, no format filter) with
+identifier-only pages, larger pages and the format prefilter. Every harvest
+resolves the same search, so the numbers show what each step saves in the
+search phase and how many items the prefilter keeps out of the resolve phase.
+
+    python bench/bench_query.py --items 5000 --audio-share 0.2
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine
+import ratelimit
+from mock_archive import start_mock_archive
+
+LEGACY_FIELDS = ('identifier', 'title', 'creator', 'year', 'subject', 'description')
+
+def run(name, harvester, server, hits, fields=engine.SEARCH_RESULT_FIELDS):
+    # Rebuilt so the old field list can be measured; the engine itself always asks for identifiers only
+    harvester.base_url = engine.build_search_url(harvester.query, harvester.rows, fields)
+    server.reset_counters()
+    start = time.perf_counter()
+    harvester.run()
+    elapsed = time.perf_counter() - start
+    search_requests, search_bytes = server.served.get('advancedsearch.php', (0, 0))
+    per_thousand = 1000 / hits
+    print(f"{name:<31} {search_requests * per_thousand:>8.1f} {search_bytes * per_thousand / 1024:>10.1f} "
+          f"{harvester.total_items * per_thousand:>9.0f} {server.requests_served * per_thousand:>9.1f} "
+          f"{server.bytes_sent * per_thousand / 1024:>10.1f} {harvester.total_files:>7} {elapsed:>7.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=5000, help="search hits")
+    parser.add_argument('--audio-share', type=float, default=0.2, help="fraction of hits without any text formats")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every mock response")
+    parser.add_argument('--file-types', default='pdf,epub')
+    parser.add_argument('--workers', type=int, default=32)
+    args = parser.parse_args()
+
+    server = start_mock_archive(items=args.items, latency=args.latency, audio_share=args.audio_share)
+    engine.ARCHIVE_URL = server.url
+    ratelimit.set_enabled(False)
+    params = {'keyword': 'bench'}
+    file_types = args.file_types.split(',')
+
+    def harvester(rows, prefilter):
+        return engine.Harvester(params, file_types, max_workers=args.workers, rows=rows, prefilter=prefilter)
+
+    print(f"{args.items} hits, {args.audio_share:.0%} without {args.file_types}; figures per 1,000 hits")
+    print(f"{'query':<31} {'searches':>8} {'search KB':>10} {'resolved':>9} {'requests':>9} "
+          f"{'total KB':>10} {'files':>7} {'secs':>7}")
+    run("6 fields, 100 rows", harvester(100, False), server, args.items, LEGACY_FIELDS)
+    run("identifier, 100 rows", harvester(100, False), server, args.items)
+    run("identifier, 1000 rows", harvester(1000, False), server, args.items)
+    run("identifier, 1000 rows, format", harvester(1000, True), server, args.items)
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
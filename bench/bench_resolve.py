@@ -0,0 +1,65 @@
+"""Compare the details-page scraper with the metadata JSON resolver, offline.
+
+The metadata resolver runs twice against a fresh item cache (cold, then warm)
+and once more for a different file type, which the cache answers too.
+
+    python bench/bench_resolve.py --items 200 --workers 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine
+import ratelimit
+from item_cache import ItemCache
+from mock_archive import default_fixtures, start_mock_archive
+
+def scrape_details(identifier, file_types):
+    return engine.fetch_file_data(f"{engine.ARCHIVE_URL}/details/{identifier}", file_types)
+
+def run(name, resolver, server, file_types, workers):
+    server.reset_counters()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda identifier: resolver(identifier, file_types), server.identifiers))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    files = sum(len(r) for r in results)
+    print(f"{name:<16} {len(results) / wall:>9.1f} items/s {cpu * 1000 / len(results):>8.2f} ms cpu/item "
+          f"{server.bytes_sent / len(results) / 1024:>9.1f} KB/item {server.requests_served:>6} requests "
+          f"{files:>7} files")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=10)
+    parser.add_argument('--file-types', default='pdf,epub,djvu')
+    parser.add_argument('--fixtures', default=default_fixtures(),
+                        help="directory of recorded responses (default: bench/fixtures if it has any)")
+    args = parser.parse_args()
+
+    server = start_mock_archive(items=args.items, fixtures_dir=args.fixtures)
+    engine.ARCHIVE_URL = server.url
+    # Measure the engine, not the politeness budgets meant for archive.org
+    ratelimit.set_enabled(False)
+    file_types = tuple(args.file_types.split(','))
+    run('details', scrape_details, server, file_types, args.workers)
+    run('metadata', engine.resolve_item_files, server, file_types, args.workers)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        engine.set_item_cache(ItemCache(os.path.join(cache_dir, 'items.sqlite3')))
+        run('metadata cold', engine.resolve_item_files, server, file_types, args.workers)
+        run('metadata warm', engine.resolve_item_files, server, file_types, args.workers)
+        run('other types', engine.resolve_item_files, server, ('txt',), args.workers)
+        print(f"item cache: {engine.item_cache.stats()}")
+        engine.item_cache.close()
+        engine.set_item_cache(None)
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""GUI cold-start time: seconds until the window is interactive, and which imports it waits for.
+
+Starts ``ARHIVE.ORG SCRAPER.py`` ``--runs`` times with ``-X importtime``, in
+an empty working directory, through a launcher that makes its main loop quit
+at the first idle moment, and reports the median time to the window's first idle moment together with the
+slowest top-level imports of the last run. As a regression guard it exits
+with status 1 when a run doesn't get that far, when the median exceeds
+``--max-seconds`` or when any of the ``--forbid`` modules (the networking,
+parsing and export stacks, which load on first use) is imported at startup.
+Needs a display; ``xvfb-run`` will do.
+
+    python bench/bench_startup.py --runs 5 --max-seconds 1.5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+GUI_SCRIPT = os.path.join(os.path.dirname(BENCH_DIR), 'ARHIVE.ORG SCRAPER.py')
+FORBIDDEN = ('requests', 'urllib3', 'bs4', 'lxml', 'selectolax', 'pyarrow', 'aiohttp', 'http.server', 'cProfile',
+             'pyinstrument')
+# Runs the GUI script given as its argument, printing "ready" and quitting once the main loop first goes
+# idle; idle callbacks only run once the window is mapped and every pending event is handled
+LAUNCHER = """
+import runpy, sys, tkinter
+mainloop = tkinter.Misc.mainloop
+def mainloop_until_ready(widget, n=0):
+    widget.after_idle(lambda: [print("ready", flush=True), widget.destroy()])
+    mainloop(widget, n)
+tkinter.Misc.mainloop = mainloop_until_ready
+runpy.run_path(sys.argv[1], run_name='__main__')
+"""
+
+def parse_importtime(lines):
+    """``(module, self_us, cumulative_us, depth)`` for every line ``-X importtime`` wrote."""
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+def start_once(script, cwd):
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', LAUNCHER, script], cwd=cwd,
+                                   stdout=subprocess.PIPE, stderr=stderr, text=True)
+        ready = None
+        for line in process.stdout:
+            if line.strip() == 'ready':
+                ready = time.perf_counter() - started
+        process.wait()
+        stderr.seek(0)
+        lines = stderr.read().splitlines()
+    errors = [line for line in lines if not line.startswith('import time:')]
+    return ready, parse_importtime(lines), errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--script', default=GUI_SCRIPT)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help="slowest top-level imports to list")
+    parser.add_argument('--max-seconds', type=float, default=None, help="fail when the median start is slower")
+    parser.add_argument('--forbid', nargs='*', default=list(FORBIDDEN), help="modules that must not load at startup")
+    args = parser.parse_args()
+
+    times = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix='bench-startup-') as cwd:
+            ready, imports, errors = start_once(os.path.abspath(args.script), cwd)
+        if ready is None:
+            print(f"{os.path.basename(args.script)} exited before its window was ready:", file=sys.stderr)
+            print('\n'.join(errors[-5:]), file=sys.stderr)
+            sys.exit(1)
+        times.append(ready)
+
+    top_level = [entry for entry in imports if entry[3] == 0]
+    total = sum(cumulative for _, _, cumulative, _ in top_level)
+    print(f"time to interactive: median {statistics.median(times):.3f}s, min {min(times):.3f}s over {len(times)} runs")
+    print(f"imports: {total / 1e6:.3f}s in {len(imports)} modules; slowest top-level imports:")
+    for name, _, cumulative, _ in sorted(top_level, key=lambda entry: -entry[2])[:args.top]:
+        print(f"  {cumulative / 1e3:>8.1f} ms  {name}")
+
+    loaded = [forbidden for forbidden in args.forbid
+              if any(name == forbidden or name.startswith(forbidden + '.') for name, _, _, _ in imports)]
+    failed = False
+    if loaded:
+        print(f"FAIL: loaded at startup: {', '.join(loaded)}")
+        failed = True
+    if args.max_seconds is not None and statistics.median(times) > args.max_seconds:
+        print(f"FAIL: median start {statistics.median(times):.3f}s is over {args.max_seconds:.3f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""End-to-end benchmark suite against the mock archive, with saved results to compare runs.
+
+Each scenario runs in its own process against its own mock server process,
+so its peak RSS is its own and one scenario's leftovers can't skew the next:
+
+    cold_search   harvest with an empty item cache
+    warm_search   the same harvest again, answered by the cache
+    harvest       a large harvest (10,000 items) with injected 500s and 429s
+    downloads     a few multi-GB files streamed at a capped bandwidth
+
+Every scenario reports items/s, MB/s, the p50/p99 of its per-item (or
+per-file) timing spans and its peak RSS. Results are written to
+``bench/results/<timestamp>.json`` and compared with the previous results
+file, or with ``--baseline``. These are the Harvester and DownloadManager
+the CLI and the GUI run, so their numbers carry over.
+
+    python bench/bench_suite.py
+    python bench/bench_suite.py --scenarios harvest --harvest-items 2000 --baseline bench/results/a.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import engine
+import metrics
+import ratelimit
+from downloads import DownloadManager
+from item_cache import ItemCache
+
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+SCENARIOS = ('cold_search', 'warm_search', 'harvest', 'downloads')
+# (key, column heading, format, whether higher is better)
+COLUMNS = (
+    ('items_per_second', 'items/s', '{:>9.1f}', True),
+    ('mb_per_second', 'MB/s', '{:>8.1f}', True),
+    ('p50_ms', 'p50 ms', '{:>8.1f}', False),
+    ('p99_ms', 'p99 ms', '{:>8.1f}', False),
+    ('peak_rss_mb', 'RSS MB', '{:>8.1f}', False),
+    ('seconds', 'secs', '{:>8.2f}', False),
+)
+
+def mock_options(name, args):
+    if name in ('cold_search', 'warm_search'):
+        return ['--items', str(args.search_items)]
+    if name == 'harvest':
+        options = ['--items', str(args.harvest_items), '--error-rate', str(args.error_rate)]
+        return options + (['--throttle', str(args.throttle)] if args.throttle else [])
+    options = ['--items', str(args.download_files), '--file-size', str(args.file_size)]
+    return options + (['--bandwidth', str(args.bandwidth)] if args.bandwidth else [])
+
+def start_mock(options):
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'mock_archive.py'), 'serve', '--port', '0']
+                               + options, stdout=subprocess.PIPE, text=True)
+    # "Serving mock archive.org on http://127.0.0.1:<port> (...)"
+    url = process.stdout.readline().split()[4]
+    return process, url
+
+def quantile(durations, q):
+    if not durations:
+        return None
+    ordered = sorted(durations)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+def counter_total(name, **labels):
+    with metrics.registry.lock:
+        return sum(value for (counter, key), value in metrics.registry.counters.items()
+                   if counter == name and set(labels.items()) <= set(key))
+
+def harvest(file_types, on_file=None):
+    harvester = engine.Harvester({'keyword': 'bench'}, file_types, on_file=on_file)
+    harvester.run()
+    return harvester
+
+def run_search(args, cache_path, prime):
+    engine.set_item_cache(ItemCache(cache_path))
+    if prime and not engine.item_cache.stats()['bytes']:
+        # Run on its own, the warm scenario fills the cache first
+        harvest(args.file_types)
+        metrics.registry = metrics.Registry(trace_spans=None)
+    start = time.perf_counter()
+    harvester = harvest(args.file_types)
+    elapsed = time.perf_counter() - start
+    stats = engine.item_cache.stats()
+    engine.item_cache.close()
+    return elapsed, harvester.total_items, 'item_resolve', {'cache_hit_ratio': round(stats['hit_ratio'], 3)}
+
+def run_harvest(args):
+    start = time.perf_counter()
+    harvester = harvest(args.file_types)
+    elapsed = time.perf_counter() - start
+    return elapsed, harvester.total_items, 'item_resolve', {
+        'failed_items': len(harvester.failed_items),
+        'search_failed': harvester.search_failed,
+        'retries': counter_total('http_retries_total'),
+        'files': harvester.total_files,
+    }
+
+def run_downloads(args):
+    records = []
+    harvest(('pdf',), on_file=records.append)
+    metrics.registry = metrics.Registry(trace_spans=None)
+    with tempfile.TemporaryDirectory(prefix='bench-downloads-') as download_dir:
+        manager = DownloadManager(download_dir, segment_size=args.segment_size)
+        manager.add_records(records)
+        start = time.perf_counter()
+        manager.run()
+        elapsed = time.perf_counter() - start
+    return elapsed, manager.done, 'download', {'files': len(records), 'corrupt': manager.corrupt}
+
+def run_scenario(name, url, args):
+    """Run one scenario in this process and return its measurements."""
+    engine.ARCHIVE_URL = url
+    ratelimit.set_enabled(args.rate_limits)
+    # Every span, not just the recent ones, so the percentiles are exact
+    metrics.registry = metrics.Registry(trace_spans=None)
+    if name == 'cold_search':
+        elapsed, items, span, extra = run_search(args, args.cache, prime=False)
+    elif name == 'warm_search':
+        elapsed, items, span, extra = run_search(args, args.cache, prime=True)
+    elif name == 'harvest':
+        elapsed, items, span, extra = run_harvest(args)
+    else:
+        elapsed, items, span, extra = run_downloads(args)
+    durations = [s['duration'] for s in metrics.registry.spans if s['name'] == span]
+    p50, p99 = quantile(durations, 0.5), quantile(durations, 0.99)
+    result = {
+        'items': items,
+        'seconds': round(elapsed, 3),
+        'items_per_second': round(items / elapsed, 2) if elapsed else None,
+        'mb_per_second': round(counter_total('http_bytes_total') / elapsed / 1e6, 2) if elapsed else None,
+        'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+        'p99_ms': round(p99 * 1000, 2) if p99 is not None else None,
+        # Linux reports kilobytes
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    result.update(extra)
+    return result
+
+def scenario_args(args):
+    options = ['--file-types', ','.join(args.file_types), '--cache', args.cache]
+    if args.segment_size:
+        options += ['--segment-size', str(args.segment_size)]
+    if args.rate_limits:
+        options.append('--rate-limits')
+    return options
+
+def measure(name, args):
+    server, url = start_mock(mock_options(name, args))
+    try:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-scenario', name, '--url', url]
+                                   + scenario_args(args), capture_output=True, text=True)
+    finally:
+        server.terminate()
+        server.wait()
+    if completed.returncode:
+        sys.stderr.write(completed.stderr)
+        raise RuntimeError(f"Scenario {name} failed with exit code {completed.returncode}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def latest_results():
+    paths = sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')))
+    return paths[-1] if paths else None
+
+def format_value(value, column_format):
+    return column_format.format(value) if value is not None else f"{'-':>{len(column_format.format(0))}}"
+
+def print_results(results, baseline):
+    print(f"{'scenario':<12} " + ' '.join(f"{heading:>{len(fmt.format(0))}}" for _, heading, fmt, _ in COLUMNS))
+    for name, result in results['scenarios'].items():
+        print(f"{name:<12} " + ' '.join(format_value(result.get(key), fmt) for key, _, fmt, _ in COLUMNS))
+        before = (baseline or {}).get('scenarios', {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for key, _, fmt, higher_is_better in COLUMNS:
+            old, new = before.get(key), result.get(key)
+            if not old or new is None:
+                changes.append(format_value(None, fmt))
+                continue
+            change = (new - old) / old * 100
+            mark = '+' if (change > 0) == higher_is_better else '-'
+            changes.append(f"{change:>+{len(fmt.format(0)) - 2}.0f}%{mark if abs(change) >= 5 else ' '}")
+        print(f"{'  vs base':<12} " + ' '.join(changes))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--file-types', default='pdf,epub', type=lambda value: value.split(','))
+    parser.add_argument('--search-items', type=int, default=2000, help="hits in the cold/warm search")
+    parser.add_argument('--harvest-items', type=int, default=10000, help="hits in the large harvest")
+    parser.add_argument('--error-rate', type=float, default=0.01, help="share of harvest requests answered with a 500")
+    parser.add_argument('--throttle', type=float, default=300,
+                        help="harvest requests per second the mock serves before answering 429 (0 for none)")
+    parser.add_argument('--download-files', type=int, default=2)
+    parser.add_argument('--file-size', type=int, default=2 << 30, help="bytes per downloaded file")
+    parser.add_argument('--bandwidth', type=float, default=200e6, help="bytes per second per download connection")
+    parser.add_argument('--segment-size', type=int, default=None, help="as for the CLI's --segment-size")
+    parser.add_argument('--rate-limits', action='store_true', help="keep the archive.org request budgets on")
+    parser.add_argument('--baseline', default=None, help="results file to compare with (default: the latest)")
+    parser.add_argument('--no-save', dest='save', action='store_false')
+    parser.add_argument('--run-scenario', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--url', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--cache', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args.run_scenario, args.url, args)))
+        return
+
+    baseline_path = args.baseline or latest_results()
+    baseline = None
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    results = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'options': {name: value for name, value in vars(args).items()
+                    if name not in ('scenarios', 'baseline', 'save', 'run_scenario', 'url', 'cache')},
+        'scenarios': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='bench-cache-') as cache_dir:
+        args.cache = os.path.join(cache_dir, 'items.sqlite3')
+        for name in args.scenarios:
+            print(f"running {name}...", file=sys.stderr)
+            results['scenarios'][name] = measure(name, args)
+    print(f"{results['commit']} on Python {results['python']}, {results['cpus']} CPUs"
+          + (f"; compared with {os.path.basename(baseline_path)} ({baseline.get('commit')})" if baseline else ""))
+    print_results(results, baseline)
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"saved {path}")
+
+if __name__ == '__main__':
+    main()
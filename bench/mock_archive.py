@@ -0,0 +1,373 @@
+"""Local stand-in for archive.org used for offline benchmarks.
+
+Serves ``advancedsearch.php``, the cursor-paged scrape API, ``/metadata/<id>``,
+``/details/<id>`` and ``/download/<id>/<name>``. Responses come from a fixtures
+directory of recorded pages when one is given (``<id>.json`` and ``<id>.html``,
+see ``record``; ``bench/fixtures`` once recordings are made there) and are
+otherwise synthesized deterministically, padded to the size of real pages. No
+recordings are committed, so out of the box every response is synthesized. Searches honour ``fl[]`` and a ``format:(...)`` clause;
+``--audio-share`` makes that fraction of items audio-only, so a format
+filter has something to exclude.
+
+Downloads are generated as they are sent, so ``--file-size`` can make every
+file gigabytes long. ``--bandwidth`` caps each connection's transfer rate,
+``--error-rate`` answers that share of requests with a 500, and
+``--throttle`` answers requests beyond that many per second with a 429 and
+``Retry-After``, like archive.org does under load.
+
+    python bench/mock_archive.py serve --port 8000 --items 1000
+    python bench/mock_archive.py record alicesadventures00carr --out bench/fixtures
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+FILE_FORMATS = [('pdf', 'Text PDF'), ('epub', 'EPUB'), ('djvu', 'DjVu'), ('txt', 'DjVuTXT')]
+AUDIO_FORMATS = [('mp3', 'VBR MP3'), ('ogg', 'Ogg Vorbis')]
+FORMAT_CLAUSE_RE = re.compile(r'format:\(([^)]*)\)')
+BLOCK_SIZE = 64 << 10
+# Hashing a multi-GB synthetic file would take longer than downloading it; such files publish no checksums
+CHECKSUM_LIMIT = 256 << 20
+
+# Recordings the benchmarks use when present; none ship with the repository, make them with ``record``
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def default_fixtures():
+    """``DEFAULT_FIXTURES`` if recordings have been made there, else None (synthesize everything)."""
+    return DEFAULT_FIXTURES if os.path.isdir(DEFAULT_FIXTURES) and os.listdir(DEFAULT_FIXTURES) else None
+
+# Real details pages are mostly navigation, scripts and inline JSON
+PAGE_PADDING = '<div class="topnav"><a href="/">nav</a><script>var x = {"k": "v"};</script></div>\n' * 1500
+
+def file_size_for(identifier, extension):
+    digest = hashlib.md5(f"{identifier}/{extension}".encode('utf-8')).digest()
+    return 10_000 + int.from_bytes(digest[:2], 'big') * 2
+
+@lru_cache(maxsize=64)
+def file_block(identifier, extension):
+    # Deterministic, non-constant bytes so checksums actually catch corruption
+    pattern = hashlib.sha256(f"{identifier}.{extension}".encode('utf-8')).digest()
+    return pattern * (BLOCK_SIZE // len(pattern))
+
+def iter_file(identifier, extension, start, end):
+    """Bytes ``start`` to ``end`` (inclusive) of a synthetic file, a block at a time."""
+    block = file_block(identifier, extension)
+    position = start
+    while position <= end:
+        offset = position % len(block)
+        chunk = block[offset:offset + end - position + 1]
+        yield chunk
+        position += len(chunk)
+
+@lru_cache(maxsize=None)
+def file_checksums(identifier, extension, size):
+    if size > CHECKSUM_LIMIT:
+        return None, None
+    md5, sha1 = hashlib.md5(), hashlib.sha1()
+    for chunk in iter_file(identifier, extension, 0, size - 1):
+        md5.update(chunk)
+        sha1.update(chunk)
+    return md5.hexdigest(), sha1.hexdigest()
+
+def formats_for(identifier):
+    return AUDIO_FORMATS if identifier.startswith('mockaudio') else FILE_FORMATS
+
+def synth_search_doc(identifier):
+    # The fields the GUI used to ask advancedsearch.php for, sized like real ones
+    return {
+        'identifier': identifier,
+        'title': f"Title of {identifier}",
+        'creator': f"Author of {identifier}",
+        'year': '1900',
+        'subject': ['fiction', 'literature', 'classics'],
+        'description': f"Description of {identifier}. " * 20,
+        'format': [file_format for _, file_format in formats_for(identifier)] + ['Metadata'],
+    }
+
+def synth_metadata(identifier, file_size=None):
+    files = []
+    formats = formats_for(identifier)
+    for extension, file_format in formats:
+        name = f"{identifier}.{extension}"
+        size = file_size or file_size_for(identifier, extension)
+        md5, sha1 = file_checksums(identifier, extension, size)
+        file_info = {
+            'name': name,
+            'source': 'original' if (extension, file_format) == formats[0] else 'derivative',
+            'format': file_format,
+            'size': str(size),
+        }
+        if md5:
+            file_info.update(md5=md5, sha1=sha1)
+        files.append(file_info)
+    files.append({'name': f"{identifier}_meta.xml", 'source': 'metadata', 'format': 'Metadata', 'size': '1200'})
+    return {
+        'files': files,
+        'metadata': {
+            'identifier': identifier,
+            'title': f"Title of {identifier}",
+            'description': f"Description of {identifier}. " * 20,
+        },
+    }
+
+def synth_details_page(identifier, file_size=None):
+    metadata = synth_metadata(identifier, file_size)
+    links = []
+    for file_info in metadata['files']:
+        links.append(f'<a class="download-pill" href="/download/{identifier}/{file_info["name"]}" '
+                     f'title="{int(file_info["size"]) / 1024 / 1024:.1f} MB">{file_info["format"]}</a>')
+    return (f'<html><head><title>{metadata["metadata"]["title"]}</title></head><body>{PAGE_PADDING}'
+            f'<h1 class="item-title">{metadata["metadata"]["title"]}</h1>'
+            f'<div itemprop="description">{metadata["metadata"]["description"]}</div>'
+            f'<section class="item-download-options">{"".join(links)}</section>'
+            f'{PAGE_PADDING}</body></html>')
+
+class MockArchiveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        url = urlsplit(self.path)
+        parts = [unquote(p) for p in url.path.strip('/').split('/')]
+        fault = server.fault()
+        if fault == 429:
+            self.send_body(b'rate limited', 'text/plain', status=429, headers={'Retry-After': '1'})
+        elif fault == 500:
+            self.send_body(b'injected error', 'text/plain', status=500)
+        elif parts[0] == 'advancedsearch.php':
+            self.send_search(parse_qs(url.query))
+        elif url.path == '/services/search/v1/scrape':
+            self.send_scrape(parse_qs(url.query))
+        elif parts[0] == 'metadata' and len(parts) == 2:
+            body = server.fixture(parts[1], 'json')
+            if body is None:
+                body = json.dumps(synth_metadata(parts[1], server.file_size)).encode('utf-8')
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_body(b'', 'application/json', status=304, headers={'ETag': etag})
+            else:
+                self.send_body(body, 'application/json', headers={'ETag': etag})
+        elif parts[0] == 'details' and len(parts) == 2:
+            body = server.fixture(parts[1], 'html')
+            if body is None:
+                body = synth_details_page(parts[1], server.file_size).encode('utf-8')
+            self.send_body(body, 'text/html')
+        elif parts[0] == 'download' and len(parts) >= 3:
+            extension = parts[-1].rsplit('.', 1)[-1]
+            self.send_file(parts[1], extension, server.file_size or file_size_for(parts[1], extension))
+        else:
+            self.send_body(b'not found', 'text/plain', status=404)
+
+    def send_search(self, query):
+        rows = int(query.get('rows', ['100'])[0])
+        page = int(query.get('page', ['1'])[0])
+        fields = query.get('fl[]')
+        identifiers = self.server.matching(query.get('q', [''])[0])
+        docs = []
+        for identifier in identifiers[(page - 1) * rows:page * rows]:
+            doc = synth_search_doc(identifier)
+            docs.append({field: doc[field] for field in fields if field in doc} if fields else doc)
+        body = json.dumps({'response': {'numFound': len(identifiers), 'start': (page - 1) * rows, 'docs': docs}})
+        self.send_body(body.encode('utf-8'), 'application/json')
+
+    def send_scrape(self, query):
+        count = int(query.get('count', ['10000'])[0])
+        start = int(query.get('cursor', ['0'])[0])
+        identifiers = self.server.matching(query.get('q', [''])[0])
+        result = {'items': [{'identifier': identifier} for identifier in identifiers[start:start + count]],
+                  'total': len(identifiers)}
+        result['count'] = len(result['items'])
+        if start + count < len(identifiers):
+            result['cursor'] = str(start + count)
+        self.send_body(json.dumps(result).encode('utf-8'), 'application/json')
+
+    def send_file(self, identifier, extension, size):
+        start, end = 0, size - 1
+        byte_range = self.headers.get('Range')
+        if byte_range and byte_range.startswith('bytes='):
+            first, _, last = byte_range[6:].partition('-')
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self.send_response(206 if byte_range else 200)
+        self.send_header('Accept-Ranges', 'bytes')
+        if byte_range:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        bandwidth = self.server.bandwidth
+        started = time.monotonic()
+        sent = 0
+        try:
+            for chunk in iter_file(identifier, extension, start, end):
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if bandwidth:
+                    ahead = sent / bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        finally:
+            self.server.count(self.path, sent)
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(self.path, len(body))
+
+class MockArchive(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, items=1000, fixtures_dir=None, latency=0.0, audio_share=0.0, file_size=None,
+                 bandwidth=None, error_rate=0.0, throttle=None, seed=0):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port), MockArchiveHandler)
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.file_size = file_size
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.random = random.Random(seed)
+        self.tokens = throttle or 0
+        self.refilled = time.monotonic()
+        # Spread evenly, so every page of results has its share of audio items
+        self.identifiers = [f"mockaudio{i:06d}" if int(i * audio_share) != int((i + 1) * audio_share)
+                            else f"mockitem{i:06d}" for i in range(items)]
+        if fixtures_dir:
+            recorded = sorted({name.rsplit('.', 1)[0] for name in os.listdir(fixtures_dir)})
+            self.identifiers = recorded + self.identifiers[len(recorded):]
+        self.lock = threading.Lock()
+        self.requests_served = 0
+        self.bytes_sent = 0
+        # Endpoint ("advancedsearch.php", "metadata", ...) -> [requests, bytes]
+        self.served = {}
+        self.faults = {429: 0, 500: 0}
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def fault(self):
+        """Status code of the fault to inject into this request (429 or 500), if any."""
+        if not self.throttle and not self.error_rate:
+            return None
+        with self.lock:
+            if self.throttle:
+                now = time.monotonic()
+                self.tokens = min(self.throttle, self.tokens + (now - self.refilled) * self.throttle)
+                self.refilled = now
+                if self.tokens < 1:
+                    self.faults[429] += 1
+                    return 429
+                self.tokens -= 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.faults[500] += 1
+                return 500
+        return None
+
+    def matching(self, query):
+        """Identifiers a search matches; only a ``format:(...)`` clause narrows anything down."""
+        clause = FORMAT_CLAUSE_RE.search(query)
+        if not clause:
+            return self.identifiers
+        wanted = set(re.findall(r'"([^"]+)"', clause.group(1)))
+        return [identifier for identifier in self.identifiers
+                if wanted.intersection(file_format for _, file_format in formats_for(identifier))]
+
+    def fixture(self, identifier, extension):
+        if not self.fixtures_dir:
+            return None
+        path = os.path.join(self.fixtures_dir, f"{identifier}.{extension}")
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def count(self, path, size):
+        endpoint = urlsplit(path).path.strip('/').split('/')[0]
+        with self.lock:
+            self.requests_served += 1
+            self.bytes_sent += size
+            served = self.served.setdefault(endpoint, [0, 0])
+            served[0] += 1
+            served[1] += size
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests_served = 0
+            self.bytes_sent = 0
+            self.served = {}
+            self.faults = {429: 0, 500: 0}
+
+def start_mock_archive(**kwargs):
+    server = MockArchive(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def record(identifiers, out_dir, archive_url='https://archive.org'):
+    import requests
+
+    os.makedirs(out_dir, exist_ok=True)
+    for identifier in identifiers:
+        for path, extension in ((f"metadata/{identifier}", 'json'), (f"details/{identifier}", 'html')):
+            response = requests.get(f"{archive_url}/{path}", timeout=60)
+            response.raise_for_status()
+            with open(os.path.join(out_dir, f"{identifier}.{extension}"), 'wb') as f:
+                f.write(response.content)
+            print(f"recorded {path} ({len(response.content)} bytes)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--items', type=int, default=1000)
+    serve_parser.add_argument('--fixtures', default=default_fixtures(),
+                              help="directory of recorded responses (default: bench/fixtures if it has any)")
+    serve_parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    serve_parser.add_argument('--audio-share', type=float, default=0.0, help="fraction of items with only audio files")
+    serve_parser.add_argument('--file-size', type=int, default=None, help="bytes in every download (default: 10-140 KB)")
+    serve_parser.add_argument('--bandwidth', type=float, default=None, help="bytes per second per download connection")
+    serve_parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with a 500")
+    serve_parser.add_argument('--throttle', type=float, default=None,
+                              help="requests per second served before answering 429 with Retry-After")
+    serve_parser.add_argument('--seed', type=int, default=0, help="seed for the injected errors")
+    record_parser = subparsers.add_parser('record')
+    record_parser.add_argument('identifiers', nargs='+')
+    record_parser.add_argument('--out', default=DEFAULT_FIXTURES)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.identifiers, args.out)
+        return
+    server = MockArchive(port=args.port, items=args.items, fixtures_dir=args.fixtures, latency=args.latency,
+                         audio_share=args.audio_share, file_size=args.file_size, bandwidth=args.bandwidth,
+                         error_rate=args.error_rate, throttle=args.throttle, seed=args.seed)
+    print(f"Serving mock archive.org on {server.url} (set ARCHIVE_ORG_URL or pass --archive-url)")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,565 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import engine
+import html_parse
+import metrics
+import ratelimit
+import transport
+from downloads import DEFAULT_CHUNK_SIZE, FINISHED_STATES, LAYOUTS, LINKS, DownloadManager
+from engine import Harvester, common_file_types, format_size
+from exporters import EXPORTERS, export_row, open_exporter
+from logqueue import configure_logging
+from selection import SOURCES, SelectionPolicy
+
+def parse_file_types(value):
+    return [ft.strip() for ft in value.split(',') if ft.strip()]
+
+def add_search_arguments(parser):
+    parser.add_argument('--language', default='')
+    parser.add_argument('--start-year', default='')
+    parser.add_argument('--end-year', default='')
+    parser.add_argument('--keyword', default='')
+    parser.add_argument('--author', default='')
+    parser.add_argument('--file-types', type=parse_file_types, default=['pdf'],
+                        help=f"comma separated, e.g. {','.join(common_file_types[:3])}")
+
+def add_selection_arguments(parser):
+    parser.add_argument('--prefer', type=parse_file_types, default=[], metavar='TYPES',
+                        help="comma separated, best first: keep only the best of these an item has, e.g. epub,pdf,djvu")
+    parser.add_argument('--source', dest='file_source', choices=SOURCES, default='any',
+                        help="originals and derivatives alike, originals over derivatives, or originals only")
+    parser.add_argument('--max-size', type=engine.parse_size, default=None,
+                        help="skip files larger than this, e.g. 200MB")
+
+def selection_from_args(args):
+    return SelectionPolicy(args.prefer, args.file_source, args.max_size) or None
+
+def search_params_from_args(args):
+    return {
+        'language': args.language.strip(),
+        'start_year': args.start_year.strip(),
+        'end_year': args.end_year.strip(),
+        'keyword': args.keyword.strip(),
+        'author': args.author.strip()
+    }
+
+# Search options a job remembers, so `resume` runs it the same way
+JOB_OPTIONS = ('file_types', 'workers', 'scrape_api', 'use_async', 'concurrency', 'download_dir', 'export',
+               'download_workers', 'chunk_size', 'segment_size', 'rows', 'prefilter', 'layout', 'link')
+
+def cmd_search(args):
+    search_params = search_params_from_args(args)
+    if not any(search_params.values()):
+        print("Please provide at least one search parameter.", file=sys.stderr)
+        return 2
+    search_params = {k: v for k, v in search_params.items() if v}
+    if args.use_async and args.scrape_api:
+        print("--async only pages the advancedsearch API; drop --scrape-api or --async.", file=sys.stderr)
+        return 2
+    selection = selection_from_args(args)
+
+    records = []
+    writer = None
+    exporters = [open_exporter(path) for path in args.export]
+
+    def on_file(record):
+        records.append(record)
+        if writer:
+            writer.add(record)
+        for exporter in exporters:
+            exporter.add(record)
+        print(json.dumps(export_row(record), ensure_ascii=False), flush=True)
+
+    store = None
+    if not args.no_result_store:
+        from result_store import ResultStore
+        store = ResultStore(args.result_store)
+        entry = store.lookup(search_params, args.file_types, selection)
+        if entry and entry.complete and not args.refresh:
+            for batch in store.iter_records(entry.key):
+                for record in batch:
+                    on_file(record)
+            print(f"Loaded {len(records)} files from the result store, total size: "
+                  f"{format_size(sum(r.file_size or 0 for r in records))}", file=sys.stderr)
+            return finish_search(args, records, exporters)
+        incremental = bool(entry and entry.complete)
+        writer = store.writer(store.begin(search_params, args.file_types, incremental=incremental,
+                                          selection=selection))
+        if incremental:
+            search_params = store.refresh_params(entry)
+
+    journal = job = None
+    if not args.no_jobs:
+        from jobs import JobJournal
+        journal = JobJournal(args.jobs)
+        options = {name: getattr(args, name) for name in JOB_OPTIONS}
+        if selection:
+            options['selection'] = selection.spec()
+        job = journal.get(journal.create(search_params, args.file_types, options))
+        print(f"Job {job.id} (continue it with: resume {job.id})", file=sys.stderr)
+
+    harvester = harvest(args, search_params, on_file, writer, journal, job)
+    if harvester.is_cancelled:
+        for exporter in exporters:
+            exporter.close()
+        return 1
+    return finish_search(args, records, exporters, journal, job,
+                         complete=not (harvester.failed_items or harvester.search_failed))
+
+def harvest(args, search_params, on_file, writer=None, journal=None, job=None):
+    if job:
+        kwargs = journal.harvester_options(job)
+    else:
+        kwargs = {'rows': args.rows, 'prefilter': args.prefilter, 'selection': selection_from_args(args)}
+    if args.use_async:
+        from async_engine import AsyncHarvester
+        harvester = AsyncHarvester(search_params, args.file_types, concurrency=args.concurrency, on_file=on_file,
+                                   **kwargs)
+    else:
+        harvester = Harvester(search_params, args.file_types, on_file=on_file, max_workers=args.workers,
+                              use_scrape_api=args.scrape_api, **kwargs)
+    run_started = time.time()
+    try:
+        if args.profile:
+            metrics.run_profiled(harvester.run, args.profile)
+        else:
+            harvester.run()
+    except KeyboardInterrupt:
+        harvester.is_cancelled = True
+    if writer:
+        # A stored search is only served as complete when every page and item came through
+        writer.close(complete=not (harvester.is_cancelled or harvester.failed_items or harvester.search_failed),
+                     run_started=run_started)
+    if job:
+        if harvester.is_cancelled:
+            journal.set_state(job.id, 'interrupted')
+        else:
+            # Failed items, and the pages after a failed search page, are retried on resume from the last
+            # checkpoint; until then the job cannot complete
+            unfinished = harvester.failed_items or harvester.search_failed
+            journal.set_state(job.id, 'incomplete' if unfinished else 'harvested')
+    print(f"Found {harvester.total_files} files out of {harvester.total_available_files}, "
+          f"total size: {format_size(harvester.total_size)}", file=sys.stderr)
+    if harvester.deselected_files:
+        print(f"Left out {harvester.deselected_files} files by format preference, "
+              f"avoiding {format_size(harvester.avoided_size)}", file=sys.stderr)
+    if harvester.skipped_items:
+        print(f"Skipped {harvester.skipped_items} items resolved by an earlier run", file=sys.stderr)
+    if harvester.failed_items:
+        hint = f"; run `resume {job.id}` to retry them" if job else ""
+        print(f"{len(harvester.failed_items)} items could not be resolved{hint}", file=sys.stderr)
+    if harvester.search_failed:
+        hint = f"; run `resume {job.id}` to continue from the last complete page" if job else ""
+        print(f"The search failed part way, so the results are incomplete{hint}", file=sys.stderr)
+    logging.info(f"HTTP stats: {transport.default_client().stats()}")
+    logging.info(f"Rate limits: {ratelimit.stats()}")
+    if engine.item_cache is not None:
+        logging.info(f"Item cache stats: {engine.item_cache.stats()}")
+    return harvester
+
+def finish_search(args, records, exporters=(), journal=None, job=None, complete=True):
+    for exporter in exporters:
+        exporter.close()
+    if args.download_dir:
+        if job:
+            # Everything the job found, including earlier runs, minus what is already downloaded
+            records = list(journal.iter_files(job.id, exclude_states=('done', 'skipped')))
+        if not run_downloads(args, records, journal, job):
+            return 1
+    if job and complete:
+        journal.set_state(job.id, 'complete')
+    return 0
+
+def cmd_resume(args):
+    from jobs import JobJournal
+    journal = JobJournal(args.jobs)
+    job = journal.get(args.job)
+    if job is None:
+        print(f"No job {args.job} in {args.jobs}", file=sys.stderr)
+        return 2
+    if job.state == 'complete':
+        print(f"Job {job.id} is already complete", file=sys.stderr)
+        return 0
+    # Jobs the GUI started (or older versions journaled) don't record every option
+    defaults = vars(build_parser().parse_args(['search']))
+    for name in JOB_OPTIONS:
+        setattr(args, name, job.options.get(name, defaults[name]))
+    if args.use_async:
+        # The asyncio engine records no checkpoints, so resuming with it would page from the start again
+        print(f"Job {job.id} was started with --async; resuming it with the threaded engine", file=sys.stderr)
+        args.use_async = False
+    print(f"Resuming job {job.id}: {job.resolved} items and {job.files} files done, "
+          f"continuing from page {job.page}", file=sys.stderr)
+
+    writer = None
+    if not args.no_result_store:
+        from result_store import ResultStore
+        store = ResultStore(args.result_store)
+        writer = store.writer(store.begin(job.search_params, job.file_types, incremental=True,
+                                          selection=SelectionPolicy.from_spec(job.options.get('selection'))))
+    exporters = [open_exporter(path) for path in args.export]
+
+    def on_file(record):
+        if writer:
+            writer.add(record)
+        for exporter in exporters:
+            exporter.add(record)
+        print(json.dumps(export_row(record), ensure_ascii=False), flush=True)
+
+    complete = True
+    if job.state != 'harvested':
+        journal.set_state(job.id, 'running')
+        harvester = harvest(args, job.search_params, on_file, writer, journal, job)
+        if harvester.is_cancelled:
+            for exporter in exporters:
+                exporter.close()
+            return 1
+        complete = not (harvester.failed_items or harvester.search_failed)
+    return finish_search(args, [], exporters, journal, job, complete)
+
+def cmd_jobs(args):
+    from jobs import JobJournal
+    for job in JobJournal(args.jobs).list():
+        params = " ".join(f"{k}={v}" for k, v in job.search_params.items())
+        print(f"{job.id}  {job.state:<11} page {job.page:<5} {job.resolved:>7} items {job.files:>8} files  "
+              f"{','.join(job.file_types)}  {params}")
+    return 0
+
+def print_download_progress(event, file_name, done, total):
+    if event != "start":
+        print(f"{event}: {file_name} ({done}/{total})", file=sys.stderr)
+
+def run_downloads(args, records=(), journal=None, job=None):
+    """Download ``records`` (and anything left queued); returns whether every download finished."""
+    on_progress = print_download_progress
+    # Name a file is saved as -> its URL, which the journal goes by
+    urls = {}
+    if job:
+        def journal_progress(event, file_name, done, total):
+            print_download_progress(event, file_name, done, total)
+            if event != "start" and file_name in urls:
+                journal.file_state(job.id, urls[file_name], event)
+
+        on_progress = journal_progress
+
+    manager_class = DownloadManager
+    if args.use_async:
+        # Same layout, resume and verification, with the transfers as coroutines
+        from async_engine import AsyncDownloadManager as manager_class
+    manager = manager_class(args.download_dir, on_progress=on_progress, **download_options(args))
+    urls.update((task.file_name, task.url) for task in manager.add_records(records))
+    try:
+        manager.run()
+    except KeyboardInterrupt:
+        manager.is_cancelled = True
+        manager.save_queue()
+    print(f"Downloaded {manager.done} files ({format_size(manager.bytes_downloaded)})"
+          + (f"; linked {manager.deduplicated} already stored ({format_size(manager.bytes_deduplicated)})"
+             if manager.deduplicated else ""), file=sys.stderr)
+    logging.info(f"HTTP stats: {transport.default_client().stats()}")
+    logging.info(f"Rate limits: {ratelimit.stats()}")
+    return not manager.is_cancelled and all(task.state in FINISHED_STATES for task in manager.tasks.values())
+
+def cmd_download(args):
+    run_downloads(args)
+    return 0
+
+def cmd_sync(args):
+    from manifest import sync_files
+
+    search_params = {k: v for k, v in search_params_from_args(args).items() if v}
+    if not search_params:
+        print("Please provide at least one search parameter.", file=sys.stderr)
+        return 2
+    records = []
+    harvester = harvest(args, search_params, records.append)
+    if harvester.is_cancelled:
+        return 1
+    prune = args.prune
+    if prune and harvester.search_failed:
+        # Every item on the pages that weren't read would look deleted
+        print("The search failed part way, so the listing is incomplete; not pruning", file=sys.stderr)
+        prune = False
+    # Items that couldn't be resolved this time still exist; their files must not be pruned
+    summary = sync_files(args.download_dir, records, prune=prune, keep_identifiers=harvester.failed_items,
+                         check_local=args.check_local, dry_run=args.dry_run, on_progress=print_download_progress,
+                         **download_options(args))
+    verb = "would download" if args.dry_run else "downloaded"
+    print(f"{summary['added']} new, {summary['changed']} changed, {summary['unchanged']} up to date, "
+          f"{summary['pruned']} {'to prune' if args.dry_run else 'pruned'}; {verb} {format_size(summary['bytes'])}"
+          + (f"; linked {summary['deduplicated']} already stored" if summary['deduplicated'] else "")
+          + (f"; {summary['failed']} downloads failed" if summary['failed'] else ""), file=sys.stderr)
+    return 1 if summary['failed'] or harvester.failed_items or harvester.search_failed else 0
+
+def cmd_verify(args):
+    from integrity import verify_directory
+
+    def on_result(path, status):
+        if status != 'ok' or args.verbose:
+            print(f"{status}: {path}", flush=True)
+
+    summary = verify_directory(args.download_dir, processes=args.processes, on_result=on_result,
+                               move_bad=args.quarantine)
+    print(", ".join(f"{count} {status}" for status, count in sorted(summary.items())) or "nothing to verify",
+          file=sys.stderr)
+    return 0 if set(summary) <= {'ok'} else 1
+
+def bulk_identifiers(args):
+    """``(identifiers, harvester)`` for a bulk source; ``harvester`` lists a collection (None for a file)."""
+    if args.source.startswith('collection:'):
+        # Paged with the scrape API, which has no depth limit, and narrowed to items with matching formats
+        harvester = Harvester({'collection': args.source[len('collection:'):]}, args.file_types, use_scrape_api=True)
+        return harvester.iter_identifiers(), harvester
+    from shards import read_identifiers
+    return read_identifiers(args.source), None
+
+def cmd_bulk(args):
+    from shards import ShardQueue
+
+    queue = ShardQueue(args.coordinator)
+    if args.source:
+        identifiers, lister = bulk_identifiers(args)
+        batch_id = queue.create(args.source, identifiers, args.file_types, args.shard_size)
+        print(f"Batch {batch_id} (more workers can join with: bulk --batch {batch_id})", file=sys.stderr)
+        if lister and lister.search_failed:
+            print(f"Listing {args.source} failed part way; batch {batch_id} only holds the items listed before "
+                  f"that, and isn't worked on", file=sys.stderr)
+            return 1
+    elif args.batch:
+        batch_id = args.batch
+        if args.retry_failed:
+            print(f"Retrying {queue.retry_failed(batch_id)} failed shards", file=sys.stderr)
+    else:
+        print("Give a file of identifiers, collection:NAME or --batch", file=sys.stderr)
+        return 2
+    batch = queue.batch(batch_id)
+    if batch is None:
+        print(f"No batch {batch_id} in {args.coordinator}", file=sys.stderr)
+        return 2
+    print(f"{sum(batch.shards.values())} shards of up to {batch.shard_size} items", file=sys.stderr)
+
+    processes = max(args.processes, 1)
+    if processes == 1:
+        bulk_worker(args, batch_id)
+    else:
+        import multiprocessing
+
+        worker_args = argparse.Namespace(**vars(args))
+        # archive.org's budgets are per client, so the processes split them
+        for traffic in ratelimit.limiters:
+            setattr(worker_args, f'{traffic}_rate', getattr(args, f'{traffic}_rate') / processes)
+        # Each process already is one of the parallel parsers
+        worker_args.parse_processes = 0
+        worker_args.metrics_port = worker_args.metrics_json = worker_args.profile = None
+        context = multiprocessing.get_context('spawn')
+        workers = [context.Process(target=bulk_worker, args=(worker_args, batch_id, True)) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # The workers got the interrupt too and hand their shards back
+            for worker in workers:
+                worker.join()
+            return 1
+    batch = queue.batch(batch_id)
+    print(f"Batch {batch_id}: " + ", ".join(f"{count} shards {state}" for state, count in sorted(batch.shards.items()))
+          + f"; {batch.items} items, {batch.files} files, {format_size(batch.bytes)} downloaded", file=sys.stderr)
+    failed = queue.failed_identifiers(batch_id)
+    if failed:
+        print(f"{len(failed)} items failed (rerun with --batch {batch_id} --retry-failed): {' '.join(failed[:10])}"
+              + (" ..." if len(failed) > 10 else ""), file=sys.stderr)
+    return 0 if batch.finished and not batch.shards.get('failed') else 1
+
+def bulk_worker(args, batch_id, configure_process=False):
+    """Work through a batch's shards until none are left; in a worker process, ``configure_process`` sets it up first."""
+    from shards import ShardQueue, ShardWorker
+
+    if configure_process:
+        configure(args)
+    queue = ShardQueue(args.coordinator)
+
+    def on_shard(shard, state, items, files):
+        print(f"shard {shard.number}: {state}, {items} items, {files} files", file=sys.stderr, flush=True)
+
+    worker = ShardWorker(queue, queue.batch(batch_id), args.download_dir or None, on_shard=on_shard,
+                         harvester_options={'max_workers': args.workers, 'selection': selection_from_args(args)},
+                         download_options=download_options(args))
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.close()
+
+def cmd_batches(args):
+    from shards import ShardQueue
+    for batch in ShardQueue(args.coordinator).list():
+        states = " ".join(f"{state}={count}" for state, count in sorted(batch.shards.items()))
+        print(f"{batch.id}  {states:<40} {batch.items:>8} items {batch.files:>8} files {format_size(batch.bytes):>12}  "
+              f"{','.join(batch.file_types)}  {batch.source}")
+    return 0
+
+def add_download_arguments(parser):
+    parser.add_argument('--download-workers', type=int, default=8,
+                        help="most files downloaded at once (the adaptive limit may use fewer)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="bytes per read")
+    parser.add_argument('--segment-size', type=int, default=None,
+                        help="fetch files at least this many bytes as parallel ranges")
+    parser.add_argument('--layout', choices=LAYOUTS, default='flat',
+                        help="all files in one directory, a directory per item, or content-addressed: each file "
+                             "stored once by checksum and linked into item directories")
+    parser.add_argument('--link', choices=LINKS, default='hard', help="how --layout cas links files into place")
+
+def download_options(args):
+    return {'workers': args.download_workers, 'chunk_size': args.chunk_size, 'segment_size': args.segment_size,
+            'layout': args.layout, 'link': args.link}
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless archive.org search and harvest.")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('--archive-url', default=engine.ARCHIVE_URL,
+                        help="base URL of archive.org or of a local mock server")
+    parser.add_argument('--item-cache', default='item_cache.sqlite3', help="on-disk item metadata cache")
+    parser.add_argument('--no-item-cache', action='store_true', help="always fetch item metadata")
+    parser.add_argument('--result-store', default='search_results.sqlite3', help="on-disk store of search results")
+    parser.add_argument('--no-result-store', action='store_true', help="always run searches against archive.org")
+    parser.add_argument('--jobs', default='jobs.sqlite3', help="journal of harvest jobs, for resume")
+    parser.add_argument('--no-jobs', action='store_true', help="don't journal searches as resumable jobs")
+    for traffic, traffic_limiter in ratelimit.limiters.items():
+        parser.add_argument(f'--{traffic}-rate', type=float, default=traffic_limiter.bucket.rate,
+                            help=f"{traffic} requests per second (0 for no limit)")
+    parser.add_argument('--no-rate-limits', action='store_true',
+                        help="no rate or concurrency limits, e.g. against a local mock server")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics (JSON at /metrics.json)")
+    parser.add_argument('--metrics-json', default=None, metavar='PATH', help="write a metrics snapshot to PATH periodically")
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help="seconds between --metrics-json snapshots")
+    parser.add_argument('--profile', default=None, metavar='PATH',
+                        help="profile the harvest into PATH (cProfile dump, or pyinstrument report for .html)")
+    parser.add_argument('--html-parser', choices=list(html_parse.BACKENDS), default=html_parse.DEFAULT_BACKEND,
+                        help="parser for details pages that have to be scraped")
+    parser.add_argument('--parse-processes', type=int, default=max((os.cpu_count() or 1) - 1, 0),
+                        help="worker processes parsing scraped pages (0 parses in the resolver threads)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    search_parser = subparsers.add_parser('search', help="search, resolve files and print them as JSON lines")
+    add_search_arguments(search_parser)
+    search_parser.add_argument('--workers', type=int, default=32,
+                               help="most concurrent item resolvers (the adaptive limit may use fewer)")
+    search_parser.add_argument('--scrape-api', action='store_true',
+                               help="page with the cursor-based scrape API (for result sets deeper than 10,000)")
+    search_parser.add_argument('--async', dest='use_async', action='store_true',
+                               help="use the asyncio engine (needs aiohttp); not with --scrape-api, and resume "
+                                    "continues with threads")
+    search_parser.add_argument('--concurrency', type=int, default=200,
+                               help="requests in flight with --async")
+    search_parser.add_argument('--rows', type=int, default=engine.DEFAULT_ROWS, help="search hits per page")
+    search_parser.add_argument('--no-prefilter', dest='prefilter', action='store_false',
+                               help="don't exclude items whose formats can't match --file-types in the query")
+    search_parser.add_argument('--refresh', action='store_true',
+                               help="fetch only items added since a stored search last ran, and add them to it")
+    search_parser.add_argument('--download-dir', default='', help="download every file found into this directory")
+    search_parser.add_argument('--export', action='append', default=[], metavar='PATH',
+                               help=f"also write results to PATH as they are found ({', '.join(EXPORTERS)}); "
+                                    "may be repeated")
+    add_selection_arguments(search_parser)
+    add_download_arguments(search_parser)
+    search_parser.set_defaults(func=cmd_search)
+
+    resume_parser = subparsers.add_parser('resume', help="continue an interrupted search job where it stopped")
+    resume_parser.add_argument('job', help="job id, as printed by search or listed by jobs")
+    resume_parser.set_defaults(func=cmd_resume)
+
+    jobs_parser = subparsers.add_parser('jobs', help="list search jobs")
+    jobs_parser.set_defaults(func=cmd_jobs)
+
+    download_parser = subparsers.add_parser('download', help="resume the unfinished downloads queued in a directory")
+    download_parser.add_argument('--download-dir', required=True)
+    add_download_arguments(download_parser)
+    download_parser.set_defaults(func=cmd_download, use_async=False)
+
+    verify_parser = subparsers.add_parser('verify', help="re-hash a download directory against the recorded checksums")
+    verify_parser.add_argument('download_dir')
+    verify_parser.add_argument('--processes', type=int, default=None, help="hashing processes (default: one per CPU)")
+    verify_parser.add_argument('--quarantine', action='store_true', help="move mismatched files into .quarantine")
+    verify_parser.set_defaults(func=cmd_verify)
+
+    sync_parser = subparsers.add_parser('sync', help="mirror a search into a directory, downloading only new and "
+                                                     "changed files")
+    add_search_arguments(sync_parser)
+    sync_parser.add_argument('--download-dir', required=True)
+    sync_parser.add_argument('--prune', action='store_true', help="delete files the search no longer lists")
+    sync_parser.add_argument('--check-local', action='store_true',
+                             help="also re-fetch files that were deleted or modified locally (stats every file)")
+    sync_parser.add_argument('--dry-run', action='store_true', help="only report what would be transferred and pruned")
+    sync_parser.add_argument('--workers', type=int, default=32,
+                             help="most concurrent item resolvers (the adaptive limit may use fewer)")
+    sync_parser.add_argument('--scrape-api', action='store_true',
+                             help="page with the cursor-based scrape API (for result sets deeper than 10,000)")
+    sync_parser.add_argument('--rows', type=int, default=engine.DEFAULT_ROWS, help="search hits per page")
+    sync_parser.add_argument('--no-prefilter', dest='prefilter', action='store_false',
+                             help="don't exclude items whose formats can't match --file-types in the query")
+    add_selection_arguments(sync_parser)
+    add_download_arguments(sync_parser)
+    sync_parser.set_defaults(func=cmd_sync, use_async=False)
+
+    bulk_parser = subparsers.add_parser('bulk', help="resolve and download a list of identifiers or a collection, "
+                                                     "sharded over worker processes")
+    bulk_parser.add_argument('source', nargs='?',
+                             help="file of identifiers, one per line ('-' for stdin), or collection:NAME")
+    bulk_parser.add_argument('--batch', default=None, help="join (or continue) an existing batch instead")
+    bulk_parser.add_argument('--retry-failed', action='store_true', help="with --batch, queue failed shards again")
+    bulk_parser.add_argument('--coordinator', default='shards.sqlite3',
+                             help="shard queue shared by every worker; other machines can use it on a shared filesystem")
+    bulk_parser.add_argument('--shard-size', type=int, default=500, help="items per shard")
+    bulk_parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                             help="worker processes on this machine; the rate limits are split between them")
+    bulk_parser.add_argument('--file-types', type=parse_file_types, default=['pdf'],
+                             help="for a new batch; joined batches keep their own")
+    add_selection_arguments(bulk_parser)
+    bulk_parser.add_argument('--workers', type=int, default=16, help="item resolvers per process")
+    bulk_parser.add_argument('--download-dir', default='', help="download every file found into this directory")
+    add_download_arguments(bulk_parser)
+    bulk_parser.set_defaults(func=cmd_bulk)
+
+    batches_parser = subparsers.add_parser('batches', help="list bulk batches and their progress")
+    batches_parser.add_argument('--coordinator', default='shards.sqlite3')
+    batches_parser.set_defaults(func=cmd_batches)
+    return parser
+
+def configure(args):
+    configure_logging(logging.DEBUG if args.verbose else logging.WARNING)
+    engine.ARCHIVE_URL = args.archive_url.rstrip('/')
+    for traffic in ratelimit.limiters:
+        ratelimit.set_rate(traffic, getattr(args, f'{traffic}_rate'))
+    if args.no_rate_limits:
+        ratelimit.set_enabled(False)
+    engine.set_html_parser(args.html_parser, args.parse_processes)
+    if not args.no_item_cache:
+        from item_cache import ItemCache
+        engine.set_item_cache(ItemCache(args.item_cache))
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure(args)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    dumper = None
+    if args.metrics_json:
+        dumper = metrics.JsonDumper(args.metrics_json, args.metrics_interval)
+        dumper.start()
+    try:
+        return args.func(args)
+    finally:
+        if dumper:
+            dumper.stop()
+
+if __name__ == '__main__':
+    sys.exit(main())
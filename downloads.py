@@ -0,0 +1,544 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+import requests
+
+import integrity
+import metrics
+import ratelimit
+import transport
+from engine import has_exact_size
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+PART_SUFFIX = '.part'
+QUEUE_FILE = '.download_queue.json'
+QUEUE_SAVE_INTERVAL = 5.0
+# Tasks in any other state ('pending' or 'error') stay queued for the next run
+FINISHED_STATES = ('done', 'skipped', 'failed')
+RESUME_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+# Where files go: all in download_dir ('flat'), in a folder per item ('item'), or
+# stored once per checksum under OBJECTS_DIR and linked into item folders ('cas')
+LAYOUTS = ('flat', 'item', 'cas')
+LINKS = ('hard', 'symlink')
+OBJECTS_DIR = '.objects'
+# "<identifier>  <file name>" per file written, so a re-run knows a file on disk is its own
+OWNERS_FILE = '.owners'
+
+def identifier_from_url(url):
+    # https://archive.org/download/<identifier>/<name>
+    parts = urlsplit(url).path.split('/')
+    return unquote(parts[parts.index('download') + 1]) if 'download' in parts[:-2] else None
+
+def storage_name(record, layout='flat'):
+    """Path, relative to the download directory, that ``record``'s file is written to under ``layout``."""
+    identifier = record.identifier or identifier_from_url(record.download_url)
+    if layout == 'flat' or not identifier:
+        return record.file_name
+    return f"{identifier}/{record.file_name}"
+
+def record_owner(download_dir, identifier, file_name):
+    with open(os.path.join(download_dir, OWNERS_FILE), 'a', encoding='utf-8') as f:
+        f.write(f"{identifier}  {file_name}\n")
+
+def read_owners(download_dir):
+    """Return ``{file_name: identifier}`` for the files downloads have written into ``download_dir``."""
+    owners = {}
+    try:
+        with open(os.path.join(download_dir, OWNERS_FILE), 'r', encoding='utf-8') as f:
+            for line in f:
+                identifier, sep, file_name = line.rstrip('\n').partition('  ')
+                if sep:
+                    # Later lines win, like in the checksum files
+                    owners[file_name] = identifier
+    except FileNotFoundError:
+        pass
+    return owners
+
+def forget_owners(download_dir, file_names):
+    """Drop the owners of ``file_names``, e.g. once those files are deleted."""
+    path = os.path.join(download_dir, OWNERS_FILE)
+    if not os.path.exists(path):
+        return
+    file_names = set(file_names)
+    tmp_path = path + '.tmp'
+    with open(path, 'r', encoding='utf-8') as f, open(tmp_path, 'w', encoding='utf-8') as out:
+        for line in f:
+            if line.rstrip('\n').partition('  ')[2] not in file_names:
+                out.write(line)
+    os.replace(tmp_path, path)
+
+def object_path(download_dir, algorithm, digest):
+    return os.path.join(download_dir, OBJECTS_DIR, algorithm, digest[:2], digest)
+
+def link_object(path, file_path, link='hard'):
+    """Make ``file_path`` a hard link (or symlink) to the stored object ``path``, replacing whatever is there."""
+    tmp_path = file_path + '.link'
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    if link == 'hard':
+        try:
+            os.link(path, tmp_path)
+        except OSError as e:
+            # Another filesystem, or one without hard links
+            logging.debug(f"Can't hard link {file_path} ({e}); using a symlink")
+            link = 'symlink'
+    if link == 'symlink':
+        os.symlink(os.path.relpath(path, os.path.dirname(file_path)), tmp_path)
+    os.replace(tmp_path, file_path)
+
+def release_object(download_dir, algorithm, digest):
+    """Delete a stored object once no hard link to it is left; returns whether it was deleted."""
+    if not digest:
+        return False
+    path = object_path(download_dir, algorithm, digest)
+    try:
+        if os.stat(path).st_nlink > 1:
+            return False
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+def failure_state(task, status_code):
+    """State for a download the server answered with ``status_code``: throttling and server errors stay queued."""
+    if status_code in transport.RETRY_STATUSES:
+        logging.warning(f"Deferring {task.url}: HTTP {status_code}, left queued for the next run")
+        return 'error'
+    logging.warning(f"Skipping {task.url}: HTTP {status_code}")
+    return 'failed'
+
+class DownloadTask:
+    __slots__ = ('file_name', 'url', 'size', 'md5', 'sha1', 'state', 'segments', 'replace', 'identifier')
+
+    def __init__(self, file_name, url, size=None, md5=None, sha1=None, state='pending', segments=None, replace=False,
+                 identifier=None):
+        self.file_name = file_name
+        self.url = url
+        self.size = size
+        self.md5 = md5
+        self.sha1 = sha1
+        self.state = state
+        # [start, end, next_offset] per range while a segmented download is in progress
+        self.segments = segments
+        # Download even over a complete-looking file, e.g. a new version of it; the old one stays until then
+        self.replace = replace
+        # The item the file belongs to (queues saved before it was kept go by the URL)
+        self.identifier = identifier or identifier_from_url(url)
+
+    @classmethod
+    def from_record(cls, record, layout='flat'):
+        # A scraped size is only a rounded label; the server's Content-Length decides instead
+        size = (record.file_size or None) if has_exact_size(record) else None
+        return cls(storage_name(record, layout), record.download_url, size, record.md5, record.sha1,
+                   identifier=record.identifier)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class DownloadManager:
+    """Downloads several files at once into ``download_dir``, resumably.
+
+    Data is streamed into ``<name>.part`` and renamed into place once complete,
+    so an interrupted file resumes with a Range request instead of starting over.
+    Files already on disk with the expected size are skipped. Files of at least
+    ``segment_size`` bytes are fetched as ``segments`` parallel ranges when the
+    server supports it. Unfinished tasks are kept in ``.download_queue.json`` in
+    ``download_dir`` and picked up again by the next manager for that directory;
+    managers sharing a directory from different processes each need their
+    own ``queue_name``.
+
+    Files are hashed while they are written and checked against the md5/sha1
+    archive.org published. A file that doesn't match is moved to ``.quarantine``
+    and downloaded again, up to ``max_verify_attempts`` more times. Verified
+    checksums are appended to ``.checksums.md5``/``.checksums.sha1`` for
+    ``integrity.verify_directory``.
+
+    ``layout`` is one of ``LAYOUTS``. With ``'flat'`` a file whose name is
+    already taken, by another file in the queue or by a different file from
+    an earlier run, is put in a folder named after its item instead of
+    overwriting it. A file on disk is only taken to be the same one when its
+    recorded checksum matches, or when ``.owners`` (written for every file
+    downloaded, with or without a checksum) or the directory's sync manifest
+    lists it under the same item. With ``'cas'``
+    every file with a published checksum is stored once, as
+    ``.objects/<algorithm>/<ab>/<digest>``, and ``<item>/<name>`` is a
+    ``link`` to it; a file whose object is already stored is linked
+    without being downloaded, and counted in ``deduplicated``.
+
+    ``on_progress(event, file_name, done, total)`` is called with ``event`` one of
+    ``"start"``, ``"done"``, ``"skipped"`` (already complete, or linked to a
+    stored copy) or ``"error"``. A file the server refuses outright (a 4xx
+    other than 429) is ``'failed'`` and dropped from the queue; one that is
+    throttled or hits a server error is ``'error'`` and stays queued.
+
+    ``workers`` is a ceiling; the adaptive ``"download"`` limit in ``ratelimit``
+    decides how many files are actually in flight.
+    """
+
+    def __init__(self, download_dir, workers=8, chunk_size=DEFAULT_CHUNK_SIZE, segment_size=None, segments=4,
+                 on_progress=None, max_resume_attempts=5, max_verify_attempts=2, queue_name=QUEUE_FILE, layout='flat',
+                 link='hard'):
+        if layout not in LAYOUTS:
+            raise ValueError(f"layout must be one of {', '.join(LAYOUTS)}, not {layout!r}")
+        self.download_dir = download_dir
+        self.layout = layout
+        self.link = link
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.segment_size = segment_size
+        self.segments = segments
+        self.on_progress = on_progress
+        self.max_resume_attempts = max_resume_attempts
+        self.max_verify_attempts = max_verify_attempts
+        self.queue_file = os.path.join(download_dir, queue_name)
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.tasks = {}
+        self.done = 0
+        self.bytes_downloaded = 0
+        self.corrupt = 0
+        self.deduplicated = 0
+        self.bytes_deduplicated = 0
+        # {file_name: (algorithm, digest)} from the checksum files, read when first needed
+        self.recorded = None
+        # {file_name: identifier} from the owners file, read when first needed
+        self.owners = None
+        # The directory's manifest.Manifest, opened when first needed (False if it has none)
+        self.manifest = None
+        # Stored object path -> lock held while it is being fetched
+        self.object_locks = {}
+        self.is_cancelled = False
+        self.last_save = 0.0
+        transport.default_client().ensure_pool_size(workers * max(segments, 1) + 1)
+        os.makedirs(download_dir, exist_ok=True)
+        self.load_queue()
+
+    def load_queue(self):
+        try:
+            with open(self.queue_file, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logging.error(f"Ignoring unreadable download queue {self.queue_file}: {e}")
+            return
+        for task_data in saved:
+            task = DownloadTask(**task_data)
+            if task.state not in FINISHED_STATES:
+                task.state = 'pending'
+                self.tasks[task.file_name] = task
+
+    def save_queue(self):
+        with self.save_lock:
+            with self.lock:
+                self.last_save = time.monotonic()
+                pending = [task.as_dict() for task in self.tasks.values() if task.state not in FINISHED_STATES]
+            if not pending:
+                if os.path.exists(self.queue_file):
+                    os.remove(self.queue_file)
+                return
+            tmp_path = self.queue_file + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(pending, f)
+            os.replace(tmp_path, self.queue_file)
+
+    def add(self, task):
+        """Queue ``task``, or return the same download already queued; under ``'flat'`` it may be renamed first."""
+        with self.lock:
+            if self.layout == 'flat' and self._is_taken(task) and task.identifier:
+                logging.info(f"{task.file_name} is taken by another item's file; saving it as "
+                             f"{task.identifier}/{task.file_name}")
+                task.file_name = f"{task.identifier}/{task.file_name}"
+            existing = self.tasks.get(task.file_name)
+            if existing and existing.url == task.url and existing.state == 'pending':
+                return existing
+            self.tasks[task.file_name] = task
+            return task
+
+    def _is_taken(self, task):
+        existing = self.tasks.get(task.file_name)
+        if existing:
+            return existing.url != task.url
+        if task.replace:
+            return False
+        if self.recorded is None:
+            self.recorded = integrity.read_checksums(self.download_dir)
+        recorded = self.recorded.get(task.file_name)
+        algorithm, expected = integrity.expected_checksum(task.md5, task.sha1)
+        if recorded and expected and recorded[0] == algorithm:
+            return recorded[1] != expected
+        if not os.path.exists(os.path.join(self.download_dir, task.file_name)):
+            return False
+        # A file of that name is there but no checksum says whose it is; it is only this one if recorded as such
+        return self._owner(task.file_name) != task.identifier
+
+    def _owner(self, file_name):
+        """Identifier of the item ``file_name`` was downloaded for, or None if nothing records it; needs ``lock``."""
+        from manifest import MANIFEST_FILE, Manifest
+
+        if self.owners is None:
+            self.owners = read_owners(self.download_dir)
+        owner = self.owners.get(file_name)
+        if owner:
+            return owner
+        # Files synced before owners were recorded are still in the sync manifest
+        if self.manifest is None:
+            exists = os.path.exists(os.path.join(self.download_dir, MANIFEST_FILE))
+            self.manifest = Manifest(self.download_dir) if exists else False
+        if not self.manifest:
+            return None
+        entry = self.manifest.lookup([file_name]).get(file_name)
+        return entry.identifier if entry else None
+
+    def add_records(self, records):
+        """Queue a download per record; returns the tasks, in order, under the names they'll be saved as."""
+        tasks = [self.add(DownloadTask.from_record(record, self.layout)) for record in records]
+        self.save_queue()
+        return tasks
+
+    def run(self):
+        pending = self._start_run()
+        total = len(pending)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for task in pending:
+                executor.submit(self._run_task, task, total)
+        self.save_queue()
+        return self.done
+
+    def _start_run(self):
+        """The tasks a run has to do, once the queue is saved."""
+        if self.manifest:
+            self.manifest.close()
+        self.manifest = None
+        pending = [task for task in self.tasks.values() if task.state == 'pending']
+        self.save_queue()
+        metrics.gauge('queue_depth', lambda: sum(task.state == 'pending' for task in pending), stage='downloads')
+        return pending
+
+    def _run_task(self, task, total):
+        if self.is_cancelled:
+            return
+        limiter = ratelimit.limiter('download')
+        held = limiter.acquire_slot()
+        if self.is_cancelled:
+            limiter.release_slot(held)
+            return
+        self._notify("start", task, total)
+        try:
+            with metrics.span('download', trace={'file': task.file_name}):
+                task.state = self.download(task)
+        except Exception as e:
+            logging.error(f"Error downloading {task.url}: {e}")
+            task.state = 'error'
+        finally:
+            limiter.release_slot(held)
+        self._task_finished(task, total)
+
+    def _task_finished(self, task, total):
+        metrics.inc('downloads_total', state=task.state)
+        if task.state == 'done':
+            with self.lock:
+                self.done += 1
+        self._notify(task.state if task.state != 'failed' else "error", task, total)
+        self.save_queue()
+
+    def _notify(self, event, task, total):
+        if self.on_progress:
+            self.on_progress(event, task.file_name, self.done, total)
+
+    def download(self, task):
+        file_path, algorithm, expected, stored = self._target(task)
+        if stored:
+            with self.lock:
+                object_lock = self.object_locks.setdefault(stored, threading.Lock())
+            # A second task for the same object waits for the first, then just links it
+            with object_lock:
+                if self._link_stored(task, file_path, algorithm, expected, stored):
+                    return 'skipped'
+                return self._fetch(task, file_path, algorithm, expected, stored)
+        if not task.replace and self.is_complete(file_path, task):
+            return 'skipped'
+        return self._fetch(task, file_path, algorithm, expected)
+
+    def _target(self, task):
+        """``(file_path, algorithm, expected, stored)`` for ``task``; ``stored`` is its object path under ``'cas'``."""
+        file_path = os.path.join(self.download_dir, task.file_name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        algorithm, expected = integrity.expected_checksum(task.md5, task.sha1)
+        stored = object_path(self.download_dir, algorithm, expected) if self.layout == 'cas' and expected else None
+        return file_path, algorithm, expected, stored
+
+    def _link_stored(self, task, file_path, algorithm, expected, stored):
+        """Link ``file_path`` to the object ``stored`` if it is already there; returns whether it was."""
+        if not (os.path.exists(stored) and (not task.size or os.path.getsize(stored) == task.size)):
+            os.makedirs(os.path.dirname(stored), exist_ok=True)
+            return False
+        if not (os.path.exists(file_path) and os.path.samefile(file_path, stored)):
+            link_object(stored, file_path, self.link)
+            self._record_checksum(algorithm, expected, task.file_name)
+            self._record_owner(task)
+            with self.lock:
+                self.deduplicated += 1
+                self.bytes_deduplicated += os.path.getsize(stored)
+        return True
+
+    def _segmented(self, task):
+        # A segmented .part is preallocated to full size, so it must be finished the same way
+        return bool(task.segments or (task.size and self.segment_size and task.size >= self.segment_size
+                                      and self.segments > 1))
+
+    def _fetch(self, task, file_path, algorithm, expected, stored=None):
+        """Download and verify ``task`` into ``file_path``, or into the object ``stored`` linked from there."""
+        part_path = file_path + PART_SUFFIX
+        for attempt in range(self.max_verify_attempts + 1):
+            if self._segmented(task):
+                state = self._download_segmented(task, part_path)
+                digest = None
+                if state == 'done' and algorithm:
+                    # Ranges arrive out of order, so segmented files are hashed once at the end
+                    digest = integrity.hash_file(part_path, algorithm)
+            else:
+                state = 'no-range'
+            if state == 'no-range':
+                state, digest = self._download_stream(task, part_path, algorithm)
+            if state != 'done':
+                return state
+            if self._place(task, part_path, file_path, algorithm, expected, digest, stored):
+                return 'done'
+        return 'error'
+
+    def _place(self, task, part_path, file_path, algorithm, expected, digest, stored=None):
+        """Move a finished ``part_path`` into place if it verifies, else quarantine it; returns whether it verified."""
+        size = os.path.getsize(part_path)
+        if (expected and digest != expected) or (task.size and size != task.size):
+            target = integrity.quarantine(part_path, self.download_dir, task.file_name)
+            with self.lock:
+                self.corrupt += 1
+            logging.error(f"{task.file_name} failed verification ({size} bytes, {algorithm} {digest}, "
+                          f"expected {task.size} bytes, {expected}); quarantined as {target}")
+            return False
+        if stored:
+            os.replace(part_path, stored)
+            link_object(stored, file_path, self.link)
+        else:
+            os.replace(part_path, file_path)
+        if expected:
+            self._record_checksum(algorithm, expected, task.file_name)
+        self._record_owner(task)
+        return True
+
+    def _record_owner(self, task):
+        if not task.identifier:
+            return
+        with self.lock:
+            if self.owners is None:
+                self.owners = read_owners(self.download_dir)
+            if self.owners.get(task.file_name) != task.identifier:
+                record_owner(self.download_dir, task.identifier, task.file_name)
+                self.owners[task.file_name] = task.identifier
+
+    def _record_checksum(self, algorithm, digest, file_name):
+        with self.lock:
+            integrity.record_checksum(self.download_dir, algorithm, digest, file_name)
+            if self.recorded is not None:
+                self.recorded[file_name] = (algorithm, digest)
+
+    def is_complete(self, file_path, task):
+        if not os.path.exists(file_path):
+            return False
+        size = task.size
+        if size is None:
+            with transport.get(task.url, traffic='download', stream=True) as response:
+                size = int(response.headers.get('Content-Length', -1)) if response.status_code == 200 else -1
+        return os.path.getsize(file_path) == size
+
+    def _download_stream(self, task, part_path, algorithm=None):
+        """Stream ``task`` into ``part_path``, hashing as it goes; returns ``(state, hexdigest)``."""
+        for attempt in range(self.max_resume_attempts + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            hasher = hashlib.new(algorithm) if algorithm else None
+            if task.size and offset >= task.size:
+                return 'done', hasher and integrity.update_from_file(hasher, part_path).hexdigest()
+            headers = {'Range': f"bytes={offset}-"} if offset else {}
+            try:
+                with transport.get(task.url, traffic='download', stream=True, headers=headers) as response:
+                    if response.status_code == 416:
+                        return 'done', hasher and integrity.update_from_file(hasher, part_path).hexdigest()
+                    if response.status_code not in (200, 206):
+                        return failure_state(task, response.status_code), None
+                    mode = 'ab' if response.status_code == 206 else 'wb'
+                    if hasher and mode == 'ab':
+                        # Only the part already on disk is re-read; everything new is hashed in flight
+                        integrity.update_from_file(hasher, part_path)
+                    with open(part_path, mode) as file:
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            if self.is_cancelled:
+                                return 'pending', None
+                            file.write(chunk)
+                            if hasher:
+                                hasher.update(chunk)
+                            self._count(len(chunk))
+                return 'done', hasher and hasher.hexdigest()
+            except RESUME_ERRORS as e:
+                logging.warning(f"Connection lost downloading {task.url} ({e}), resuming (attempt {attempt + 1})")
+        return 'error', None
+
+    def _download_segmented(self, task, part_path):
+        if not task.segments or not os.path.exists(part_path):
+            segment_length = -(-task.size // self.segments)
+            task.segments = [[start, min(start + segment_length, task.size) - 1, start]
+                             for start in range(0, task.size, segment_length)]
+            with open(part_path, 'wb') as file:
+                file.truncate(task.size)
+            self.save_queue()
+        with ThreadPoolExecutor(max_workers=len(task.segments)) as executor:
+            states = list(executor.map(lambda segment: self._download_range(task, part_path, segment), task.segments))
+        if 'no-range' in states:
+            os.remove(part_path)
+            task.segments = None
+            return 'no-range'
+        for state in ('error', 'pending', 'failed'):
+            if state in states:
+                return state
+        task.segments = None
+        return 'done'
+
+    def _download_range(self, task, part_path, segment):
+        start, end, _ = segment
+        for attempt in range(self.max_resume_attempts + 1):
+            if segment[2] > end:
+                return 'done'
+            try:
+                headers = {'Range': f"bytes={segment[2]}-{end}"}
+                with transport.get(task.url, traffic='download', stream=True, headers=headers) as response:
+                    if response.status_code == 200:
+                        return 'no-range'
+                    if response.status_code != 206:
+                        return failure_state(task, response.status_code)
+                    with open(part_path, 'r+b') as file:
+                        file.seek(segment[2])
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            if self.is_cancelled:
+                                return 'pending'
+                            file.write(chunk)
+                            segment[2] += len(chunk)
+                            self._count(len(chunk))
+                return 'done'
+            except RESUME_ERRORS as e:
+                logging.warning(f"Connection lost downloading {task.url} range {start}-{end} ({e}), resuming")
+        return 'error'
+
+    def _count(self, n):
+        metrics.inc('http_bytes_total', n, traffic='download')
+        with self.lock:
+            self.bytes_downloaded += n
+            save_due = time.monotonic() - self.last_save > QUEUE_SAVE_INTERVAL
+        # Keeps segment offsets on disk so a crash only loses the last few seconds
+        if save_due:
+            self.save_queue()
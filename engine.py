@@ -0,0 +1,502 @@
+import os
+import re
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import quote
+
+# The HTTP and HTML parsing stacks (transport, html_parse) are imported where
+# they're first needed, so the GUI and other light users of the records and
+# helpers here start without loading requests, bs4 or lxml
+import metrics
+
+common_file_types = ['pdf', 'epub', 'mobi', 'txt', 'doc', 'docx', 'rtf', 'djvu']
+
+# Point this at a mock server (see bench/mock_archive.py) to run offline
+ARCHIVE_URL = os.environ.get('ARCHIVE_ORG_URL', 'https://archive.org')
+
+# Optional item_cache.ItemCache shared by every resolver
+item_cache = None
+
+# How details pages are parsed when they have to be scraped (None: the fastest
+# installed backend); see set_html_parser
+html_parser = None
+parse_pool = None
+
+# Search hits are only used for their identifier; titles, descriptions and
+# file lists all come from the item's metadata later
+SEARCH_RESULT_FIELDS = ('identifier',)
+DEFAULT_ROWS = 1000
+
+# archive.org's names for the formats a file type can appear as in an item's
+# ``format`` field. Types missing here turn the query prefilter off, since
+# excluding items on a guess would lose files.
+FORMAT_NAMES = {
+    'pdf': ('Text PDF', 'Image Container PDF', 'Additional Text PDF', 'PDF'),
+    'epub': ('EPUB',),
+    'djvu': ('DjVu',),
+    'txt': ('DjVuTXT', 'Text'),
+    'doc': ('Microsoft Word',),
+    'rtf': ('Rich Text Format',),
+}
+
+# The first five fields are what the details-page scraper has always returned;
+# the rest are only known when the item was resolved from its metadata
+FileRecord = namedtuple('FileRecord', ['file_name', 'book_name', 'download_url', 'file_size', 'description',
+                                       'identifier', 'md5', 'sha1', 'format', 'source'],
+                        defaults=(None, None, None, None, None))
+
+def has_exact_size(record):
+    """Whether ``record.file_size`` is the byte count the metadata API published, not a details page's rounded label."""
+    # Only records resolved from the metadata API carry their item's identifier
+    return record.identifier is not None
+
+def fetch_file_data(item_url, file_types):
+    import transport
+
+    result = []
+    try:
+        response = transport.get(item_url, traffic='metadata')
+        result = parse_details_page(response.content, file_types)
+    except Exception as e:
+        logging.error(f"Error fetching data for {item_url}: {e}")
+    return result
+
+def parse_details_page(content, file_types):
+    import html_parse
+
+    backend = html_parser or html_parse.DEFAULT_BACKEND
+    with metrics.span('parse', backend=backend, pool=parse_pool is not None):
+        if parse_pool is not None:
+            rows = parse_pool.parse(content, file_types, ARCHIVE_URL)
+        else:
+            rows = html_parse.parse_details(content, file_types, ARCHIVE_URL, backend)
+    return [FileRecord(*row) for row in rows]
+
+def set_html_parser(backend=None, processes=0):
+    """Parse details pages with ``backend`` (see ``html_parse.BACKENDS``), in ``processes`` worker processes if not 0."""
+    import html_parse
+
+    global html_parser, parse_pool
+    backend = backend or html_parse.DEFAULT_BACKEND
+    if backend not in html_parse.BACKENDS:
+        raise RuntimeError(f"The {backend} HTML parser isn't installed: pip install {backend}")
+    if parse_pool is not None:
+        parse_pool.close()
+    html_parser = backend
+    parse_pool = html_parse.ParsePool(processes, backend) if processes else None
+
+def set_item_cache(cache):
+    global item_cache
+    item_cache = cache
+    if cache is not None:
+        for stat in ('hits', 'misses', 'stale', 'hit_ratio'):
+            metrics.gauge(f"item_cache_{stat}", lambda stat=stat: cache.stats()[stat])
+
+def revalidation_headers(cached):
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+    return headers
+
+def remember_item_metadata(identifier, cached, status, metadata, headers):
+    """Reconcile a metadata response with the cache entry it revalidated; returns the metadata to use."""
+    if status == 304 and cached is not None:
+        item_cache.touch(identifier)
+        return cached.metadata
+    if status != 200:
+        # A stale listing beats none at all while the API is failing
+        return cached.metadata if cached is not None else {}
+    if item_cache is not None and metadata.get('files'):
+        item_cache.put(identifier, metadata, headers.get('ETag'), headers.get('Last-Modified'))
+    return metadata
+
+def load_item_metadata(identifier):
+    import transport
+
+    cached = item_cache.get(identifier) if item_cache is not None else None
+    if cached is not None and cached.fresh:
+        return cached.metadata
+    try:
+        response = transport.get(f"{ARCHIVE_URL}/metadata/{identifier}", traffic='metadata',
+                                 headers=revalidation_headers(cached))
+        metadata = response.json() if response.status_code == 200 else {}
+        status, headers = response.status_code, response.headers
+    except Exception as e:
+        logging.warning(f"Metadata lookup failed for {identifier}: {e}")
+        status, metadata, headers = None, {}, {}
+    return remember_item_metadata(identifier, cached, status, metadata, headers)
+
+def metadata_text(value, default):
+    if isinstance(value, list):
+        value = " ".join(str(v) for v in value)
+    return value.strip() if value else default
+
+class ItemUnavailable(Exception):
+    """An item couldn't be resolved right now (throttled or failing server), as opposed to having no matching files."""
+
+def resolve_item_files(identifier, file_types):
+    """Resolve an item's files from the metadata API, scraping the details page only as a fallback.
+
+    Returns the same records as ``fetch_file_data`` except that ``file_size`` is
+    the exact byte count published in the metadata and checksums are filled in.
+    Listings come from ``item_cache`` when one is set (see ``set_item_cache``).
+    Raises ``ItemUnavailable`` when neither source answers, so the item isn't
+    mistaken for one without files.
+    """
+    metadata = load_item_metadata(identifier)
+    if not metadata.get('files'):
+        import transport
+
+        logging.warning(f"No file listing for {identifier}, falling back to details page")
+        try:
+            response = transport.get(f"{ARCHIVE_URL}/details/{identifier}", traffic='metadata')
+        except Exception as e:
+            raise ItemUnavailable(f"{identifier}: {e}")
+        if response.status_code in transport.RETRY_STATUSES:
+            raise ItemUnavailable(f"{identifier}: HTTP {response.status_code}")
+        return parse_details_page(response.content, file_types)
+    return files_from_metadata(identifier, metadata, file_types)
+
+def files_from_metadata(identifier, metadata, file_types):
+    item_metadata = metadata.get('metadata', {})
+    book_name = metadata_text(item_metadata.get('title'), "Unknown")
+    description = metadata_text(item_metadata.get('description'), "No description available.")
+    suffixes = tuple(f".{file_type.lower()}" for file_type in file_types)
+    result = []
+    for file_info in metadata.get('files', []):
+        name = file_info.get('name', '')
+        if not name.lower().endswith(suffixes):
+            continue
+        download_url = f"{ARCHIVE_URL}/download/{identifier}/{quote(name)}"
+        result.append(FileRecord(os.path.basename(name), book_name, download_url, int(file_info.get('size') or 0),
+                                 description, identifier, file_info.get('md5'), file_info.get('sha1'),
+                                 file_info.get('format'), file_info.get('source')))
+    return result
+
+def parse_size(size_str):
+    if isinstance(size_str, int):
+        return size_str
+    if not size_str or size_str.lower() == 'unknown':
+        return 0
+    size_str = size_str.replace(',', '').strip()
+    match = re.match(r"([\d.]+)\s*([KMGT]?B?)", size_str, re.I)
+    if not match:
+        return 0
+    size, unit = match.groups()
+    size = float(size)
+    unit = unit.upper() if unit else 'B'
+    units = {'B': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    return int(size * units.get(unit[:1], 1))
+
+def format_size(size):
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+
+def build_advanced_query(**kwargs):
+    query_parts = []
+    if kwargs.get('language'):
+        query_parts.append(f"language:{kwargs['language']}")
+    if kwargs.get('start_year') and kwargs.get('end_year'):
+        query_parts.append(f"year:[{kwargs['start_year']} TO {kwargs['end_year']}]")
+    if kwargs.get('keyword'):
+        query_parts.append(f"title:{kwargs['keyword']}")
+    if kwargs.get('author'):
+        query_parts.append(f"creator:{kwargs['author']}")
+    if kwargs.get('collection'):
+        query_parts.append(f"collection:{kwargs['collection']}")
+    if kwargs.get('added_since'):
+        query_parts.append(f"addeddate:[{kwargs['added_since']} TO null]")
+    return " AND ".join(query_parts)
+
+def build_format_filter(file_types):
+    """Query clause matching only items that hold one of ``file_types``, or None if that can't be told from the index."""
+    names = []
+    for file_type in file_types:
+        file_type = file_type.lower().lstrip('.')
+        if file_type not in FORMAT_NAMES:
+            return None
+        names.extend(name for name in FORMAT_NAMES[file_type] if name not in names)
+    if not names:
+        return None
+    return "format:(" + " OR ".join(f'"{name}"' for name in names) + ")"
+
+def build_search_url(query, rows=DEFAULT_ROWS, fields=SEARCH_RESULT_FIELDS):
+    field_params = "".join(f"&fl[]={field}" for field in fields)
+    return f"{ARCHIVE_URL}/advancedsearch.php?q={query}{field_params}&sort[]=downloads+desc&rows={rows}&output=json"
+
+def build_scrape_url(query, count=10000):
+    return f"{ARCHIVE_URL}/services/search/v1/scrape?q={query}&fields=identifier&count={count}"
+
+class Harvester:
+    """Runs search -> enumerate items -> resolve files without touching any GUI.
+
+    A producer thread pages through the search results ahead of the resolvers
+    and feeds identifiers into a bounded queue, which one long-lived pool of
+    ``max_workers`` resolvers drains; the bound keeps memory flat however many
+    hits the search has. Progress is reported from the thread calling ``run``:
+    ``on_status(harvester)`` after every change to the counters and
+    ``on_file(record)`` for every file found, where ``record`` is a
+    ``FileRecord`` whose ``file_size`` is always a byte count.
+
+    To continue an earlier run, pass the ``start_page``/``start_cursor`` it
+    reached and the identifiers it already resolved as ``skip_identifiers``.
+    ``on_item(identifier, records)`` is called as each item is resolved and
+    ``on_checkpoint(page, cursor)`` whenever every item up to a search page has
+    been, with where the next run should start paging.
+
+    Search pages ask for identifiers only, ``rows`` at a time. With
+    ``prefilter`` the query also excludes items whose formats can't include
+    any of ``file_types`` (see ``build_format_filter``), so they are never
+    resolved. A resumed run must page with the same ``rows`` and
+    ``prefilter`` as the run it continues. With ``identifiers`` there is no
+    search: that list of items is resolved instead, paged ``rows`` at a time.
+
+    With a ``selection`` (a ``selection.SelectionPolicy``) each item's files
+    are narrowed down as it is resolved, and only those it keeps are
+    reported; the others are counted in ``deselected_files`` and
+    ``avoided_size``.
+
+    ``max_workers`` is only a ceiling: how many lookups actually run at once is
+    set by the adaptive ``"metadata"`` limit in ``ratelimit``. Items that can't
+    be resolved are listed in ``failed_items`` and hold the checkpoint back,
+    so a resumed run tries them again. A search page that fails or comes back
+    malformed ends the run early with ``search_failed`` set: the items on the
+    pages after it were never listed, so the results are incomplete even
+    though the run finished.
+    """
+
+    def __init__(self, search_params, file_types, on_file=None, on_status=None, max_workers=32,
+                 rows=DEFAULT_ROWS, prefetch_pages=2, use_scrape_api=False, start_page=1, start_cursor=None,
+                 skip_identifiers=(), on_item=None, on_checkpoint=None, prefilter=True, identifiers=None,
+                 selection=None):
+        import transport
+
+        self.search_params = {k: v for k, v in search_params.items() if v}
+        self.file_types = tuple(file_types)
+        self.query = build_advanced_query(**self.search_params)
+        format_filter = build_format_filter(self.file_types) if prefilter else None
+        if format_filter:
+            self.query = f"{self.query} AND {format_filter}" if self.query else format_filter
+        self.rows = rows
+        self.base_url = build_search_url(self.query, rows)
+        self.use_scrape_api = use_scrape_api
+        self.identifiers = identifiers
+        self.selection = selection
+        self.on_file = on_file
+        self.on_status = on_status
+        self.max_workers = max_workers
+        self.queue_size = rows * prefetch_pages
+        transport.default_client().ensure_pool_size(max_workers + 1)
+        self.total_files = 0
+        self.total_size = 0
+        self.total_items = 0
+        self.deselected_files = 0
+        self.avoided_size = 0
+        self.is_paused = False
+        self.is_cancelled = False
+        self.total_available_files = 0
+        self.progress = 0
+        self.page = start_page
+        self.cursor = start_cursor
+        self.skip_identifiers = skip_identifiers
+        self.skipped_items = 0
+        self.failed_items = []
+        self.search_failed = False
+        self.on_item = on_item
+        self.on_checkpoint = on_checkpoint
+        # Search page sequence number -> [items still resolving, next page, next cursor]
+        self.pages = {}
+        self.next_checkpoint = 0
+        self.checkpoint_lock = threading.Lock()
+
+    def iter_identifiers(self):
+        for identifiers, page, cursor in self.iter_pages():
+            yield from identifiers
+
+    def iter_pages(self):
+        """Yield ``(identifiers, page, cursor)`` for each search page, ``page``/``cursor`` being where the next one starts."""
+        import transport
+
+        if self.identifiers is not None:
+            yield from self._iter_identifier_pages()
+            return
+        if self.use_scrape_api:
+            yield from self._iter_scrape_pages()
+            return
+        yielded = (self.page - 1) * self.rows
+        while not self.is_cancelled:
+            url = f"{self.base_url}&page={self.page}"
+            with metrics.span('search_page', api='advancedsearch'):
+                response = transport.get(url, traffic='search')
+            data = response.json() if response.status_code == 200 else {}
+            if "response" not in data or "docs" not in data["response"]:
+                logging.error(f"Unexpected search response (HTTP {response.status_code}) for {url}")
+                self.search_failed = True
+                return
+            docs = data["response"]["docs"]
+            self.total_available_files = int(data["response"]["numFound"])
+            if not docs:  # If we've reached a page with no results, stop
+                return
+            yielded += len(docs)
+            self.page += 1  # Move to the next page
+            yield [doc['identifier'] for doc in docs], self.page, None
+            if yielded >= self.total_available_files:
+                return
+
+    def _iter_scrape_pages(self):
+        # The scrape API pages with an opaque cursor instead of page numbers, so deep
+        # result sets don't get slower (or capped) the further in we are
+        import transport
+
+        scrape_url = build_scrape_url(self.query, max(self.rows, 100))
+        while not self.is_cancelled:
+            url = f"{scrape_url}&cursor={self.cursor}" if self.cursor else scrape_url
+            with metrics.span('search_page', api='scrape'):
+                response = transport.get(url, traffic='search')
+            data = response.json() if response.status_code == 200 else {}
+            if "items" not in data:
+                logging.error(f"Unexpected scrape response (HTTP {response.status_code}) for {url}: "
+                              f"{data.get('error')}")
+                self.search_failed = True
+                return
+            self.total_available_files = int(data.get("total", self.total_available_files))
+            self.cursor = data.get("cursor")
+            self.page += 1
+            yield [doc['identifier'] for doc in data["items"]], self.page, self.cursor
+            if not self.cursor or not data["items"]:
+                return
+
+    def _iter_identifier_pages(self):
+        self.total_available_files = len(self.identifiers)
+        while not self.is_cancelled:
+            start = (self.page - 1) * self.rows
+            page_identifiers = self.identifiers[start:start + self.rows]
+            if not page_identifiers:
+                return
+            self.page += 1
+            yield page_identifiers, self.page, None
+
+    def _produce(self, identifiers):
+        try:
+            for sequence, (page_identifiers, page, cursor) in enumerate(self.iter_pages()):
+                todo = [identifier for identifier in page_identifiers if identifier not in self.skip_identifiers]
+                self.skipped_items += len(page_identifiers) - len(todo)
+                metrics.inc('items_skipped_total', len(page_identifiers) - len(todo))
+                with self.checkpoint_lock:
+                    self.pages[sequence] = [len(todo), page, cursor]
+                for identifier in todo:
+                    if not self._put(identifiers, (identifier, sequence)):
+                        return
+        except Exception as e:
+            logging.error(f"Error paging search results for {self.query}: {e}")
+            self.search_failed = True
+        self._put(identifiers, None)
+
+    def _put(self, identifiers, identifier):
+        while not self.is_cancelled:
+            try:
+                identifiers.put(identifier, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        identifiers = queue.Queue(maxsize=self.queue_size)
+        producer = threading.Thread(target=self._produce, args=(identifiers,), daemon=True)
+        producer.start()
+        max_in_flight = self.max_workers * 2
+        pending = {}
+        metrics.gauge('queue_depth', identifiers.qsize, stage='identifiers')
+        metrics.gauge('queue_depth', lambda: len(pending), stage='resolving')
+        producer_done = False
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while not self.is_cancelled:
+                while self.is_paused and not self.is_cancelled:
+                    time.sleep(0.1)
+                while len(pending) < max_in_flight and not producer_done:
+                    try:
+                        item = identifiers.get(timeout=0 if pending else 0.1)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        producer_done = True
+                        break
+                    pending[executor.submit(self._resolve, item[0])] = item
+                self._advance_checkpoint()
+                if not pending:
+                    if producer_done:
+                        break
+                    continue
+                done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for item_future in done:
+                    identifier, sequence = pending.pop(item_future)
+                    try:
+                        result = item_future.result()
+                    except ItemUnavailable as e:
+                        logging.error(f"Could not resolve {e}")
+                        self.failed_items.append(identifier)
+                        metrics.inc('items_failed_total')
+                        self._notify_status()
+                        continue
+                    self._add_item(result, identifier)
+                    with self.checkpoint_lock:
+                        self.pages[sequence][0] -= 1
+            if self.is_cancelled:
+                executor.shutdown(wait=True, cancel_futures=True)
+            else:
+                self._advance_checkpoint()
+
+        self.progress = 100
+        self._notify_status()
+
+    def _resolve(self, identifier):
+        with metrics.span('item_resolve', trace={'identifier': identifier}):
+            return resolve_item_files(identifier, self.file_types)
+
+    def _advance_checkpoint(self):
+        # Pages complete out of order; the checkpoint only moves past a run of finished ones
+        checkpoint = None
+        with self.checkpoint_lock:
+            while self.next_checkpoint in self.pages and self.pages[self.next_checkpoint][0] == 0:
+                checkpoint = self.pages.pop(self.next_checkpoint)[1:]
+                self.next_checkpoint += 1
+        if checkpoint and self.on_checkpoint:
+            self.on_checkpoint(*checkpoint)
+
+    def _add_item(self, result, identifier=None):
+        self.total_items += 1
+        if self.total_available_files:
+            done = self.total_items + self.skipped_items
+            self.progress = min((done / self.total_available_files) * 100, 100)
+        records = [record._replace(file_size=parse_size(record.file_size)) for record in result]
+        if self.selection:
+            records, dropped = self.selection.select(records)
+            avoided = sum(record.file_size for record in dropped)
+            self.deselected_files += len(dropped)
+            self.avoided_size += avoided
+            metrics.inc('files_deselected_total', len(dropped))
+            metrics.inc('bytes_avoided_total', avoided)
+        metrics.inc('items_resolved_total')
+        metrics.inc('files_found_total', len(records))
+        if self.on_item and identifier is not None:
+            self.on_item(identifier, records)
+        for record in records:
+            self.total_files += 1
+            self.total_size += record.file_size
+            if self.on_file:
+                self.on_file(record)
+        self._notify_status()
+
+    def _notify_status(self):
+        if self.on_status:
+            self.on_status(self)
@@ -0,0 +1,187 @@
+import csv
+import json
+import os
+import time
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # optional dependency, only needed for Parquet and Arrow exports
+    pyarrow = None
+
+from engine import FileRecord, format_size
+
+EXPORT_COLUMNS = ('File Name', 'Book Name', 'Size', 'URL', 'Description')
+FLUSH_INTERVAL = 2.0
+ROW_GROUP_SIZE = 10000
+
+def export_row(record):
+    """The labelled fields the GUI, the CLI and the text exporters share."""
+    return {'File Name': record.file_name, 'Book Name': record.book_name,
+            'Size': format_size(record.file_size or 0), 'URL': record.download_url,
+            'Description': record.description}
+
+class Exporter:
+    """Writes records to ``path`` as they arrive, flushing at least every ``flush_interval`` seconds.
+
+    Nothing is held back beyond the file buffer (or one row group for the
+    columnar formats), so memory stays flat and a killed run leaves everything
+    up to the last flush on disk. Text formats append to an existing file.
+    """
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.rows = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, record):
+        self.write(record)
+        self.rows += 1
+        if time.monotonic() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def add_many(self, records):
+        for record in records:
+            self.add(record)
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class TextExporter(Exporter):
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        Exporter.__init__(self, path, flush_interval)
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.is_new = self.file.tell() == 0
+
+    def flush(self):
+        self.file.flush()
+        Exporter.flush(self)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+class JsonlExporter(TextExporter):
+    def write(self, record):
+        self.file.write(json.dumps(export_row(record), ensure_ascii=False) + '\n')
+
+class CsvExporter(TextExporter):
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        TextExporter.__init__(self, path, flush_interval)
+        self.writer = csv.writer(self.file)
+        if self.is_new:
+            self.writer.writerow(EXPORT_COLUMNS)
+
+    def write(self, record):
+        self.writer.writerow(export_row(record).values())
+
+class TxtExporter(TextExporter):
+    def write(self, record):
+        for column, value in export_row(record).items():
+            self.file.write(f"{column}: {value}\n")
+        self.file.write("\n---\n\n")
+
+class JsonExporter(TextExporter):
+    """A JSON array written one element at a time; only valid JSON once closed."""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        TextExporter.__init__(self, path, flush_interval)
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write('[')
+
+    def write(self, record):
+        self.file.write(',\n' if self.rows else '\n')
+        self.file.write(json.dumps(export_row(record), ensure_ascii=False, indent=2))
+
+    def close(self):
+        if not self.file.closed:
+            self.file.write('\n]\n')
+        TextExporter.close(self)
+
+class ColumnarExporter(Exporter):
+    """Buffers up to ``row_group_size`` records column-wise and writes them as one batch."""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, row_group_size=ROW_GROUP_SIZE):
+        if pyarrow is None:
+            raise RuntimeError("Parquet and Arrow exports need pyarrow: pip install pyarrow")
+        Exporter.__init__(self, path, flush_interval)
+        self.row_group_size = row_group_size
+        self.schema = pyarrow.schema([(name, pyarrow.int64() if name == 'file_size' else pyarrow.string())
+                                      for name in FileRecord._fields])
+        self.pending = []
+        self.writer = None
+
+    def write(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= self.row_group_size:
+            self.write_batch()
+
+    def flush(self):
+        # Small row groups make poor Parquet files, so time-based flushes only apply to Arrow streams
+        if self.flushes_partial_groups:
+            self.write_batch()
+        Exporter.flush(self)
+
+    def write_batch(self):
+        if not self.pending:
+            return
+        columns = list(zip(*self.pending))
+        self.pending = []
+        batch = pyarrow.record_batch([pyarrow.array(column, type=field.type)
+                                      for column, field in zip(columns, self.schema)], schema=self.schema)
+        if self.writer is None:
+            self.writer = self.open_writer()
+        self.writer.write_batch(batch)
+
+    def close(self):
+        self.write_batch()
+        if self.writer is None:
+            self.writer = self.open_writer()
+        self.writer.close()
+
+class ParquetExporter(ColumnarExporter):
+    """Parquet with one row group per ``row_group_size`` records; the footer is written on close."""
+
+    flushes_partial_groups = False
+
+    def open_writer(self):
+        return pyarrow.parquet.ParquetWriter(self.path, self.schema)
+
+class ArrowExporter(ColumnarExporter):
+    """Arrow IPC stream; readable up to the last complete batch even if the run is killed."""
+
+    flushes_partial_groups = True
+
+    def open_writer(self):
+        self.sink = pyarrow.OSFile(self.path, 'wb')
+        return pyarrow.ipc.new_stream(self.sink, self.schema)
+
+    def close(self):
+        ColumnarExporter.close(self)
+        self.sink.close()
+
+EXPORTERS = {
+    '.jsonl': JsonlExporter,
+    '.ndjson': JsonlExporter,
+    '.csv': CsvExporter,
+    '.txt': TxtExporter,
+    '.json': JsonExporter,
+    '.parquet': ParquetExporter,
+    '.arrow': ArrowExporter,
+}
+
+def open_exporter(path, **kwargs):
+    """Return the exporter for ``path``'s extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXPORTERS:
+        raise ValueError(f"Don't know how to export to {extension or path!r}; use one of {', '.join(EXPORTERS)}")
+    return EXPORTERS[extension](path, **kwargs)
@@ -0,0 +1,120 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:  # optional dependency, a faster parser backend
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # optional dependency, the fastest parser backend
+    LexborHTMLParser = None
+
+def class_xpath(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+def details_fields(links, title, description, page_size, file_types, archive_url):
+    """Turn a page's ``(href, size)`` download links into ``(file_name, book_name, download_url, size, description)`` rows."""
+    result = []
+    file_links = set()
+    for file_type in file_types:
+        suffix = f".{file_type}"
+        for href, size in links:
+            if not href.endswith(suffix):
+                continue
+            download_url = f"{archive_url}{href}"
+            if download_url not in file_links:
+                file_links.add(download_url)
+                result.append((os.path.basename(download_url), title, download_url, size or page_size, description))
+    return result
+
+def parse_with_html_parser(content, file_types, archive_url):
+    soup = BeautifulSoup(content, 'html.parser')
+    links = [(link['href'], link.get('data-original-title') or link.get('title'))
+             for link in soup.select('a.download-pill[href]')]
+    title = soup.find('h1', class_='item-title')
+    description = soup.select_one('div[itemprop="description"]')
+    size = soup.select_one('.item-stats .size')
+    return details_fields(links, title.text.strip() if title else "Unknown",
+                          description.text.strip() if description else "No description available.",
+                          size.text.strip() if size else 'Unknown', file_types, archive_url)
+
+def parse_with_lxml(content, file_types, archive_url):
+    if isinstance(content, bytes):
+        # Without a charset lxml assumes Latin-1; archive.org pages are UTF-8
+        try:
+            content = content.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+    document = lxml.html.fromstring(content)
+    links = [(link.get('href'), link.get('data-original-title') or link.get('title'))
+             for link in document.xpath(f"//a[{class_xpath('download-pill')}][@href]")]
+    title = document.xpath(f"//h1[{class_xpath('item-title')}]")
+    description = document.xpath("//div[@itemprop='description']")
+    size = document.xpath(f"//*[{class_xpath('item-stats')}]//*[{class_xpath('size')}]")
+    return details_fields(links, title[0].text_content().strip() if title else "Unknown",
+                          description[0].text_content().strip() if description else "No description available.",
+                          size[0].text_content().strip() if size else 'Unknown', file_types, archive_url)
+
+def parse_with_selectolax(content, file_types, archive_url):
+    tree = LexborHTMLParser(content)
+    links = []
+    for link in tree.css('a.download-pill[href]'):
+        attributes = link.attributes
+        links.append((attributes['href'], attributes.get('data-original-title') or attributes.get('title')))
+    title = tree.css_first('h1.item-title')
+    description = tree.css_first('div[itemprop="description"]')
+    size = tree.css_first('.item-stats .size')
+    return details_fields(links, title.text().strip() if title else "Unknown",
+                          description.text().strip() if description else "No description available.",
+                          size.text().strip() if size else 'Unknown', file_types, archive_url)
+
+BACKENDS = {'html.parser': parse_with_html_parser}
+if lxml is not None:
+    BACKENDS['lxml'] = parse_with_lxml
+if LexborHTMLParser is not None:
+    BACKENDS['selectolax'] = parse_with_selectolax
+# The fastest one installed; they all extract the same fields
+DEFAULT_BACKEND = list(BACKENDS)[-1]
+
+def parse_details(content, file_types, archive_url, backend=DEFAULT_BACKEND):
+    """Extract a details page's download links as ``(file_name, book_name, download_url, size, description)`` rows.
+
+    The title, description and page-wide size are read once per page; each
+    link only contributes its href and its own size label.
+    """
+    if not content.strip():
+        return []
+    return BACKENDS[backend](content, file_types, archive_url)
+
+class ParsePool:
+    """Parses details pages in worker processes, so scraping isn't held back by the GIL.
+
+    Resolver threads keep doing the fetching and hand the raw bytes over
+    with ``parse``, which blocks until a worker is done. Workers are started
+    on first use, with the ``spawn`` method because the pool is created while
+    other threads are running; the main module therefore needs an
+    ``if __name__ == '__main__'`` guard.
+    """
+
+    def __init__(self, processes=None, backend=DEFAULT_BACKEND):
+        self.processes = processes or os.cpu_count()
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def parse(self, content, file_types, archive_url):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor.submit(parse_details, content, tuple(file_types), archive_url, self.backend).result()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+QUARANTINE_DIR = '.quarantine'
+# Written next to the downloads in md5sum/sha1sum format, so `md5sum -c` works too
+CHECKSUM_FILES = {'md5': '.checksums.md5', 'sha1': '.checksums.sha1'}
+MMAP_SLICE = 64 << 20
+
+def expected_checksum(md5=None, sha1=None):
+    """Return ``(algorithm, hexdigest)`` for the checksum archive.org published, or ``(None, None)``."""
+    if md5:
+        return 'md5', md5.lower()
+    if sha1:
+        return 'sha1', sha1.lower()
+    return None, None
+
+def update_from_file(hasher, path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hasher
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(view), MMAP_SLICE):
+                    hasher.update(view[offset:offset + MMAP_SLICE])
+            finally:
+                view.release()
+    return hasher
+
+def hash_file(path, algorithm='md5'):
+    return update_from_file(hashlib.new(algorithm), path).hexdigest()
+
+def quarantine(path, download_dir, file_name):
+    # The random part keeps two failures of one file within a second from overwriting each other
+    target = os.path.join(download_dir, QUARANTINE_DIR, f"{file_name}.{int(time.time())}.{uuid.uuid4().hex[:8]}")
+    # file_name may be in an item folder
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.move(path, target)
+    return target
+
+def record_checksum(download_dir, algorithm, digest, file_name):
+    with open(os.path.join(download_dir, CHECKSUM_FILES[algorithm]), 'a', encoding='utf-8') as f:
+        f.write(f"{digest}  {file_name}\n")
+
+def forget_checksums(download_dir, file_names):
+    """Drop the lines for ``file_names`` from the checksum files, e.g. once those files are deleted."""
+    file_names = set(file_names)
+    for checksum_file in CHECKSUM_FILES.values():
+        path = os.path.join(download_dir, checksum_file)
+        if not os.path.exists(path):
+            continue
+        tmp_path = path + '.tmp'
+        with open(path, 'r', encoding='utf-8') as f, open(tmp_path, 'w', encoding='utf-8') as out:
+            for line in f:
+                if line.rstrip('\n').partition('  ')[2] not in file_names:
+                    out.write(line)
+        os.replace(tmp_path, path)
+
+def read_checksums(download_dir):
+    """Return ``{file_name: (algorithm, hexdigest)}`` from the checksum files in ``download_dir``."""
+    expected = {}
+    for algorithm, checksum_file in CHECKSUM_FILES.items():
+        path = os.path.join(download_dir, checksum_file)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                digest, sep, file_name = line.rstrip('\n').partition('  ')
+                if sep:
+                    # Later lines win, so a re-download supersedes the old entry
+                    expected[file_name] = (algorithm, digest)
+    return expected
+
+def _check_file(args):
+    path, algorithm, digest = args
+    if not os.path.exists(path):
+        return path, 'missing'
+    try:
+        return path, 'ok' if hash_file(path, algorithm) == digest else 'mismatch'
+    except OSError as e:
+        logging.error(f"Error reading {path}: {e}")
+        return path, 'unreadable'
+
+def verify_directory(download_dir, processes=None, on_result=None, move_bad=False):
+    """Re-hash every file recorded in ``download_dir``'s checksum files with a process pool.
+
+    ``on_result(path, status)`` is called as each file finishes, with ``status``
+    one of ``"ok"``, ``"mismatch"``, ``"missing"`` or ``"unreadable"``. Returns a
+    ``{status: count}`` summary. With ``move_bad`` mismatched files are quarantined.
+    """
+    jobs = [(os.path.join(download_dir, file_name), algorithm, digest)
+            for file_name, (algorithm, digest) in read_checksums(download_dir).items()]
+    # Largest files first so one huge archive doesn't finish the run on its own
+    jobs.sort(key=lambda job: os.path.getsize(job[0]) if os.path.exists(job[0]) else 0, reverse=True)
+    summary = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for path, status in executor.map(_check_file, jobs, chunksize=8):
+            summary[status] = summary.get(status, 0) + 1
+            if status == 'mismatch' and move_bad:
+                quarantine(path, download_dir, os.path.basename(path))
+            if on_result:
+                on_result(path, status)
+    return summary
@@ -0,0 +1,136 @@
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 512 << 20
+FILE_FIELDS = ('name', 'size', 'md5', 'sha1', 'format', 'source', 'mtime')
+
+def compact_metadata(metadata):
+    """Keep only what resolution needs from a metadata API response."""
+    item_metadata = metadata.get('metadata', {})
+    return {
+        'files': [{k: f[k] for k in FILE_FIELDS if k in f} for f in metadata.get('files', [])],
+        'metadata': {k: item_metadata[k] for k in ('title', 'description') if k in item_metadata},
+    }
+
+class CachedItem:
+    __slots__ = ('metadata', 'etag', 'last_modified', 'fresh')
+
+    def __init__(self, metadata, etag, last_modified, fresh):
+        self.metadata = metadata
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = fresh
+
+class ItemCache:
+    """On-disk cache of item metadata keyed by identifier.
+
+    Each item's full file listing is stored once, whatever file types it was
+    looked up for, and filtered at read time. Entries older than ``ttl`` are
+    returned as stale so the caller can revalidate them with ``ETag`` /
+    ``Last-Modified``; once the cache holds more than ``max_bytes`` of metadata
+    the least recently used entries are evicted. Only successful lookups are
+    stored. Safe to share between threads, and between processes through
+    SQLite's own locking.
+    """
+
+    def __init__(self, path='item_cache.sqlite3', ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS items (
+            identifier TEXT PRIMARY KEY,
+            metadata TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            size INTEGER NOT NULL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS items_accessed_at ON items (accessed_at)')
+        self.conn.commit()
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM items').fetchone()[0]
+
+    def get(self, identifier):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT metadata, etag, last_modified, fetched_at FROM items WHERE identifier = ?',
+                                    (identifier,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute('UPDATE items SET accessed_at = ? WHERE identifier = ?', (now, identifier))
+            self.conn.commit()
+            fresh = now - row[3] < self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+        return CachedItem(json.loads(row[0]), row[1], row[2], fresh)
+
+    def put(self, identifier, metadata, etag=None, last_modified=None):
+        data = json.dumps(compact_metadata(metadata), separators=(',', ':'))
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute('SELECT size FROM items WHERE identifier = ?', (identifier,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (identifier, data, etag, last_modified, now, now, len(data)))
+            self.total_bytes += len(data) - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def touch(self, identifier):
+        """Mark a stale entry fresh again after the server answered 304 Not Modified."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute('UPDATE items SET fetched_at = ?, accessed_at = ? WHERE identifier = ?',
+                              (now, now, identifier))
+            self.conn.commit()
+            self.revalidated += 1
+
+    def _evict(self):
+        # Drop least recently used entries down to 90% of the limit, so eviction isn't run on every put
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute('SELECT identifier, size FROM items ORDER BY accessed_at')
+        evicted = []
+        for identifier, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((identifier,))
+            self.total_bytes -= size
+        self.conn.executemany('DELETE FROM items WHERE identifier = ?', evicted)
+        self.evictions += len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM items')
+            self.conn.commit()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses + self.stale
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'revalidated': self.revalidated,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'bytes': self.total_bytes,
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,218 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from engine import FileRecord
+from selection import SelectionPolicy
+
+FLUSH_INTERVAL = 2.0
+FLUSH_ROWS = 1000
+# Jobs in any other state can be resumed
+FINISHED_STATES = ('complete',)
+# How jobs journaled before the search layout was recorded paged through results
+LEGACY_SEARCH_OPTIONS = {'rows': 100, 'prefilter': False}
+
+class Job:
+    __slots__ = ('id', 'search_params', 'file_types', 'options', 'state', 'page', 'cursor', 'created_at',
+                 'updated_at', 'resolved', 'files')
+
+    def __init__(self, id, search_params, file_types, options, state, page, cursor, created_at, updated_at,
+                 resolved=0, files=0):
+        self.id = id
+        self.search_params = search_params
+        self.file_types = file_types
+        self.options = options
+        self.state = state
+        self.page = page
+        self.cursor = cursor
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.resolved = resolved
+        self.files = files
+
+class JobJournal:
+    """SQLite journal of harvest jobs, so an interrupted harvest can carry on where it stopped.
+
+    For each job it keeps the query, the search page (or scrape cursor) up to
+    which every item has been resolved, the identifiers resolved so far, the
+    files they produced and each file's download state. ``Harvester`` and
+    ``DownloadManager`` report through ``item_resolved``, ``checkpoint`` and
+    ``file_state``; those calls only buffer, and the buffers are written in
+    one transaction every ``flush_interval`` seconds or ``flush_rows`` rows.
+    A checkpoint is always written together with the items it covers, so the
+    journal never claims a page whose items are missing.
+    """
+
+    def __init__(self, path='jobs.sqlite3', flush_interval=FLUSH_INTERVAL, flush_rows=FLUSH_ROWS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.lock = threading.Lock()
+        self.resolved = []
+        self.files = []
+        self.file_states = []
+        self.checkpoints = {}
+        self.last_flush = time.monotonic()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            search_params TEXT NOT NULL,
+            file_types TEXT NOT NULL,
+            options TEXT NOT NULL,
+            state TEXT NOT NULL,
+            page INTEGER NOT NULL DEFAULT 1,
+            cursor TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS resolved (
+            job_id TEXT NOT NULL,
+            identifier TEXT NOT NULL,
+            PRIMARY KEY (job_id, identifier)) WITHOUT ROWID''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS files (
+            job_id TEXT NOT NULL,
+            download_url TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            book_name TEXT,
+            file_size INTEGER,
+            description TEXT,
+            identifier TEXT,
+            md5 TEXT,
+            sha1 TEXT,
+            format TEXT,
+            source TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            PRIMARY KEY (job_id, download_url))''')
+        self.conn.commit()
+
+    def create(self, search_params, file_types, options=None):
+        job_id = uuid.uuid4().hex[:8]
+        now = time.time()
+        with self.lock:
+            self.conn.execute('INSERT INTO jobs (id, search_params, file_types, options, state, created_at, updated_at) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (job_id, json.dumps(search_params), json.dumps(list(file_types)),
+                               json.dumps(options or {}), 'running', now, now))
+            self.conn.commit()
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute('''SELECT id, search_params, file_types, options, state, page, cursor, created_at,
+                                       updated_at, (SELECT COUNT(*) FROM resolved WHERE job_id = jobs.id),
+                                       (SELECT COUNT(*) FROM files WHERE job_id = jobs.id)
+                                       FROM jobs WHERE id = ?''', (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def list(self):
+        with self.lock:
+            rows = self.conn.execute('''SELECT id, search_params, file_types, options, state, page, cursor, created_at,
+                                        updated_at, (SELECT COUNT(*) FROM resolved WHERE job_id = jobs.id),
+                                        (SELECT COUNT(*) FROM files WHERE job_id = jobs.id)
+                                        FROM jobs ORDER BY updated_at DESC''').fetchall()
+        return [self._job(row) for row in rows]
+
+    def delete(self, job_id):
+        """Forget ``job_id`` with everything journaled for it."""
+        self.flush()
+        with self.lock:
+            with self.conn:
+                for table, column in (('resolved', 'job_id'), ('files', 'job_id'), ('jobs', 'id')):
+                    self.conn.execute(f'DELETE FROM {table} WHERE {column} = ?', (job_id,))
+
+    def prune(self, origin, keep):
+        """Delete all but the ``keep`` most recently updated jobs started by ``origin`` (``options['origin']``)."""
+        jobs = [job for job in self.list() if job.options.get('origin') == origin]
+        for job in jobs[keep:]:
+            self.delete(job.id)
+        return len(jobs[keep:])
+
+    def latest_unfinished(self):
+        return next((job for job in self.list() if job.state not in FINISHED_STATES), None)
+
+    def _job(self, row):
+        return Job(row[0], json.loads(row[1]), json.loads(row[2]), json.loads(row[3]), *row[4:])
+
+    def harvester_options(self, job):
+        """Keyword arguments that make a ``Harvester`` continue ``job`` and report back to this journal."""
+        return {
+            # Page numbers only mean the same thing with the same page size and query
+            'rows': job.options.get('rows', LEGACY_SEARCH_OPTIONS['rows']),
+            'prefilter': job.options.get('prefilter', LEGACY_SEARCH_OPTIONS['prefilter']),
+            'start_page': job.page,
+            'start_cursor': job.cursor,
+            'skip_identifiers': self.resolved_identifiers(job.id),
+            'on_item': lambda identifier, records: self.item_resolved(job.id, identifier, records),
+            'on_checkpoint': lambda page, cursor: self.checkpoint(job.id, page, cursor),
+            'selection': SelectionPolicy.from_spec(job.options.get('selection')),
+        }
+
+    def resolved_identifiers(self, job_id):
+        with self.lock:
+            return {row[0] for row in self.conn.execute('SELECT identifier FROM resolved WHERE job_id = ?', (job_id,))}
+
+    def iter_files(self, job_id, exclude_states=()):
+        """Yield the job's files as ``FileRecord``s, skipping those whose download state is in ``exclude_states``."""
+        with self.lock:
+            rows = self.conn.execute('''SELECT file_name, book_name, download_url, file_size, description, identifier,
+                                        md5, sha1, format, source, state FROM files WHERE job_id = ?''',
+                                     (job_id,)).fetchall()
+        for row in rows:
+            if row[-1] not in exclude_states:
+                yield FileRecord(*row[:-1])
+
+    def item_resolved(self, job_id, identifier, records):
+        with self.lock:
+            self.resolved.append((job_id, identifier))
+            self.files.extend((job_id, r.download_url, r.file_name, r.book_name, r.file_size, r.description,
+                               r.identifier, r.md5, r.sha1, r.format, r.source) for r in records)
+        self.maybe_flush()
+
+    def checkpoint(self, job_id, page, cursor=None):
+        with self.lock:
+            self.checkpoints[job_id] = (page, cursor)
+        self.maybe_flush()
+
+    def file_state(self, job_id, download_url, state):
+        with self.lock:
+            self.file_states.append((state, job_id, download_url))
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        with self.lock:
+            buffered = len(self.resolved) + len(self.files) + len(self.file_states)
+            due = buffered >= self.flush_rows or time.monotonic() - self.last_flush > self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        now = time.time()
+        with self.lock:
+            self.last_flush = time.monotonic()
+            with self.conn:
+                self.conn.executemany('INSERT OR IGNORE INTO resolved VALUES (?, ?)', self.resolved)
+                self.conn.executemany('''INSERT OR IGNORE INTO files (job_id, download_url, file_name, book_name,
+                                         file_size, description, identifier, md5, sha1, format, source)
+                                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', self.files)
+                self.conn.executemany('UPDATE files SET state = ? WHERE job_id = ? AND download_url = ?',
+                                      self.file_states)
+                self.conn.executemany('UPDATE jobs SET page = ?, cursor = ?, updated_at = ? WHERE id = ?',
+                                      [(page, cursor, now, job_id) for job_id, (page, cursor) in self.checkpoints.items()])
+            self.resolved = []
+            self.files = []
+            self.file_states = []
+            self.checkpoints = {}
+
+    def set_state(self, job_id, state):
+        self.flush()
+        with self.lock:
+            self.conn.execute('UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?', (state, time.time(), job_id))
+            self.conn.commit()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,35 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+listener = None
+
+def configure_logging(level=logging.WARNING, format=LOG_FORMAT, stream=None):
+    """Send root-logger records through a queue to a background thread that formats and writes them.
+
+    Logging calls then only enqueue the record, so debug output doesn't hold
+    back the threads that produce it. The listener drains the queue at exit.
+    """
+    global listener
+    if listener is not None:
+        listener.stop()
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter(format))
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    return listener
+
+@atexit.register
+def stop_logging():
+    if listener is not None:
+        listener.stop()
@@ -0,0 +1,279 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from engine import has_exact_size
+
+MANIFEST_FILE = '.manifest.sqlite3'
+FLUSH_ROWS = 1000
+# Rows looked up per query; SQLite allows at most 999 parameters in older builds
+LOOKUP_BATCH = 500
+
+class ManifestEntry:
+    __slots__ = ('file_name', 'identifier', 'download_url', 'size', 'mtime', 'md5', 'sha1', 'synced_at')
+
+    def __init__(self, file_name, identifier, download_url, size, mtime, md5, sha1, synced_at):
+        self.file_name = file_name
+        self.identifier = identifier
+        self.download_url = download_url
+        self.size = size
+        self.mtime = mtime
+        self.md5 = md5
+        self.sha1 = sha1
+        self.synced_at = synced_at
+
+class SyncPlan:
+    """What a sync has to do: ``added``/``changed`` records to download, ``unchanged`` ones to leave alone."""
+
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.unchanged = []
+
+    @property
+    def downloads(self):
+        return self.added + self.changed
+
+    @property
+    def download_bytes(self):
+        return sum(record.file_size or 0 for record in self.downloads)
+
+def is_changed(entry, record):
+    """Whether the remote ``record`` differs from what ``entry`` says we hold; checksums decide when both sides have one."""
+    if record.md5 and entry.md5:
+        return record.md5 != entry.md5
+    if record.sha1 and entry.sha1:
+        return record.sha1 != entry.sha1
+    return bool(record.file_size) and has_exact_size(record) and record.file_size != entry.size
+
+class Manifest:
+    """SQLite index of the files held in a download directory, for syncing it without walking or hashing it.
+
+    One row per file: its name in the directory, the item and URL it came
+    from, its size and mtime when it was written, and the md5/sha1 that
+    archive.org published for it. ``plan`` diffs a fresh listing against the
+    index with primary-key lookups, so a sync costs the same however many
+    files the tree already holds. Writes are buffered and committed
+    ``flush_rows`` at a time.
+    """
+
+    def __init__(self, download_dir, name=MANIFEST_FILE, flush_rows=FLUSH_ROWS):
+        self.download_dir = download_dir
+        self.flush_rows = flush_rows
+        self.lock = threading.Lock()
+        self.pending = []
+        os.makedirs(download_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(download_dir, name), check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS files (
+            file_name TEXT PRIMARY KEY,
+            identifier TEXT,
+            download_url TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            md5 TEXT,
+            sha1 TEXT,
+            synced_at REAL NOT NULL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS files_identifier ON files (identifier)')
+        self.conn.commit()
+
+    def lookup(self, file_names):
+        """Return ``{file_name: ManifestEntry}`` for those of ``file_names`` in the manifest."""
+        self.flush()
+        file_names = list(file_names)
+        entries = {}
+        with self.lock:
+            for start in range(0, len(file_names), LOOKUP_BATCH):
+                batch = file_names[start:start + LOOKUP_BATCH]
+                rows = self.conn.execute(f'''SELECT file_name, identifier, download_url, size, mtime, md5, sha1, synced_at
+                                             FROM files WHERE file_name IN ({",".join("?" * len(batch))})''', batch)
+                for row in rows:
+                    entries[row[0]] = ManifestEntry(*row)
+        return entries
+
+    def plan(self, records, check_local=False):
+        """Sort a remote listing into a ``SyncPlan``.
+
+        With ``check_local`` every file the manifest calls unchanged is also
+        stat'ed, and one that is missing or no longer matches its recorded
+        size and mtime is fetched again.
+        """
+        plan = SyncPlan()
+        entries = self.lookup(record.file_name for record in records)
+        for record in records:
+            entry = entries.get(record.file_name)
+            if entry is None:
+                plan.added.append(record)
+            elif is_changed(entry, record) or (check_local and not self.is_intact(entry)):
+                plan.changed.append(record)
+            else:
+                plan.unchanged.append(record)
+        return plan
+
+    def is_intact(self, entry):
+        try:
+            stat = os.stat(os.path.join(self.download_dir, entry.file_name))
+        except FileNotFoundError:
+            return False
+        return stat.st_size == entry.size and stat.st_mtime == entry.mtime
+
+    def add(self, record):
+        """Record that ``record``'s file is now in the directory, as it is on disk right now."""
+        try:
+            stat = os.stat(os.path.join(self.download_dir, record.file_name))
+        except FileNotFoundError:
+            logging.warning(f"Not adding {record.file_name} to the manifest: it isn't in {self.download_dir}")
+            return
+        with self.lock:
+            self.pending.append((record.file_name, record.identifier, record.download_url, stat.st_size,
+                                 stat.st_mtime, record.md5, record.sha1, time.time()))
+            due = len(self.pending) >= self.flush_rows
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                with self.conn:
+                    self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self.pending)
+                self.pending = []
+
+    def stale(self, records, keep_identifiers=()):
+        """File names in the manifest that ``records`` (the complete remote listing) no longer has.
+
+        Files of items in ``keep_identifiers``, e.g. ones that couldn't be
+        resolved this time, are never stale.
+        """
+        self.flush()
+        with self.lock:
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS listed (file_name TEXT PRIMARY KEY)')
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS kept (identifier TEXT PRIMARY KEY)')
+            self.conn.execute('DELETE FROM listed')
+            self.conn.execute('DELETE FROM kept')
+            self.conn.executemany('INSERT OR IGNORE INTO listed VALUES (?)', ((r.file_name,) for r in records))
+            self.conn.executemany('INSERT OR IGNORE INTO kept VALUES (?)', ((i,) for i in keep_identifiers))
+            rows = self.conn.execute('''SELECT file_name FROM files WHERE file_name NOT IN (SELECT file_name FROM listed)
+                                        AND (identifier IS NULL OR identifier NOT IN (SELECT identifier FROM kept))''')
+            stale = [row[0] for row in rows]
+            self.conn.commit()
+        return stale
+
+    def remove(self, file_names):
+        self.flush()
+        with self.lock:
+            with self.conn:
+                self.conn.executemany('DELETE FROM files WHERE file_name = ?', ((name,) for name in file_names))
+
+    def count(self):
+        self.flush()
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def place(self, records, layout='flat'):
+        """``records`` renamed to where ``layout`` stores them in the directory, so they can be planned.
+
+        Under ``'flat'`` a name stays with the item holding it in the manifest,
+        or else with the first item listing it; the same name from any other
+        item moves into a folder named after that item.
+        """
+        from downloads import storage_name
+
+        if layout != 'flat':
+            return [record._replace(file_name=storage_name(record, layout)) for record in records]
+        held = {name: entry.identifier for name, entry in self.lookup(record.file_name for record in records).items()}
+        placed = []
+        for record in records:
+            owner = held.setdefault(record.file_name, record.identifier)
+            if owner and record.identifier and owner != record.identifier:
+                record = record._replace(file_name=storage_name(record, 'item'))
+            placed.append(record)
+        return placed
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
+
+def sync_files(download_dir, records, prune=False, keep_identifiers=(), check_local=False, dry_run=False,
+               on_progress=None, layout='flat', **download_options):
+    """Bring ``download_dir`` in line with ``records``, the current remote listing, and return what was done.
+
+    Only files the manifest doesn't hold yet or holds in another version are
+    downloaded; a changed file is replaced once its new version is complete.
+    With ``prune`` files the listing no longer has are deleted, except those
+    of ``keep_identifiers``; only prune with a listing that is known to be
+    complete. Files are stored as ``layout`` (see
+    ``downloads.LAYOUTS``) says. ``dry_run`` only plans. Returns a
+    ``{what: count}`` summary with ``added``, ``changed``, ``unchanged``,
+    ``pruned``, ``failed``, ``bytes`` (downloaded) and ``deduplicated`` (files
+    linked to a copy already stored).
+    """
+    import integrity
+    from downloads import DownloadManager, DownloadTask, forget_owners, release_object
+
+    manifest = Manifest(download_dir)
+    try:
+        records = manifest.place(records, layout)
+        plan = manifest.plan(records, check_local)
+        stale = manifest.stale(records, keep_identifiers) if prune else []
+        summary = {'added': len(plan.added), 'changed': len(plan.changed), 'unchanged': len(plan.unchanged),
+                   'pruned': len(stale), 'failed': 0, 'bytes': 0, 'deduplicated': 0}
+        if dry_run:
+            summary['bytes'] = plan.download_bytes
+            return summary
+        by_name = {}
+        # Stored objects are only dropped when nothing links to them, which only
+        # hard links can tell; a replaced file's old version is one of them
+        hard_links = layout == 'cas' and download_options.get('link', 'hard') == 'hard'
+        replaced = manifest.lookup(record.file_name for record in plan.changed) if hard_links else {}
+
+        def release(entry):
+            release_object(download_dir, *integrity.expected_checksum(entry.md5, entry.sha1))
+
+        def on_manager_progress(event, file_name, done, total):
+            # "skipped" only means the file is already complete (or linked to a stored copy); a download
+            # that failed is reported as "error" and leaves the manifest, and any older version, alone
+            if event in ('done', 'skipped') and file_name in by_name:
+                manifest.add(by_name[file_name])
+                if file_name in replaced and not os.path.islink(os.path.join(download_dir, file_name)):
+                    release(replaced[file_name])
+            if on_progress:
+                on_progress(event, file_name, done, total)
+
+        manager = DownloadManager(download_dir, on_progress=on_manager_progress, layout=layout, **download_options)
+        for downloads, replace in ((plan.added, False), (plan.changed, True)):
+            for record in downloads:
+                # Records already carry their place in the directory
+                task = DownloadTask.from_record(record)
+                task.replace = replace
+                task = manager.add(task)
+                by_name[task.file_name] = record._replace(file_name=task.file_name)
+        manager.save_queue()
+        manager.run()
+        summary['failed'] = sum(task.state in ('failed', 'error', 'pending') for task in manager.tasks.values())
+        summary['bytes'] = manager.bytes_downloaded
+        summary['deduplicated'] = manager.deduplicated
+        if stale and not manager.is_cancelled:
+            entries = manifest.lookup(stale) if hard_links else {}
+            for file_name in stale:
+                path = os.path.join(download_dir, file_name)
+                linked = os.path.islink(path)
+                try:
+                    os.remove(path)
+                    if os.path.dirname(file_name):
+                        # An item folder is removed with its last file
+                        os.rmdir(os.path.dirname(path))
+                except OSError:
+                    pass
+                if file_name in entries and not linked:
+                    release(entries[file_name])
+            manifest.remove(stale)
+            integrity.forget_checksums(download_dir, stale)
+            forget_owners(download_dir, stale)
+            logging.info(f"Pruned {len(stale)} files no longer listed from {download_dir}")
+        return summary
+    finally:
+        manifest.close()
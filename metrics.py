@@ -0,0 +1,270 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Upper bounds, in seconds, of the duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+TRACE_SPANS = 2000
+PREFIX = 'archive_scraper_'
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile (the largest value past the last bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+class Span:
+    __slots__ = ('registry', 'name', 'labels', 'trace', 'started', 'wall_started')
+
+    def __init__(self, registry, name, labels, trace):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.trace = trace
+
+    def __enter__(self):
+        self.wall_started = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        self.registry.observe(f"{self.name}_seconds", duration, **self.labels)
+        span = {'name': self.name, 'start': round(self.wall_started, 6), 'duration': round(duration, 6)}
+        span.update(self.labels)
+        if self.trace:
+            span.update(self.trace)
+        if exc_type is not None:
+            span['error'] = exc_type.__name__
+        self.registry.spans.append(span)
+
+class Registry:
+    """Counters, histograms and gauges for every pipeline stage, plus a ring buffer of recent timing spans.
+
+    Counters and histograms are keyed by name and labels. Gauges are read
+    through a callable only when a snapshot is taken, so a queue's depth
+    costs nothing between scrapes.
+    """
+
+    def __init__(self, trace_spans=TRACE_SPANS):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.spans = deque(maxlen=trace_spans)
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, read, **labels):
+        """Report ``read()`` as ``name``; registering the same name and labels again replaces it."""
+        with self.lock:
+            self.gauges[(name, label_key(labels))] = read
+
+    def span(self, name, trace=None, **labels):
+        """Time a block into the ``<name>_seconds`` histogram; ``trace`` fields only go to the span log."""
+        return Span(self, name, labels, trace)
+
+    def read_gauges(self):
+        with self.lock:
+            gauges = list(self.gauges.items())
+        values = {}
+        for key, read in gauges:
+            try:
+                values[key] = read()
+            except Exception:
+                continue
+        return values
+
+    def snapshot(self):
+        gauges = self.read_gauges()
+        with self.lock:
+            return {
+                'time': time.time(),
+                'uptime': time.time() - self.started,
+                'counters': [dict(key[1], name=key[0], value=value) for key, value in self.counters.items()],
+                'gauges': [dict(key[1], name=key[0], value=value) for key, value in gauges.items()],
+                'histograms': [dict(key[1], name=key[0], count=h.count, sum=round(h.sum, 6),
+                                    p50=h.quantile(0.5), p99=h.quantile(0.99))
+                               for key, h in self.histograms.items()],
+                'spans': list(self.spans),
+            }
+
+    def render_prometheus(self):
+        gauges = self.read_gauges()
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = [(key, list(h.buckets), list(h.counts), h.count, h.sum)
+                          for key, h in sorted(self.histograms.items(), key=lambda item: item[0])]
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+            lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} gauge")
+            lines.append(f"{PREFIX}{name}{format_labels(labels)} {float(value)}")
+        for (name, labels), buckets, counts, count, total in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f"{PREFIX}{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+def gauge(name, read, **labels):
+    registry.gauge(name, read, **labels)
+
+def span(name, trace=None, **labels):
+    return registry.span(name, trace, **labels)
+
+def serve(port, host='127.0.0.1'):
+    """Serve ``/metrics`` (Prometheus text format) and ``/metrics.json`` from a background thread."""
+    # Imported here: http.server is a sizeable import that most runs never need
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = registry.render_prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = json.dumps(registry.snapshot()).encode('utf-8'), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def counter_key(counter):
+    return tuple(sorted((name, str(value)) for name, value in counter.items() if name not in ('value', 'rate')))
+
+class JsonDumper(threading.Thread):
+    """Writes a snapshot to ``path`` every ``interval`` seconds, with per-second rates of every counter."""
+
+    def __init__(self, path, interval=10.0):
+        threading.Thread.__init__(self, daemon=True)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.previous = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        snapshot = registry.snapshot()
+        if self.previous is not None:
+            elapsed = snapshot['time'] - self.previous['time']
+            before = {counter_key(counter): counter['value'] for counter in self.previous['counters']}
+            for counter in snapshot['counters']:
+                delta = counter['value'] - before.get(counter_key(counter), 0)
+                counter['rate'] = round(delta / elapsed, 3) if elapsed > 0 else 0.0
+        self.previous = snapshot
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+
+    def stop(self):
+        self.stopped.set()
+        self.dump()
+
+def run_profiled(function, path):
+    """Run ``function`` under a profiler and write the profile to ``path``.
+
+    An ``.html`` path gets a pyinstrument report; anything else a cProfile
+    dump for ``pstats`` or snakeviz. Only the calling thread is profiled;
+    the spans show where worker threads spend their time.
+    """
+    # The profilers are only imported here, so that importing metrics stays cheap
+    if path.endswith('.html'):
+        try:
+            import pyinstrument
+        except ImportError:  # optional dependency, only needed for HTML profiles
+            raise RuntimeError("HTML profiles need pyinstrument: pip install pyinstrument")
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            return function()
+        finally:
+            profiler.stop()
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function)
+    finally:
+        profiler.dump_stats(path)
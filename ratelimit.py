@@ -0,0 +1,203 @@
+import threading
+import time
+from collections import deque
+
+import metrics
+
+RATE_WINDOW = 10  # seconds of history behind the observed request rate
+THROTTLE_STATUSES = {429, 503}
+
+class TokenBucket:
+    """Allows ``rate`` acquisitions per second on average and bursts of up to ``burst``; a rate of 0 means no limit."""
+
+    def __init__(self, rate, burst=None):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self.rate = rate
+            self.burst = burst or max(rate, 1)
+            self.tokens = min(self.tokens, self.burst)
+
+    def pause(self, seconds):
+        """Hand out nothing for ``seconds``, e.g. while the server's Retry-After runs."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif not self.rate:
+                    return
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class AimdLimit:
+    """Concurrency limit that grows additively while requests go well and halves when they don't.
+
+    Each healthy completion adds ``1 / limit``, so the limit rises by about one
+    per round of requests. A throttled response, an error or a latency above
+    ``latency_target`` multiplies it by ``decrease``, at most once per
+    ``cooldown`` seconds so one burst of failures counts as one signal.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=64, latency_target=None, decrease=0.5, cooldown=1.0):
+        self.condition = threading.Condition()
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.decreases = 0
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def record(self, outcome, latency=None):
+        with self.condition:
+            slow = self.latency_target is not None and latency is not None and latency > self.latency_target
+            if outcome == 'ok' and not slow:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                now = time.monotonic()
+                if now - self.last_decrease > self.cooldown:
+                    self.last_decrease = now
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.decreases += 1
+            self.condition.notify_all()
+
+class TrafficLimiter:
+    """Request budget for one kind of traffic: a token bucket for the rate and an AIMD limit for concurrency."""
+
+    def __init__(self, name, rate, burst=None, initial=4, minimum=1, maximum=64, latency_target=None):
+        self.name = name
+        self.enabled = True
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AimdLimit(initial, minimum, maximum, latency_target)
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def acquire_slot(self):
+        """Wait for a concurrency slot; returns whether one was taken, to pass on to ``release_slot``."""
+        if not self.enabled:
+            return False
+        self.concurrency.acquire()
+        return True
+
+    def release_slot(self, held):
+        if held:
+            self.concurrency.release()
+
+    def before_request(self, hold=True):
+        """Wait for a token and, with ``hold``, a concurrency slot; returns ``held`` for ``after_request``."""
+        held = self.acquire_slot() if hold else False
+        if self.enabled:
+            self.bucket.acquire()
+        second = int(time.monotonic())
+        with self.lock:
+            self.requests += 1
+            if self.recent and self.recent[-1][0] == second:
+                self.recent[-1][1] += 1
+            else:
+                self.recent.append([second, 1])
+            while self.recent[0][0] <= second - RATE_WINDOW:
+                self.recent.popleft()
+        return held
+
+    def after_request(self, outcome, latency=None, retry_after=None, held=True):
+        """Report how a request went: ``outcome`` is ``"ok"``, ``"throttled"`` or ``"error"``."""
+        self.release_slot(held)
+        with self.lock:
+            if outcome == 'throttled':
+                self.throttled += 1
+            elif outcome == 'error':
+                self.errors += 1
+        if outcome == 'throttled' and retry_after:
+            self.bucket.pause(retry_after)
+        self.concurrency.record(outcome, latency)
+
+    def observed_rate(self):
+        now = time.monotonic()
+        with self.lock:
+            recent = sum(count for second, count in self.recent if second > now - RATE_WINDOW)
+        return recent / RATE_WINDOW
+
+    def stats(self):
+        return {
+            'rate': self.bucket.rate,
+            'observed_rate': round(self.observed_rate(), 2),
+            'limit': int(self.concurrency.limit),
+            'in_flight': self.concurrency.in_flight,
+            'requests': self.requests,
+            'throttled': self.throttled,
+            'errors': self.errors,
+            'backoffs': self.concurrency.decreases,
+        }
+
+def outcome_for_status(status_code):
+    if status_code in THROTTLE_STATUSES:
+        return 'throttled'
+    return 'error' if status_code >= 500 else 'ok'
+
+# Budgets per kind of archive.org traffic; rates are requests per second
+limiters = {
+    'search': TrafficLimiter('search', rate=2, burst=4, initial=2, maximum=4, latency_target=30),
+    'metadata': TrafficLimiter('metadata', rate=20, burst=40, initial=8, minimum=2, maximum=64, latency_target=10),
+    'download': TrafficLimiter('download', rate=8, burst=16, initial=4, maximum=16),
+}
+
+def register_metrics():
+    for name, traffic_limiter in limiters.items():
+        metrics.gauge('ratelimit_concurrency_limit', lambda l=traffic_limiter: l.concurrency.limit, traffic=name)
+        metrics.gauge('ratelimit_in_flight', lambda l=traffic_limiter: l.concurrency.in_flight, traffic=name)
+        metrics.gauge('ratelimit_observed_rate', traffic_limiter.observed_rate, traffic=name)
+        metrics.gauge('ratelimit_throttled', lambda l=traffic_limiter: l.throttled, traffic=name)
+
+register_metrics()
+
+def limiter(traffic):
+    return limiters[traffic]
+
+def set_rate(traffic, rate):
+    limiters[traffic].bucket.set_rate(rate)
+
+def set_enabled(enabled):
+    """Switch every limit on or off, e.g. for benchmarks against a local server; counters keep running."""
+    for traffic_limiter in limiters.values():
+        traffic_limiter.enabled = enabled
+
+def stats():
+    return {name: traffic_limiter.stats() for name, traffic_limiter in limiters.items()}
+
+def summary():
+    """One line for a status bar, e.g. ``metadata 6/8 at 19.5/s``."""
+    return "  ".join(f"{name} {s['in_flight']}/{s['limit']} at {s['observed_rate']:.1f}/s"
+                     for name, s in stats().items())
@@ -0,0 +1,180 @@
+import re
+from array import array
+
+from engine import FileRecord, format_size
+
+TEXT_COLUMNS = ('file_name', 'book_name', 'download_url', 'description', 'identifier', 'md5', 'sha1', 'format', 'source')
+# Every file of an item carries the same values for these, so consecutive rows share one string object
+SHARED_COLUMNS = ('book_name', 'description', 'identifier', 'source')
+SEARCH_COLUMNS = ('file_name', 'book_name', 'description')
+TOKEN_RE = re.compile(r'\w+')
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.casefold()) if text else []
+
+class ResultModel:
+    """Search results held column by column, one list per field and sizes as a packed int array.
+
+    Rows are addressed by their index in the order they were added. A view
+    only ever asks for the few rows it shows, through ``display_values``;
+    ``record`` rebuilds the full ``FileRecord`` for downloads and exports.
+    ``sorted_rows`` returns a display order; the per-field ranking it is built
+    from is cached until more rows arrive.
+
+    Each file is stored once, keyed by its download URL (``find``). The
+    casefolded text ``filter_rows`` searches is only built the first time a
+    filter is used, then kept up to date as rows are added.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.columns = {name: [] for name in TEXT_COLUMNS}
+        self.file_size = array('q')
+        self.total_size = 0
+        self.ranks = {}
+        self.index = {}
+        self.search_runs = {}
+        self.indexed_rows = 0
+        self.term_cache = {}
+
+    def __len__(self):
+        return len(self.file_size)
+
+    def append(self, record):
+        self.extend((record,))
+
+    def extend(self, records):
+        index = self.index
+        new_records = []
+        for record in records:
+            if record.download_url not in index:
+                index[record.download_url] = len(self) + len(new_records)
+                new_records.append(record)
+        records = new_records
+        if not records:
+            return
+        fields = dict(zip(FileRecord._fields, zip(*records)))
+        for name in TEXT_COLUMNS:
+            column = self.columns[name]
+            if name in SHARED_COLUMNS:
+                previous = column[-1] if column else None
+                for value in fields[name]:
+                    if value != previous:
+                        previous = value
+                    column.append(previous)
+            else:
+                column.extend(fields[name])
+        sizes = fields['file_size']
+        self.file_size.extend(-1 if size is None else size for size in sizes)
+        self.total_size += sum(size or 0 for size in sizes)
+
+    def find(self, download_url):
+        return self.index.get(download_url)
+
+    def size(self, row):
+        size = self.file_size[row]
+        return None if size < 0 else size
+
+    def record(self, row):
+        columns = self.columns
+        return FileRecord(columns['file_name'][row], columns['book_name'][row], columns['download_url'][row],
+                          self.size(row), columns['description'][row], columns['identifier'][row],
+                          columns['md5'][row], columns['sha1'][row], columns['format'][row], columns['source'][row])
+
+    def records(self, rows=None):
+        for row in range(len(self)) if rows is None else rows:
+            yield self.record(row)
+
+    def display_values(self, row):
+        columns = self.columns
+        return (columns['file_name'][row], columns['book_name'][row], format_size(self.size(row) or 0),
+                columns['download_url'][row])
+
+    def sort_rank(self, field):
+        """Dense rank of every row by ``field``: sizes as numbers, text case-insensitively."""
+        cached = self.ranks.get(field)
+        if cached and cached[0] == len(self):
+            return cached[1], cached[2]
+        if field == 'file_size':
+            keys = self.file_size
+        else:
+            keys = [(value or '').casefold() for value in self.columns[field]]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        rank = array('l', bytes(array('l').itemsize * len(keys)))
+        current = 0
+        previous = None
+        for row in order:
+            if keys[row] != previous:
+                current += 1
+                previous = keys[row]
+            rank[row] = current
+        self.ranks[field] = (len(self), rank, order)
+        return rank, order
+
+    def sorted_rows(self, sort_fields):
+        """Rows ordered by ``sort_fields``, a list of ``(field, reverse)`` pairs, most significant first.
+
+        Ties keep the order the rows were found in.
+        """
+        if not sort_fields:
+            return None
+        if len(sort_fields) == 1:
+            field, reverse = sort_fields[0]
+            rank, order = self.sort_rank(field)
+            if not reverse:
+                return list(order)
+            return sorted(range(len(self)), key=rank.__getitem__, reverse=True)
+        ranks = [(self.sort_rank(field)[0], -1 if reverse else 1) for field, reverse in sort_fields]
+        return sorted(range(len(self)), key=lambda row: tuple(rank[row] * sign for rank, sign in ranks))
+
+    def update_search_index(self):
+        """Casefold the searchable text of rows added since the last filter, once per distinct string."""
+        for name in SEARCH_COLUMNS:
+            texts, starts = self.search_runs.setdefault(name, ([], array('l')))
+            column = self.columns[name]
+            last = column[self.indexed_rows - 1] if self.indexed_rows else None
+            for row in range(self.indexed_rows, len(self)):
+                value = column[row]
+                # Shared strings are the same object as the row before, so each item is searched once
+                if value is not last or not texts:
+                    texts.append((value or '').casefold())
+                    starts.append(row)
+                    last = value
+        if self.indexed_rows != len(self):
+            self.indexed_rows = len(self)
+            self.term_cache.clear()
+
+    def term_rows(self, term):
+        """Rows where ``term`` appears in the file name, title or description."""
+        cached = self.term_cache.get(term)
+        if cached is None:
+            # A longer term can only match text the shorter one matched, which keeps typing cheap
+            narrower = self.term_cache.get(term[:-1]) or self.term_cache.get(term[1:])
+            runs = {}
+            rows = set()
+            for name, (texts, starts) in self.search_runs.items():
+                candidates = narrower[0][name] if narrower else range(len(texts))
+                runs[name] = matched = [i for i in candidates if term in texts[i]]
+                for i in matched:
+                    end = starts[i + 1] if i + 1 < len(starts) else len(self)
+                    rows.update(range(starts[i], end))
+            cached = self.term_cache[term] = (runs, rows)
+        return cached[1]
+
+    def filter_rows(self, text, rows=None):
+        """Rows (of ``rows``, in that order, or of the whole model) matching every word of ``text``."""
+        terms = tokenize(text)
+        if not terms:
+            return rows
+        self.update_search_index()
+        matches = None
+        for term in sorted(set(terms), key=len, reverse=True):
+            term_matches = self.term_rows(term)
+            matches = set(term_matches) if matches is None else matches & term_matches
+            if not matches:
+                break
+        if rows is None:
+            return sorted(matches)
+        return [row for row in rows if row in matches]
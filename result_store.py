@@ -0,0 +1,206 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from engine import FileRecord
+
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_MAX_ROWS = 2_000_000
+SEARCH_FIELDS = ('language', 'start_year', 'end_year', 'keyword', 'author')
+
+def normalize_query(search_params, file_types, selection=None):
+    """Return ``(key, params)`` for a search, identical for every spelling of the same query.
+
+    A ``selection`` policy keeps a different subset of the files, so it is part
+    of the key; searches without one keep the keys they always had.
+    """
+    params = {}
+    for field in SEARCH_FIELDS:
+        value = ' '.join(str(search_params.get(field) or '').split())
+        if value:
+            params[field] = value.lower()
+    params['file_types'] = sorted({ft.strip().lower().lstrip('.') for ft in file_types if ft.strip()})
+    if selection:
+        params['selection'] = selection.spec()
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+    return key, params
+
+class SearchEntry:
+    __slots__ = ('key', 'params', 'complete', 'created_at', 'updated_at', 'last_run', 'count')
+
+    def __init__(self, key, params, complete, created_at, updated_at, last_run, count):
+        self.key = key
+        self.params = params
+        self.complete = complete
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.last_run = last_run
+        self.count = count
+
+class ResultWriter:
+    """Buffers records for one search and writes them to the store in batches."""
+
+    def __init__(self, store, key, batch_size=200):
+        self.store = store
+        self.key = key
+        self.batch_size = batch_size
+        self.pending = []
+
+    def add(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.store.add(self.key, self.pending)
+            self.pending = []
+
+    def close(self, complete=True, run_started=None):
+        self.flush()
+        if complete:
+            self.store.finish(self.key, run_started)
+
+class ResultStore:
+    """SQLite store of search results, one row per file.
+
+    Searches are keyed by ``normalize_query``. Rows are kept in the order they
+    were found and can be read back a batch at a time with ``iter_records``,
+    so a cached search streams into the UI or an exporter without loading
+    whole. ``refresh_params`` turns a finished search into one that only asks
+    for items added since its last run. Searches older than ``ttl`` are
+    dropped, as are the least recently updated ones once the store holds more
+    than ``max_rows`` files. Each thread gets its own connection and SQLite's
+    WAL locking keeps several processes safe.
+    """
+
+    def __init__(self, path='search_results.sqlite3', ttl=DEFAULT_TTL, max_rows=DEFAULT_MAX_ROWS):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS searches (
+                key TEXT PRIMARY KEY,
+                params TEXT NOT NULL,
+                complete INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                last_run REAL,
+                count INTEGER NOT NULL DEFAULT 0)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                book_name TEXT,
+                download_url TEXT NOT NULL,
+                file_size INTEGER,
+                description TEXT,
+                identifier TEXT,
+                md5 TEXT,
+                sha1 TEXT,
+                format TEXT,
+                source TEXT,
+                UNIQUE (key, download_url))''')
+            conn.execute('CREATE INDEX IF NOT EXISTS results_key_id ON results (key, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS searches_updated_at ON searches (updated_at)')
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def lookup(self, search_params, file_types, selection=None):
+        key, _ = normalize_query(search_params, file_types, selection)
+        row = self.connection().execute(
+            'SELECT key, params, complete, created_at, updated_at, last_run, count FROM searches WHERE key = ?',
+            (key,)).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[4] > self.ttl:
+            self.delete(key)
+            return None
+        return SearchEntry(row[0], json.loads(row[1]), bool(row[2]), row[3], row[4], row[5], row[6])
+
+    def begin(self, search_params, file_types, incremental=False, selection=None):
+        """Start (or, with ``incremental``, continue) storing a search; returns its key."""
+        key, params = normalize_query(search_params, file_types, selection)
+        now = time.time()
+        with self.connection() as conn:
+            if not incremental:
+                conn.execute('DELETE FROM results WHERE key = ?', (key,))
+                conn.execute('DELETE FROM searches WHERE key = ?', (key,))
+            conn.execute('INSERT OR IGNORE INTO searches (key, params, created_at, updated_at) VALUES (?, ?, ?, ?)',
+                         (key, json.dumps(params), now, now))
+            conn.execute('UPDATE searches SET complete = 0, updated_at = ? WHERE key = ?', (now, key))
+        return key
+
+    def writer(self, key, batch_size=200):
+        return ResultWriter(self, key, batch_size)
+
+    def add(self, key, records):
+        rows = [(key, r.file_name, r.book_name, r.download_url, r.file_size, r.description,
+                 r.identifier, r.md5, r.sha1, r.format, r.source) for r in records]
+        with self.connection() as conn:
+            before = conn.total_changes
+            conn.executemany('''INSERT OR IGNORE INTO results (key, file_name, book_name, download_url, file_size,
+                                description, identifier, md5, sha1, format, source)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+            added = conn.total_changes - before
+            conn.execute('UPDATE searches SET count = count + ?, updated_at = ? WHERE key = ?',
+                         (added, time.time(), key))
+        return added
+
+    def finish(self, key, run_started=None):
+        with self.connection() as conn:
+            conn.execute('UPDATE searches SET complete = 1, last_run = ?, updated_at = ? WHERE key = ?',
+                         (run_started or time.time(), time.time(), key))
+        self.expire()
+
+    def iter_records(self, key, batch_size=1000):
+        """Yield the stored records of a search as lists of ``FileRecord``, in the order found."""
+        last_id = 0
+        conn = self.connection()
+        while True:
+            rows = conn.execute('''SELECT id, file_name, book_name, download_url, file_size, description,
+                                   identifier, md5, sha1, format, source FROM results
+                                   WHERE key = ? AND id > ? ORDER BY id LIMIT ?''',
+                                (key, last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [FileRecord(*row[1:]) for row in rows]
+
+    def refresh_params(self, entry):
+        """Search params that fetch only the items added since ``entry`` last ran."""
+        params = {k: v for k, v in entry.params.items() if k not in ('file_types', 'selection')}
+        if entry.last_run:
+            # addeddate only has day precision; rows already stored are ignored on insert
+            since = datetime.datetime.fromtimestamp(entry.last_run, datetime.timezone.utc) - datetime.timedelta(days=1)
+            params['added_since'] = since.strftime('%Y-%m-%d')
+        return params
+
+    def delete(self, key):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            conn.execute('DELETE FROM searches WHERE key = ?', (key,))
+
+    def expire(self):
+        with self.connection() as conn:
+            expired = conn.execute('SELECT key FROM searches WHERE updated_at < ?', (time.time() - self.ttl,)).fetchall()
+            total = conn.execute('SELECT COALESCE(SUM(count), 0) FROM searches').fetchone()[0]
+            if total > self.max_rows:
+                for key, count in conn.execute('SELECT key, count FROM searches ORDER BY updated_at').fetchall():
+                    if total <= self.max_rows:
+                        break
+                    expired.append((key,))
+                    total -= count
+            conn.executemany('DELETE FROM results WHERE key = ?', expired)
+            conn.executemany('DELETE FROM searches WHERE key = ?', expired)
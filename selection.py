@@ -0,0 +1,72 @@
+import os
+
+# How a policy treats archive.org's ``source`` field: keep originals and
+# derivatives alike, keep derivatives only when a format has no original, or
+# drop derivatives outright
+SOURCES = ('any', 'prefer-original', 'original')
+
+def file_type(file_name):
+    return os.path.splitext(file_name)[1].lower().lstrip('.')
+
+def is_derivative(record):
+    # Scraped records don't know their source; they're given the benefit of the doubt
+    return record.source is not None and record.source != 'original'
+
+class SelectionPolicy:
+    """Which of an item's matching files are worth downloading.
+
+    archive.org derives EPUB, PDF, DjVu and text versions from most uploads,
+    so an item matching several file types usually holds the same book
+    several times over. ``prefer`` ranks file types, best first: of the types
+    it lists only the best one the item has is kept (all of its files, for
+    multi-volume items), while files of types it doesn't list are kept as
+    before. ``source`` is one of ``SOURCES``; with ``'prefer-original'`` an
+    uploaded file beats a derivative, even one of a better-ranked type. Files
+    over ``max_size`` bytes are dropped before anything is ranked, so an
+    oversized EPUB gives way to the PDF. Files of unknown size always pass.
+    """
+
+    def __init__(self, prefer=(), source='any', max_size=None):
+        if source not in SOURCES:
+            raise ValueError(f"source must be one of {', '.join(SOURCES)}, not {source!r}")
+        self.prefer = [ft.strip().lower().lstrip('.') for ft in prefer if ft.strip()]
+        self.source = source
+        self.max_size = max_size or None
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(**spec) if spec else None
+
+    def spec(self):
+        """The policy as a plain dict, for job options and result store keys."""
+        return {'prefer': self.prefer, 'source': self.source, 'max_size': self.max_size}
+
+    def __bool__(self):
+        return bool(self.prefer) or self.source != 'any' or self.max_size is not None
+
+    def allows(self, record):
+        if self.max_size is not None and (record.file_size or 0) > self.max_size:
+            return False
+        return self.source != 'original' or not is_derivative(record)
+
+    def select(self, records):
+        """Split one item's ``records`` into ``(kept, dropped)``, both in their original order."""
+        candidates = [record for record in records if self.allows(record)]
+        by_type = {}
+        for record in candidates:
+            by_type.setdefault(file_type(record.file_name), []).append(record)
+        if self.prefer:
+            ranked = [ft for ft in self.prefer if ft in by_type]
+            if self.source == 'prefer-original':
+                with_original = [ft for ft in ranked if not all(is_derivative(r) for r in by_type[ft])]
+                ranked = with_original + [ft for ft in ranked if ft not in with_original]
+            for ft in ranked[1:]:
+                del by_type[ft]
+        if self.source == 'prefer-original':
+            for ft, group in by_type.items():
+                originals = [record for record in group if not is_derivative(record)]
+                by_type[ft] = originals or group
+        keep = {id(record) for group in by_type.values() for record in group}
+        kept = [record for record in records if id(record) in keep]
+        dropped = [record for record in records if id(record) not in keep]
+        return kept, dropped
@@ -0,0 +1,325 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+DEFAULT_SHARD_SIZE = 500
+DEFAULT_LEASE = 300.0
+MAX_ATTEMPTS = 3
+# A shard is 'pending' until claimed, then 'claimed' until it ends up 'done' or,
+# after MAX_ATTEMPTS tries that left items unresolved or files undownloaded, 'failed'
+SHARD_STATES = ('pending', 'claimed', 'done', 'failed')
+
+def read_identifiers(path):
+    """Identifiers from a file with one per line (``-`` for stdin); blank lines and ``#`` comments are skipped."""
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        for line in f:
+            identifier = line.split('#', 1)[0].strip()
+            if identifier:
+                yield identifier
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class Shard:
+    __slots__ = ('batch_id', 'number', 'identifiers', 'attempts')
+
+    def __init__(self, batch_id, number, identifiers, attempts):
+        self.batch_id = batch_id
+        self.number = number
+        self.identifiers = identifiers
+        self.attempts = attempts
+
+class Batch:
+    __slots__ = ('id', 'source', 'file_types', 'shard_size', 'created_at', 'shards', 'items', 'files', 'bytes')
+
+    def __init__(self, id, source, file_types, shard_size, created_at, shards=None, items=0, files=0, bytes=0):
+        self.id = id
+        self.source = source
+        self.file_types = file_types
+        self.shard_size = shard_size
+        self.created_at = created_at
+        # State -> number of shards in it
+        self.shards = shards or {}
+        self.items = items
+        self.files = files
+        self.bytes = bytes
+
+    @property
+    def finished(self):
+        return not (self.shards.get('pending') or self.shards.get('claimed'))
+
+class ShardQueue:
+    """SQLite work queue handing out the shards of bulk harvests to workers, in any number of processes.
+
+    A batch is a list of identifiers cut into shards of ``shard_size``. A
+    worker ``claim``s a shard, which leases it for ``lease`` seconds;
+    ``heartbeat`` renews the lease while the worker is busy and ``finish``
+    records the outcome. A shard that failed in part goes back to the queue
+    until it has been tried ``max_attempts`` times; one whose worker died is
+    handed out again once its lease runs out. Claims happen inside
+    ``BEGIN IMMEDIATE`` transactions, so no two workers ever hold the same
+    shard. Several machines can share one coordinator file on a filesystem
+    with working locks.
+    """
+
+    def __init__(self, path='shards.sqlite3', lease=DEFAULT_LEASE, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60, isolation_level=None)
+        # Not WAL: its shared-memory index only works on one machine, and the
+        # queue sees a few writes per shard, not per item
+        self.conn.execute('PRAGMA journal_mode=DELETE')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS batches (
+            id TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            file_types TEXT NOT NULL,
+            shard_size INTEGER NOT NULL,
+            created_at REAL NOT NULL)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS shards (
+            batch_id TEXT NOT NULL,
+            number INTEGER NOT NULL,
+            identifiers TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            lease_until REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            items INTEGER NOT NULL DEFAULT 0,
+            files INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            failed TEXT,
+            updated_at REAL,
+            PRIMARY KEY (batch_id, number))''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS shards_state ON shards (batch_id, state)')
+
+    def create(self, source, identifiers, file_types, shard_size=DEFAULT_SHARD_SIZE):
+        """Queue ``identifiers`` (any iterable; duplicates are dropped) as a new batch and return its id."""
+        batch_id = uuid.uuid4().hex[:8]
+        seen = set()
+        shard = []
+        number = 0
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute('INSERT INTO batches VALUES (?, ?, ?, ?, ?)',
+                                  (batch_id, source, json.dumps(list(file_types)), shard_size, time.time()))
+                for identifier in identifiers:
+                    if identifier in seen:
+                        continue
+                    seen.add(identifier)
+                    shard.append(identifier)
+                    if len(shard) == shard_size:
+                        self._insert_shard(batch_id, number, shard)
+                        number, shard = number + 1, []
+                if shard:
+                    self._insert_shard(batch_id, number, shard)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        return batch_id
+
+    def _insert_shard(self, batch_id, number, identifiers):
+        self.conn.execute('INSERT INTO shards (batch_id, number, identifiers) VALUES (?, ?, ?)',
+                          (batch_id, number, json.dumps(identifiers)))
+
+    def batch(self, batch_id):
+        with self.lock:
+            row = self.conn.execute('SELECT id, source, file_types, shard_size, created_at FROM batches WHERE id = ?',
+                                    (batch_id,)).fetchone()
+            if row is None:
+                return None
+            return self._batch(row)
+
+    def list(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT id, source, file_types, shard_size, created_at FROM batches '
+                                     'ORDER BY created_at DESC').fetchall()
+            return [self._batch(row) for row in rows]
+
+    def _batch(self, row):
+        batch = Batch(row[0], row[1], json.loads(row[2]), row[3], row[4])
+        for state, count, items, files, size in self.conn.execute(
+                'SELECT state, COUNT(*), SUM(items), SUM(files), SUM(bytes) FROM shards WHERE batch_id = ? '
+                'GROUP BY state', (batch.id,)):
+            batch.shards[state] = count
+            batch.items += items
+            batch.files += files
+            batch.bytes += size
+        return batch
+
+    def claim(self, batch_id, worker):
+        """Lease the next pending (or abandoned) shard of ``batch_id`` to ``worker``; None when none is left."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute('''SELECT number, identifiers, attempts FROM shards WHERE batch_id = ?
+                                           AND (state = 'pending' OR (state = 'claimed' AND lease_until < ?))
+                                           ORDER BY number LIMIT 1''', (batch_id, now)).fetchone()
+                if row is not None:
+                    self.conn.execute('''UPDATE shards SET state = 'claimed', worker = ?, lease_until = ?,
+                                         attempts = attempts + 1, updated_at = ? WHERE batch_id = ? AND number = ?''',
+                                      (worker, now + self.lease, now, batch_id, row[0]))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return Shard(batch_id, row[0], json.loads(row[1]), row[2] + 1)
+
+    def heartbeat(self, shard, worker):
+        """Renew ``worker``'s lease on ``shard``; returns False if it was lost to another worker."""
+        with self.lock:
+            cursor = self.conn.execute('''UPDATE shards SET lease_until = ? WHERE batch_id = ? AND number = ?
+                                          AND worker = ? AND state = 'claimed' ''',
+                                       (time.time() + self.lease, shard.batch_id, shard.number, worker))
+            return cursor.rowcount == 1
+
+    def finish(self, shard, worker, items=0, files=0, size=0, failed=()):
+        """Record a processed shard: done, or back in the queue (failed after ``max_attempts``) if ``failed`` lists items.
+
+        Returns the shard's new state, or None if ``worker`` no longer held it.
+        """
+        if not failed:
+            state = 'done'
+        else:
+            state = 'failed' if shard.attempts >= self.max_attempts else 'pending'
+        with self.lock:
+            cursor = self.conn.execute('''UPDATE shards SET state = ?, worker = NULL, lease_until = NULL, items = ?,
+                                          files = ?, bytes = bytes + ?, failed = ?, updated_at = ?
+                                          WHERE batch_id = ? AND number = ? AND worker = ?''',
+                                       (state, items, files, size, json.dumps(list(failed)) if failed else None,
+                                        time.time(), shard.batch_id, shard.number, worker))
+        return state if cursor.rowcount == 1 else None
+
+    def release(self, shard, worker):
+        """Hand an unfinished shard back without counting the attempt, e.g. when the worker is interrupted."""
+        with self.lock:
+            self.conn.execute('''UPDATE shards SET state = 'pending', worker = NULL, lease_until = NULL,
+                                 attempts = attempts - 1, updated_at = ? WHERE batch_id = ? AND number = ?
+                                 AND worker = ? AND state = 'claimed' ''',
+                              (time.time(), shard.batch_id, shard.number, worker))
+
+    def retry_failed(self, batch_id):
+        with self.lock:
+            cursor = self.conn.execute('''UPDATE shards SET state = 'pending', attempts = 0, updated_at = ?
+                                          WHERE batch_id = ? AND state = 'failed' ''', (time.time(), batch_id))
+            return cursor.rowcount
+
+    def failed_identifiers(self, batch_id):
+        with self.lock:
+            rows = self.conn.execute('SELECT failed FROM shards WHERE batch_id = ? AND failed IS NOT NULL',
+                                     (batch_id,)).fetchall()
+        return [identifier for row in rows for identifier in json.loads(row[0])]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class Heartbeat(threading.Thread):
+    """Renews a shard's lease every third of the lease period until stopped; ``lost`` is set if the lease was taken over."""
+
+    def __init__(self, queue, shard, worker):
+        threading.Thread.__init__(self, daemon=True)
+        self.queue = queue
+        self.shard = shard
+        self.worker = worker
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease / 3):
+            try:
+                if not self.queue.heartbeat(self.shard, self.worker):
+                    self.lost.set()
+                    return
+            except sqlite3.Error as e:
+                logging.warning(f"Could not renew the lease on shard {self.shard.number}: {e}")
+
+    def stop(self):
+        self.stopped.set()
+
+class ShardWorker:
+    """Claims shards of one batch until none are left, resolving each one's items and downloading their files.
+
+    Items are resolved by a ``Harvester`` given the shard's identifiers and
+    files fetched by a ``DownloadManager`` into ``download_dir`` (if set),
+    with a queue file of its own for the shard, so an interrupted shard's
+    downloads resume wherever it is picked up again. A retried shard is
+    resolved and downloaded as a whole once more, which the item cache and
+    the manager's skipping of complete files make cheap. Items that couldn't
+    be resolved and files that couldn't be downloaded are reported to the
+    queue as failures.
+    """
+
+    def __init__(self, queue, batch, download_dir=None, worker=None, harvester_options=None, download_options=None,
+                 on_shard=None):
+        self.queue = queue
+        self.batch = batch
+        self.download_dir = download_dir
+        self.worker = worker or worker_name()
+        self.harvester_options = harvester_options or {}
+        self.download_options = download_options or {}
+        # on_shard(shard, state, items, files) after each shard
+        self.on_shard = on_shard
+        self.shards_done = 0
+
+    def run(self):
+        while True:
+            shard = self.queue.claim(self.batch.id, self.worker)
+            if shard is None:
+                return self.shards_done
+            try:
+                self.process(shard)
+            except BaseException:
+                self.queue.release(shard, self.worker)
+                raise
+
+    def process(self, shard):
+        from downloads import FINISHED_STATES, DownloadManager
+        from engine import Harvester
+
+        heartbeat = Heartbeat(self.queue, shard, self.worker)
+        heartbeat.start()
+        records = []
+        harvester = Harvester({}, self.batch.file_types, on_file=records.append, identifiers=shard.identifiers,
+                              **self.harvester_options)
+        try:
+            harvester.run()
+            # Identifier (or, for scraped items, file name) -> None; a dict keeps them unique and in order
+            failed = dict.fromkeys(harvester.failed_items)
+            size = 0
+            if self.download_dir and records and not heartbeat.lost.is_set():
+                queue_name = f".download_queue.{shard.batch_id}-{shard.number}.json"
+                manager = DownloadManager(self.download_dir, queue_name=queue_name, **self.download_options)
+                manager.add_records(records)
+                manager.run()
+                size = manager.bytes_downloaded
+                for task in manager.tasks.values():
+                    if task.state not in FINISHED_STATES:
+                        # Tasks go by where they're stored, which needn't be the record's file name
+                        failed[task.identifier or task.file_name] = None
+        finally:
+            heartbeat.stop()
+        state = None
+        if not heartbeat.lost.is_set():
+            state = self.queue.finish(shard, self.worker, harvester.total_items, len(records), size, list(failed))
+        if state is None:
+            logging.warning(f"Lost the lease on shard {shard.number} of batch {shard.batch_id}; its outcome is dropped")
+            return
+        self.shards_done += 1
+        if self.on_shard:
+            self.on_shard(shard, state, harvester.total_items, len(records))
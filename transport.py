@@ -0,0 +1,177 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import ratelimit
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT = (10, 60)  # (connect, read) seconds
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+class HttpClient:
+    """One pooled keep-alive session shared by every fetch, with timeouts and retries.
+
+    Requests that fail with a connection error, a timeout or one of
+    ``RETRY_STATUSES`` are retried up to ``max_retries`` times with exponential
+    backoff and full jitter, waiting at least as long as ``Retry-After`` asks.
+
+    With ``traffic`` (``"search"``, ``"metadata"`` or ``"download"``) every
+    attempt also waits for that budget in ``ratelimit`` and reports back how it
+    went. Streamed requests only take a token: their caller holds a concurrency
+    slot for the whole transfer. Latency, status, bytes and retries are
+    recorded in ``metrics`` per kind of traffic; streamed bodies are counted
+    by whoever reads them.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, max_retries=5,
+                 backoff_factor=0.5, max_backoff=60.0):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.pool_size = 0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        # Counts of the pools replaced by ensure_pool_size
+        self.retired_handshakes = 0
+        self.retired_requests = 0
+        self.adapter = None
+        self.session = requests.Session()
+        self.ensure_pool_size(pool_size)
+
+    def ensure_pool_size(self, pool_size):
+        with self.lock:
+            if pool_size <= self.pool_size:
+                return
+            self.pool_size = pool_size
+            old_adapter = self.adapter
+            self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False)
+            self.session.mount('https://', self.adapter)
+            self.session.mount('http://', self.adapter)
+        if old_adapter is not None:
+            # Keep what the old pools counted, then drop their idle connections; ones in use are
+            # closed as they are returned
+            handshakes, pooled_requests = self._pool_counts(old_adapter)
+            with self.lock:
+                self.retired_handshakes += handshakes
+                self.retired_requests += pooled_requests
+            old_adapter.close()
+
+    @staticmethod
+    def _pool_counts(adapter):
+        """``(handshakes, requests)`` over ``adapter``'s connection pools."""
+        handshakes = pooled_requests = 0
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                handshakes += pool.num_connections
+                pooled_requests += pool.num_requests
+        return handshakes, pooled_requests
+
+    def backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+    def get(self, url, traffic=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        limiter = ratelimit.limiter(traffic) if traffic else None
+        hold = not kwargs.get('stream')
+        held = False
+        label = traffic or 'other'
+        attempt = 0
+        while True:
+            with self.lock:
+                self.requests += 1
+            if limiter:
+                held = limiter.before_request(hold)
+            started = time.monotonic()
+            try:
+                response = self.session.get(url, **kwargs)
+            except Exception as e:
+                if limiter:
+                    limiter.after_request('error', held=held)
+                metrics.inc('http_requests_total', traffic=label, status='error')
+                if not isinstance(e, RETRY_EXCEPTIONS):
+                    raise
+                if attempt >= self.max_retries:
+                    with self.lock:
+                        self.failures += 1
+                    raise
+                delay = self.backoff(attempt)
+                logging.warning(f"{type(e).__name__} for {url}, retrying in {delay:.1f}s")
+            else:
+                latency = time.monotonic() - started
+                if limiter:
+                    limiter.after_request(ratelimit.outcome_for_status(response.status_code), latency,
+                                          parse_retry_after(response.headers.get('Retry-After')), held=held)
+                metrics.observe('http_request_seconds', latency, traffic=label)
+                metrics.inc('http_requests_total', traffic=label, status=response.status_code)
+                if hold:
+                    metrics.inc('http_bytes_total', len(response.content), traffic=label)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    if response.status_code >= 400:
+                        with self.lock:
+                            self.failures += 1
+                    return response
+                delay = self.backoff(attempt, response)
+                logging.warning(f"HTTP {response.status_code} for {url}, retrying in {delay:.1f}s")
+                response.close()
+            with self.lock:
+                self.retries += 1
+            metrics.inc('http_retries_total', traffic=label)
+            attempt += 1
+            time.sleep(delay)
+
+    def stats(self):
+        handshakes, pooled_requests = self._pool_counts(self.adapter)
+        with self.lock:
+            handshakes += self.retired_handshakes
+            pooled_requests += self.retired_requests
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures,
+                'handshakes': handshakes,
+                'pool_hits': max(pooled_requests - handshakes, 0),
+                'pool_size': self.pool_size,
+            }
+
+_client = None
+_client_lock = threading.Lock()
+
+def default_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+def get(url, traffic=None, **kwargs):
+    return default_client().get(url, traffic, **kwargs)